@@ -0,0 +1,426 @@
+"""
+This module contains the local HTTP/JSON API of the SuperPy commandline
+tool. It offers the same operations as the buy, sell, inventory and
+report commands to tills and dashboards:
+- GET /date returns the current date
+- POST /buy stores one purchase or a list of purchases
+- POST /sell sells one product or a list of products
+- GET /inventory lists the products in stock (optionally by count)
+- GET /report returns sales, costs, revenue or profit for a date or for
+  each period in a range of dates
+All requests share one in-memory state, which is only accessed by a
+single worker thread, so that writes never interleave.
+"""
+
+# Imports
+import argparse
+import asyncio
+import json
+import storage
+import superpy as sp
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+REASONS = {
+    200: 'OK',
+    201: 'Created',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    409: 'Conflict',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class ApiError(Exception):
+    """An error that is sent to the client with the given status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Functions handling the requests
+def get_query_value(query, name, default=None):
+    """Return the last value of a query parameter, or default."""
+    return query.get(name, [default])[-1]
+
+
+def get_query_flag(query, name):
+    """Check if a query parameter is set to a true value, e.g. ?count=1."""
+    return get_query_value(query, name, '').lower() in ('1', 'true', 'yes')
+
+
+def check_date(date, name):
+    """Return date if it is in YYYY-MM-DD format, otherwise raise ApiError."""
+    try:
+        return datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ApiError(400, f'invalid {name} {date!r}')
+
+
+def get_items(body):
+    """Return the items of a request body holding an object or a list."""
+    if isinstance(body, dict):
+        return [body]
+    if isinstance(body, list) and body:
+        return body
+    raise ApiError(400, 'body must be a JSON object or a list of objects')
+
+
+def show_date(query, body):
+    """Return the current date."""
+    return 200, {'date': sp.current_store().date()}
+
+
+def buy(query, body):
+    """Store every purchase in the request body.
+
+    Parameters
+    ----------
+    query : dict
+        The query parameters of the request (unused).
+    body : dict or list
+        A purchase or a list of purchases with the fields accepted by
+        superpy.parse_purchase.
+
+    Returns
+    -------
+    status : int
+        201 once all products have been stored.
+    response : dict
+        The number of products that have been added. Nothing is stored
+        if any of the purchases is invalid.
+    """
+    try:
+        products = sp.current_store().buy_many(get_items(body))
+    except ValueError as error:
+        raise ApiError(400, str(error))
+    return 201, {'added': len(products)}
+
+
+def sell(query, body):
+    """Sell every product in the request body.
+
+    Parameters
+    ----------
+    query : dict
+        The query parameters of the request (unused).
+    body : dict or list
+        A sale or a list of sales with the fields accepted by
+        superpy.parse_sale.
+
+    Returns
+    -------
+    status : int
+        200, or 409 if a single sale has not been possible.
+    response : dict
+        The name, buy price and sell price of each sold product and
+        the index and reason of each sale that has not been possible.
+    """
+    sales = []
+    errors = []
+    for index, row in enumerate(get_items(body)):
+        try:
+            sales.append((index, sp.parse_sale(
+                row if isinstance(row, dict) else None)))
+        except ValueError as error:
+            if isinstance(body, dict):
+                raise ApiError(400, str(error))
+            errors.append({'index': index, 'error': str(error)})
+
+    products = sp.current_store().sell_many(
+        [(sale['product_name'], sale['sell_price']) for _, sale in sales])
+    sold_products = []
+    for (index, sale), product in zip(sales, products):
+        if product is None:
+            errors.append({
+                'index': index,
+                'error': f'{sale["product_name"]} is expired or is not '
+                'in stock',
+            })
+        else:
+            sold_products.append(product)
+    errors.sort(key=lambda error: error['index'])
+
+    status = 409 if isinstance(body, dict) and errors else 200
+    return status, {
+        'sold': [{
+            'product_name': product.product_name,
+            'buy_price': product.buy_price / 100,
+            'sell_price': product.sell_price / 100,
+        } for product in sold_products],
+        'errors': errors,
+    }
+
+
+def inventory(query, body):
+    """Return the products in stock, or their count with ?count=1.
+
+    The products can be filtered with ?name= and paginated with
+    ?offset= and ?limit=, like the options of the inventory command.
+    """
+    store = sp.current_store()
+    current_date = store.date()
+    name_filter = get_query_value(query, 'name')
+    try:
+        offset = int(get_query_value(query, 'offset', 0))
+        limit = get_query_value(query, 'limit')
+        limit = None if limit is None else int(limit)
+    except ValueError:
+        raise ApiError(400, 'offset and limit must be integers')
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ApiError(400, 'offset and limit cannot be negative')
+
+    if get_query_flag(query, 'count'):
+        return 200, {
+            'date': current_date,
+            'products': [{'product_name': product_name, 'count': count}
+                         for product_name, count in store.inventory(
+                             name_filter, True, offset, limit)],
+        }
+
+    return 200, {
+        'date': current_date,
+        'products': [{
+            'product_name': product.product_name,
+            'buy_price': product.buy_price / 100,
+            'expiration_date': storage.format_date(product.expiration_date)
+            or None,
+            'expired': not sp.product_is_non_expiring(product) and
+            not sp.product_is_fresh(product, current_date),
+        } for product in store.inventory(name_filter, False, offset,
+                                         limit)],
+    }
+
+
+def report(query, body):
+    """Return sales, costs, revenue or profit.
+
+    Parameters
+    ----------
+    query : dict
+        The query parameters of the request:
+
+        * information: sales, costs, revenue or profit (required)
+        * date: today (default), yesterday or a date in YYYY-MM-DD
+          format
+        * from, to, group_by and by_product: report each day, week,
+          month or quarter in a range of dates instead, like the
+          --from, --to, --group-by and --by-product options
+    body : None
+        The body of the request (unused).
+
+    Returns
+    -------
+    status : int
+        200 if the report has been created.
+    response : dict
+        The sold products or the figure for the date, or the figures of
+        each period in the range along with their totals.
+    """
+    store = sp.current_store()
+    information = get_query_value(query, 'information')
+    if information not in ('sales', 'costs', 'revenue', 'profit'):
+        raise ApiError(400, 'information must be sales, costs, revenue or '
+                       'profit')
+
+    if get_query_value(query, 'from') is not None:
+        start_date = check_date(get_query_value(query, 'from'), 'from date')
+        end_date = check_date(
+            get_query_value(query, 'to', store.date()), 'to date')
+        group_by = get_query_value(query, 'group_by', 'day')
+        if group_by not in ('day', 'week', 'month', 'quarter'):
+            raise ApiError(400, 'group_by must be day, week, month or '
+                           'quarter')
+        if start_date > end_date:
+            raise ApiError(400, f'start date {start_date} is after end date '
+                           f'{end_date}')
+
+        field = 'sold_count' if information == 'sales' else information
+        figures = store.period_figures(start_date, end_date, group_by,
+                                       get_query_flag(query, 'by_product'))
+        total = sum(figure[field] for figure in figures)
+        return 200, {
+            'from': start_date,
+            'to': end_date,
+            'group_by': group_by,
+            'figures': figures,
+            'total': total if field == 'sold_count' else round(total, 2),
+        }
+
+    date = get_query_value(query, 'date', 'today')
+    args = argparse.Namespace(
+        today=date == 'today',
+        yesterday=date == 'yesterday',
+        date=None if date in ('today', 'yesterday')
+        else check_date(date, 'date'),
+    )
+    date = sp.get_selected_date(args)
+
+    if information == 'sales':
+        return 200, {
+            'date': date,
+            'sales': [{
+                'product_name': product.product_name,
+                'buy_price': product.buy_price / 100,
+                'sell_price': product.sell_price / 100,
+            } for product in sorted(store.sales(date),
+                                    key=lambda product:
+                                    product.product_name)],
+        }
+    return 200, {
+        'date': date,
+        information: store.figures(date)[information],
+    }
+
+
+ROUTES = {
+    '/date': ('GET', show_date),
+    '/buy': ('POST', buy),
+    '/sell': ('POST', sell),
+    '/inventory': ('GET', inventory),
+    '/report': ('GET', report),
+}
+
+
+# Functions serving the requests over HTTP
+def handle_request(method, target, body):
+    """Route a request to its handler and return status and response.
+
+    Runs in the worker thread, which is the only thread that touches
+    the storage backend and its in-memory state.
+    """
+    url = urlsplit(target)
+    if url.path not in ROUTES:
+        return 404, {'error': f'unknown path {url.path}'}
+    route_method, handler = ROUTES[url.path]
+    if method != route_method:
+        return 405, {'error': f'{url.path} only accepts {route_method}'}
+
+    try:
+        if body:
+            try:
+                body = json.loads(body)
+            except ValueError:
+                raise ApiError(400, 'body is not valid JSON')
+        else:
+            body = None
+        return handler(parse_qs(url.query), body)
+    except ApiError as error:
+        return error.status, {'error': str(error)}
+    except Exception as error:
+        return 500, {'error': str(error)}
+
+
+async def handle_connection(reader, writer, worker):
+    """Serve the requests of a single (keep-alive) connection."""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            try:
+                method, target, version = request_line.decode(
+                    'latin-1').split()
+            except ValueError:
+                method = target = version = None
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            keep_alive = version is not None and \
+                headers.get('connection', '').lower() != 'close' and \
+                (version == 'HTTP/1.1' or
+                 headers.get('connection', '').lower() == 'keep-alive')
+            try:
+                length = int(headers.get('content-length', 0))
+            except ValueError:
+                length = -1
+
+            if method is None or length < 0:
+                status, response = 400, {'error': 'malformed request'}
+                keep_alive = False
+            elif length > MAX_BODY_BYTES:
+                status, response = 413, {'error': 'request body too large'}
+                keep_alive = False
+            else:
+                body = await reader.readexactly(length)
+                status, response = await loop.run_in_executor(
+                    worker, handle_request, method, target, body)
+
+            content = json.dumps(response).encode()
+            writer.write(
+                f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                'Content-Type: application/json\r\n'
+                f'Content-Length: {len(content)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+                '\r\n'.encode('latin-1') + content)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run_server(host, port, listening=None):
+    """Accept connections until the task is cancelled.
+
+    Parameters
+    ----------
+    host : str
+        The address to listen on.
+    port : int
+        The port to listen on, or 0 for any free port.
+    listening : callable, optional
+        Called with the port that is actually listened on, as soon as
+        connections are accepted.
+    """
+    # A single worker thread serializes every access to the storage
+    # backend, while the event loop keeps reading and writing sockets.
+    with ThreadPoolExecutor(max_workers=1) as worker:
+        server = await asyncio.start_server(
+            lambda reader, writer: handle_connection(reader, writer, worker),
+            host, port)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            sp.rprint('[bold green]OK[/bold green]')
+            print(f'API is listening on http://{host}:{port}.', flush=True)
+            if listening is not None:
+                listening(port)
+            await server.serve_forever()
+
+
+def serve(args):
+    """Serve the HTTP/JSON API until interrupted.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the following fields:
+
+        * host
+        * port
+        * func
+
+    Returns
+    -------
+    None : None
+        Requests are served until the process is interrupted (e.g. by
+        pressing Ctrl+C).
+    """
+    try:
+        asyncio.run(run_server(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,206 @@
+"""
+This script generates the files of a large, realistic store, so that
+SuperPy can be benchmarked at scale. It writes the following files to a
+directory:
+- 'current_date.txt' with the last day of the generated history
+- 'products.csv' with a configurable number of products, of which a
+  configurable share has been sold
+- 'financial_records.csv' with the costs, revenue and profit of each
+  day on which products have been sold
+The same seed always generates the same files.
+"""
+
+# Imports
+import argparse
+import csv
+import os
+import random
+import uuid
+from datetime import date, timedelta
+
+PRODUCT_FIELDNAMES = [
+    'id',
+    'product_name',
+    'buy_date',
+    'buy_price',
+    'expiration_date',
+    'sell_date',
+    'sell_price',
+]
+FINANCIAL_RECORD_FIELDNAMES = ['date', 'costs', 'revenue', 'profit']
+# Perishable products along with their typical buy price.
+PERISHABLE_PRODUCTS = {
+    'apple': 0.3, 'banana': 0.2, 'bread': 1.5, 'butter': 2.1,
+    'cheese': 4.5, 'chicken': 5.0, 'eggs': 2.4, 'fish': 7.5,
+    'grapes': 2.0, 'ham': 3.2, 'lettuce': 0.8, 'milk': 0.9,
+    'orange': 0.4, 'pear': 0.35, 'salmon': 9.0, 'strawberries': 2.5,
+    'tomato': 0.25, 'yoghurt': 1.1,
+}
+# Non-perishable products along with their typical buy price.
+NON_PERISHABLE_PRODUCTS = {
+    'batteries': 3.0, 'candles': 1.8, 'coffee': 4.0, 'dish soap': 1.2,
+    'frying pan': 15.0, 'kitchen knife': 9.5, 'pasta': 0.9, 'rice': 1.4,
+    'salt': 0.5, 'sponges': 1.0, 'tea': 2.2, 'toilet paper': 3.5,
+}
+
+
+def generate_store(directory, rows, sold_ratio=0.7, expiration_spread=30,
+                   days=365, non_expiring_ratio=0.2, current_date=None,
+                   seed=0):
+    """Write the files of a store with a generated history.
+
+    Parameters
+    ----------
+    directory : str
+        The directory to write the files to (created if needed).
+    rows : int
+        The number of products in 'products.csv'.
+    sold_ratio : float, optional
+        The share of products that has been sold (defaults to 0.7).
+    expiration_spread : int, optional
+        The maximum number of days perishable products stay fresh after
+        being bought (defaults to 30).
+    days : int, optional
+        The number of days the history spans (defaults to 365).
+    non_expiring_ratio : float, optional
+        The share of products that does not expire (defaults to 0.2).
+    current_date : datetime.date, optional
+        The last day of the history (defaults to today).
+    seed : int, optional
+        The seed of the random number generator (defaults to 0).
+
+    Returns
+    -------
+    summary : dict
+        The number of products, sold products and financial records
+        that have been written, along with the first and last date of
+        the history.
+    """
+    rng = random.Random(seed)
+    current_date = current_date or date.today()
+    first_date = current_date - timedelta(days=days - 1)
+    dates = [(first_date + timedelta(days=offset)).strftime('%Y-%m-%d')
+             for offset in range(days + expiration_spread + 1)]
+    perishable = list(PERISHABLE_PRODUCTS.items())
+    non_perishable = list(NON_PERISHABLE_PRODUCTS.items())
+    daily_totals = {}
+    sold_count = 0
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'current_date.txt'), 'w') as text_file:
+        text_file.write(current_date.strftime('%Y-%m-%d'))
+
+    with open(os.path.join(directory, 'products.csv'), 'w',
+              newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(PRODUCT_FIELDNAMES)
+        for _ in range(rows):
+            buy_offset = rng.randrange(days)
+            if rng.random() < non_expiring_ratio:
+                product_name, price = rng.choice(non_perishable)
+                expiration_date = ''
+                # Non-perishable products can be sold on any later day.
+                last_sell_offset = days - 1
+            else:
+                product_name, price = rng.choice(perishable)
+                expiration_offset = buy_offset + \
+                    rng.randint(1, expiration_spread)
+                expiration_date = dates[expiration_offset]
+                last_sell_offset = min(expiration_offset, days - 1)
+            buy_price = round(price * rng.uniform(0.8, 1.2), 2)
+
+            sell_date = sell_price = ''
+            if rng.random() < sold_ratio:
+                sell_offset = rng.randint(buy_offset, last_sell_offset)
+                sell_date = dates[sell_offset]
+                sell_price = round(buy_price * rng.uniform(1.1, 1.8), 2)
+                totals = daily_totals.setdefault(sell_date, [0.0, 0.0])
+                totals[0] += buy_price
+                totals[1] += sell_price
+                sold_count += 1
+
+            writer.writerow([
+                uuid.UUID(int=rng.getrandbits(128), version=4),
+                product_name,
+                dates[buy_offset],
+                buy_price,
+                expiration_date,
+                sell_date,
+                sell_price,
+            ])
+
+    with open(os.path.join(directory, 'financial_records.csv'), 'w',
+              newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(FINANCIAL_RECORD_FIELDNAMES)
+        for sell_date, (costs, revenue) in sorted(daily_totals.items()):
+            writer.writerow([sell_date, round(costs, 2), round(revenue, 2),
+                             round(revenue - costs, 2)])
+
+    return {
+        'rows': rows,
+        'sold_rows': sold_count,
+        'financial_records': len(daily_totals),
+        'first_date': dates[0],
+        'current_date': current_date.strftime('%Y-%m-%d'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate the files of a large store for SuperPy'
+    )
+    parser.add_argument(
+        'directory',
+        help='directory to write the files to'
+    )
+    parser.add_argument(
+        '-r',
+        '--rows',
+        default=10000,
+        help='number of products to generate (defaults to 10000)',
+        type=int
+    )
+    parser.add_argument(
+        '--sold-ratio',
+        default=0.7,
+        help='share of products that has been sold (defaults to 0.7)',
+        type=float
+    )
+    parser.add_argument(
+        '--expiration-spread',
+        default=30,
+        help='maximum number of days products stay fresh (defaults to 30)',
+        type=int
+    )
+    parser.add_argument(
+        '--days',
+        default=365,
+        help='number of days the history spans (defaults to 365)',
+        type=int
+    )
+    parser.add_argument(
+        '--non-expiring-ratio',
+        default=0.2,
+        help='share of products that does not expire (defaults to 0.2)',
+        type=float
+    )
+    parser.add_argument(
+        '--seed',
+        default=0,
+        help='seed of the random number generator (defaults to 0)',
+        type=int
+    )
+    args = parser.parse_args()
+
+    summary = generate_store(args.directory, args.rows, args.sold_ratio,
+                             args.expiration_spread, args.days,
+                             args.non_expiring_ratio, seed=args.seed)
+    print(f'Generated {summary["rows"]} products '
+          f'({summary["sold_rows"]} sold) and '
+          f'{summary["financial_records"]} financial records from '
+          f'{summary["first_date"]} to {summary["current_date"]}.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+This script times each command of the SuperPy commandline tool against
+generated stores of different sizes. Every command is run as a separate
+process, exactly as it would be run from the terminal, and the results
+are written as JSON, so that they can be compared across versions:
+    python3 benchmarks/run_benchmarks.py --rows 10000 1000000 \
+        --output results.json
+Charts are rendered with Matplotlib's non-interactive Agg backend.
+"""
+
+# Imports
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from generate_data import generate_store
+
+PACKAGE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__)))
+SUPER_PY = os.path.join(PACKAGE_DIRECTORY, 'super.py')
+# Read-only commands come first, so that they all see the generated
+# store. {first_date} is replaced by the first date of its history.
+COMMANDS = {
+    'inventory': ['inventory'],
+    'inventory --count': ['inventory', '--count'],
+    'report sales': ['report', 'sales', '--today'],
+    'report profit': ['report', 'profit', '--today'],
+    'report revenue by month': ['report', 'revenue', '--from',
+                                '{first_date}', '--group-by', 'month'],
+    'visualize': ['visualize', '--type', 'line'],
+    'record': ['record', '--today'],
+    'buy': ['buy', '--product-name', 'apple', '--price', '0.3'],
+    'sell': ['sell', '--product-name', 'apple', '--price', '0.6'],
+}
+
+
+def get_version():
+    """Return the git commit of SuperPy, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=PACKAGE_DIRECTORY, capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def time_command(argv, directory):
+    """Run a command once and measure it.
+
+    Parameters
+    ----------
+    argv : list
+        The arguments to be passed to super.py.
+    directory : str
+        The directory containing the files of the store.
+
+    Returns
+    -------
+    measurement : dict
+        The wall time in seconds, the return code and (on platforms
+        that report it) the peak resident memory of the process in
+        kilobytes.
+    """
+    env = dict(os.environ, MPLBACKEND='Agg')
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, SUPER_PY, *argv],
+                               cwd=directory, env=env,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    peak_memory = None
+    if hasattr(os, 'wait4'):
+        # Collect the resource usage of this very process, while
+        # Popen.wait would only report its return code.
+        stderr = process.stderr.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is reported in bytes on macOS and kilobytes on Linux.
+        peak_memory = usage.ru_maxrss // 1024 \
+            if sys.platform == 'darwin' else usage.ru_maxrss
+    else:
+        _, stderr = process.communicate()
+    duration = time.perf_counter() - start
+
+    measurement = {
+        'seconds': round(duration, 4),
+        'returncode': process.returncode,
+        'peak_memory_kb': peak_memory,
+    }
+    if process.returncode:
+        measurement['stderr'] = stderr.decode(errors='replace')[-2000:]
+    return measurement
+
+
+def run_benchmarks(rows, backends, commands, repeat, sold_ratio,
+                   expiration_spread, directory):
+    """Time each command for each store size and storage backend.
+
+    Parameters
+    ----------
+    rows : list
+        The numbers of products of the stores to be generated.
+    backends : list
+        The names of the storage backends to be benchmarked.
+    commands : list
+        The names of the commands in COMMANDS to be timed.
+    repeat : int
+        The number of times each command is run.
+    sold_ratio : float
+        The share of products that has been sold.
+    expiration_spread : int
+        The maximum number of days products stay fresh.
+    directory : str
+        The directory to generate the stores in.
+
+    Returns
+    -------
+    results : list
+        A dictionary for each command, store size and backend with the
+        wall time of each run, their minimum and median, the return
+        code of the last run and its peak memory.
+    """
+    results = []
+    for row_count in rows:
+        for backend in backends:
+            store_directory = os.path.join(directory,
+                                           f'{backend}-{row_count}')
+            if os.path.exists(store_directory):
+                shutil.rmtree(store_directory)
+            print(f'Generating {row_count} products for {backend}...',
+                  file=sys.stderr)
+            summary = generate_store(store_directory, row_count,
+                                     sold_ratio, expiration_spread)
+
+            # The sqlite backend first has to import the generated files,
+            # which is timed once.
+            timed_commands = [(name, COMMANDS[name], repeat)
+                              for name in commands]
+            if backend == 'sqlite':
+                timed_commands.insert(0, ('import-csv', ['import-csv'], 1))
+            for name, argv, run_count in timed_commands:
+                argv = [argument.format(**summary) for argument in argv]
+                runs = [time_command(['--plain', '--storage', backend,
+                                      *argv], store_directory)
+                        for _ in range(run_count)]
+                seconds = [run['seconds'] for run in runs]
+                result = {
+                    'command': name,
+                    'argv': argv,
+                    'storage': backend,
+                    'rows': row_count,
+                    'runs': seconds,
+                    'min': min(seconds),
+                    'median': statistics.median(seconds),
+                    'returncode': runs[-1]['returncode'],
+                    'peak_memory_kb': runs[-1]['peak_memory_kb'],
+                }
+                if 'stderr' in runs[-1]:
+                    result['stderr'] = runs[-1]['stderr']
+                results.append(result)
+                print(f'{backend:>6} {row_count:>10} {name:<24} '
+                      f'min {result["min"]:8.3f}s  '
+                      f'median {result["median"]:8.3f}s'
+                      f'{"" if not result["returncode"] else "  FAILED"}',
+                      file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time each SuperPy command against generated stores'
+    )
+    parser.add_argument(
+        '-r',
+        '--rows',
+        default=[10000, 100000],
+        help='numbers of products to benchmark (defaults to 10000 and \
+        100000)',
+        nargs='+',
+        type=int
+    )
+    parser.add_argument(
+        '-s',
+        '--storage',
+        choices=['csv', 'log', 'sqlite'],
+        default=['csv'],
+        help='storage backends to benchmark (defaults to csv)',
+        nargs='+'
+    )
+    parser.add_argument(
+        '-c',
+        '--commands',
+        choices=list(COMMANDS),
+        default=list(COMMANDS),
+        help='commands to time (defaults to all of them)',
+        metavar='COMMAND',
+        nargs='+'
+    )
+    parser.add_argument(
+        '-n',
+        '--repeat',
+        default=3,
+        help='number of runs of each command (defaults to 3)',
+        type=int
+    )
+    parser.add_argument(
+        '--sold-ratio',
+        default=0.7,
+        help='share of products that has been sold (defaults to 0.7)',
+        type=float
+    )
+    parser.add_argument(
+        '--expiration-spread',
+        default=30,
+        help='maximum number of days products stay fresh (defaults to 30)',
+        type=int
+    )
+    parser.add_argument(
+        '-d',
+        '--directory',
+        help='directory to generate the stores in, which is kept (defaults \
+        to a temporary directory)'
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='file to write the JSON results to (defaults to stdout)'
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        results = run_benchmarks(
+            args.rows, args.storage, args.commands, args.repeat,
+            args.sold_ratio, args.expiration_spread,
+            args.directory or temporary_directory)
+
+    report = {
+        'version': get_version(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'sold_ratio': args.sold_ratio,
+        'expiration_spread': args.expiration_spread,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
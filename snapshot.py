@@ -0,0 +1,240 @@
+"""
+This module contains the columnar snapshot of the SuperPy commandline
+tool. The snapshot stores every product as a set of memory-mapped NumPy
+arrays, so that read-only commands do not have to parse 'products.csv':
+- prices are stored as integer numbers of cents
+- dates are stored as integer ordinals (days since 1970-01-01)
+- product names are dictionary-encoded as integer codes
+The snapshot is regenerated whenever the files it has been built from
+have changed, from chunks of a large 'products.csv' that are encoded in
+parallel. Each store of a chain has a snapshot of its own.
+"""
+
+# Imports
+import datetime
+import json
+import os
+import storage
+import timings
+
+SNAPSHOT_DIRECTORY = '.superpy_snapshot'
+# Snapshots written in an older format are rebuilt.
+SNAPSHOT_VERSION = 2
+# Below this size, parsing the csv files is cheaper than importing NumPy.
+SNAPSHOT_MIN_BYTES = 1024 * 1024
+# Ordinals for a missing date and a missing expiration date, chosen so
+# that unsold products are never within a range of selling dates and
+# non-expiring products are always fresh.
+NO_DATE = -2 ** 31
+NO_EXPIRATION_DATE = 2 ** 31 - 1
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+COLUMNS = [
+    'product_code',
+    'buy_date',
+    'buy_price',
+    'expiration_date',
+    'sell_date',
+    'sell_price',
+]
+
+
+def date_to_ordinal(date):
+    """Return the ordinal of a date in YYYY-MM-DD format."""
+    import numpy as np
+    return int(np.datetime64(date, 'D').astype('int64'))
+
+
+def dates_to_ordinals(dates, missing):
+    """Convert dates into an array of ordinals.
+
+    Parameters
+    ----------
+    dates : list
+        Dates as datetime.date objects, or None.
+    missing : int
+        The ordinal to be used for None.
+
+    Returns
+    -------
+    ordinals : numpy.ndarray
+        The ordinals as 32-bit integers.
+    """
+    import numpy as np
+    dates = np.array(dates, dtype='datetime64[D]')
+    ordinals = dates.astype('int64')
+    ordinals[np.isnat(dates)] = missing
+    return ordinals.astype('int32')
+
+
+def ordinals_to_dates(ordinals, missing):
+    """Convert an array of ordinals back into a list of datetime.date
+    objects.
+
+    Ordinals equal to missing become None.
+    """
+    return [None if ordinal == missing
+            else datetime.date.fromordinal(ordinal + EPOCH_ORDINAL)
+            for ordinal in ordinals.tolist()]
+
+
+def product_columns(products):
+    """Encode products as the columns of a snapshot.
+
+    Parameters
+    ----------
+    products : iterable
+        The products to be encoded.
+
+    Returns
+    -------
+    arrays : dict
+        A dictionary mapping 'product_names' to the sorted names of the
+        products and each name in COLUMNS to a NumPy array.
+    """
+    import numpy as np
+
+    names = []
+    columns = {name: [] for name in COLUMNS if name != 'product_code'}
+    for product in products:
+        names.append(product.product_name)
+        columns['buy_date'].append(product.buy_date)
+        columns['buy_price'].append(product.buy_price)
+        columns['expiration_date'].append(product.expiration_date)
+        columns['sell_date'].append(product.sell_date)
+        # Unsold products are never within a range of selling dates, so
+        # their price does not matter.
+        columns['sell_price'].append(product.sell_price or 0)
+
+    product_names, product_codes = np.unique(
+        np.array(names, dtype=str), return_inverse=True)
+    return {
+        'product_names': product_names,
+        'product_code': product_codes.astype('int32'),
+        'buy_date': dates_to_ordinals(columns['buy_date'], NO_DATE),
+        'buy_price': np.array(columns['buy_price'], dtype='int64'),
+        'expiration_date': dates_to_ordinals(columns['expiration_date'],
+                                             NO_EXPIRATION_DATE),
+        'sell_date': dates_to_ordinals(columns['sell_date'], NO_DATE),
+        'sell_price': np.array(columns['sell_price'], dtype='int64'),
+    }
+
+
+def concatenate_columns(partial_columns):
+    """Concatenate the columns of consecutive chunks of products.
+
+    The product codes of each chunk are translated into codes for the
+    sorted names of all chunks.
+    """
+    if len(partial_columns) == 1:
+        return partial_columns[0]
+
+    import numpy as np
+    product_names = np.unique(np.concatenate(
+        [columns['product_names'] for columns in partial_columns]))
+    arrays = {
+        'product_names': product_names,
+        'product_code': np.concatenate([
+            np.searchsorted(product_names, columns['product_names']).astype(
+                'int32')[columns['product_code']]
+            for columns in partial_columns]),
+    }
+    for name in COLUMNS[1:]:
+        arrays[name] = np.concatenate(
+            [columns[name] for columns in partial_columns])
+    return arrays
+
+
+@timings.timed('write')
+def build_snapshot(arrays, signature):
+    """Write the columnar snapshot of all products to disk.
+
+    Parameters
+    ----------
+    arrays : dict
+        The columns of all products, as returned by product_columns.
+    signature : list
+        The signature of the files the products have been read from.
+
+    Returns
+    -------
+    None : None
+        Each column is written to the SNAPSHOT_DIRECTORY of the selected
+        store as an .npy file, followed by 'meta.json', which marks the
+        snapshot as complete. Has to be called while holding
+        storage.lock_files.
+    """
+    import numpy as np
+
+    directory = storage.data_path(SNAPSHOT_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    meta_filename = os.path.join(directory, 'meta.json')
+    if os.path.exists(meta_filename):
+        os.remove(meta_filename)
+    for name, array in arrays.items():
+        filename = os.path.join(directory, f'{name}.npy')
+        np.save(f'{filename}.tmp.npy', array)
+        timings.count_file('bytes_written', f'{filename}.tmp.npy')
+        os.replace(f'{filename}.tmp.npy', filename)
+    with open(meta_filename, 'w') as meta_file:
+        json.dump({'version': SNAPSHOT_VERSION, 'signature': signature,
+                   'rows': len(arrays['product_code'])}, meta_file)
+
+
+def snapshot_is_current(signature):
+    """Check if the snapshot has been built from the files as they are."""
+    try:
+        with open(os.path.join(storage.data_path(SNAPSHOT_DIRECTORY),
+                               'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        return meta.get('version') == SNAPSHOT_VERSION and \
+            meta['signature'] == signature
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+@timings.timed('read')
+def load_columns(product_storage, force=False):
+    """Return the columnar snapshot of all products.
+
+    Parameters
+    ----------
+    product_storage : storage.CsvStorage
+        The storage backend the products are read from.
+    force : bool, optional
+        Whether to use the snapshot regardless of the size of the files.
+
+    Returns
+    -------
+    columns : dict or None
+        A dictionary mapping 'product_names' to the sorted names of all
+        products and each name in COLUMNS to a read-only memory-mapped
+        array. None is returned if the backend does not support
+        snapshots or its files are too small to benefit from one.
+    """
+    if not hasattr(product_storage, 'snapshot_signature'):
+        return None
+    if not force and sum(size for _, size, *_ in
+                         product_storage.snapshot_signature()) < \
+            SNAPSHOT_MIN_BYTES:
+        return None
+
+    import numpy as np
+    # The lock keeps other processes from rebuilding the snapshot, or
+    # changing the products it is built from, while it is checked,
+    # rebuilt and opened. Opened columns stay valid afterwards, since a
+    # rebuild replaces their files instead of overwriting them.
+    with storage.lock_files():
+        signature = product_storage.snapshot_signature()
+        if not snapshot_is_current(signature):
+            build_snapshot(concatenate_columns(
+                product_storage.map_products(product_columns)), signature)
+
+        directory = storage.data_path(SNAPSHOT_DIRECTORY)
+        columns = {'product_names': np.load(
+            os.path.join(directory, 'product_names.npy'))}
+        for name in COLUMNS:
+            filename = os.path.join(directory, f'{name}.npy')
+            columns[name] = np.load(filename, mmap_mode='r')
+            timings.count_file('bytes_read', filename)
+    timings.count('rows_scanned', len(columns['product_code']))
+    return columns
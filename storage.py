@@ -0,0 +1,1782 @@
+"""
+This module contains the storage backends of the SuperPy commandline
+tool. A backend decides how products and financial records are read
+from and written to disk:
+- 'csv' keeps every product in 'products.csv' and rewrites the whole
+  file whenever a product has been sold
+- 'log' appends immutable buy and sell events to 'products_log.csv' and
+  periodically compacts them into 'products.csv', which then serves as
+  a snapshot of the inventory
+- 'sqlite' keeps products and financial records in the indexed tables
+  of 'superpy.db'
+Whichever backend is used, products are parsed into Product records as
+soon as they are read, with dates, prices in cents and interned names.
+A chain of stores keeps the files of each store in its own directory in
+'stores', which is selected with set_store.
+The csv backends can move products that have been sold long ago into
+monthly partitions in the 'archive' directory, which are only read by
+reports on the months they cover.
+A large 'products.csv' is split into chunks at line boundaries, which
+are parsed and aggregated by a pool of processes.
+"""
+
+# Imports
+import contextlib
+import csv
+import datetime
+import gc
+import heapq
+import itertools
+import os
+import re
+import sys
+import threading
+import timings
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl module, so msvcrt is used to lock files.
+    fcntl = None
+
+PRODUCT_FIELDNAMES = [
+    'id',
+    'product_name',
+    'buy_date',
+    'buy_price',
+    'expiration_date',
+    'sell_date',
+    'sell_price',
+]
+EVENT_FIELDNAMES = [
+    'event',
+    'id',
+    'product_name',
+    'date',
+    'price',
+    'expiration_date',
+]
+FINANCIAL_RECORD_FIELDNAMES = ['date', 'costs', 'revenue', 'profit']
+DAILY_TOTAL_FIELDNAMES = ['date', 'costs', 'revenue', 'sold_count']
+LOCK_FILENAME = 'superpy.lock'
+# Files of at least PARALLEL_MIN_BYTES are split into chunks of about
+# PARALLEL_CHUNK_BYTES, which are parsed by PARALLEL_WORKERS processes.
+PARALLEL_MIN_BYTES = 64 * 1024 * 1024
+PARALLEL_CHUNK_BYTES = 16 * 1024 * 1024
+PARALLEL_WORKERS = os.cpu_count() or 1
+STORES_DIRECTORY = 'stores'
+STORE_NAME_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+ARCHIVE_EXTENSIONS = {'none': '.csv', 'gzip': '.csv.gz', 'lzma': '.csv.xz'}
+PARTITION_PATTERN = re.compile(
+    r'products-(?P<month>\d{4}-\d{2})\.csv(\.gz|\.xz)?')
+# The lock can be taken again by the thread that holds it, so that a
+# command can keep it across a whole read-modify-write cycle while each
+# write of the backend takes it as well.
+_thread_lock = threading.RLock()
+_file_lock = {'file': None, 'depth': 0}
+# Numbers the entries of the heaps of sellable products in the order in
+# which they are added.
+_sell_sequence = itertools.count()
+# The files of the selected store are kept in this directory, or in the
+# root directory (by default the working directory) if no store has
+# been selected.
+_store = {'root': '', 'name': None, 'directory': ''}
+# Each date and price is only parsed once and then shared by every
+# product with that date or price.
+_parsed_dates = {}
+_parsed_prices = {}
+
+
+def set_store(name, root=''):
+    """Select the store whose files are read and written.
+
+    Parameters
+    ----------
+    name : str or None
+        The name of a store in STORES_DIRECTORY, which is created if it
+        does not exist yet, or None for the files in the root directory.
+    root : str, optional
+        The directory holding STORES_DIRECTORY (defaults to the working
+        directory).
+
+    Returns
+    -------
+    None : None
+        Subsequent calls to set_storage create backends for the files
+        of this store. The selected backend is kept if the store has
+        already been selected.
+    """
+    global _storage
+    if (root, name) == (_store['root'], _store['name']):
+        return
+    _store['root'] = root
+    _store['name'] = name
+    _store['directory'] = root if name is None \
+        else os.path.join(root, STORES_DIRECTORY, name)
+    if name is not None:
+        os.makedirs(_store['directory'], exist_ok=True)
+    _storage = None
+
+
+def get_root():
+    """Return the directory holding the files of all stores."""
+    return _store['root']
+
+
+def data_path(filename):
+    """Return the path of one of the files of the selected store."""
+    return os.path.join(_store['directory'], filename)
+
+
+def root_path(filename):
+    """Return the path of a file shared by all stores, e.g. the current
+    date."""
+    return os.path.join(_store['root'], filename)
+
+
+def list_stores():
+    """Return the sorted names of all stores in STORES_DIRECTORY."""
+    directory = root_path(STORES_DIRECTORY)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(entry.name for entry in os.scandir(directory)
+                  if entry.is_dir() and STORE_NAME_PATTERN.fullmatch(
+                      entry.name))
+
+
+@contextlib.contextmanager
+def lock_files():
+    """Hold an exclusive advisory lock on the files of SuperPy.
+
+    Every SuperPy process that changes products, daily totals or
+    financial records holds this lock while doing so, so that two
+    processes never read the same state and then overwrite each other's
+    changes. The lock is released as soon as the outermost block exits.
+    Each store has a lock of its own.
+    """
+    with _thread_lock:
+        if _file_lock['depth'] == 0:
+            lock_file = open(data_path(LOCK_FILENAME), 'a+')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                else:
+                    import msvcrt
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            except BaseException:
+                lock_file.close()
+                raise
+            _file_lock['file'] = lock_file
+        _file_lock['depth'] += 1
+        try:
+            yield
+        finally:
+            _file_lock['depth'] -= 1
+            if _file_lock['depth'] == 0:
+                # Closing the file releases the lock.
+                _file_lock['file'].close()
+                _file_lock['file'] = None
+
+
+def reset_file_lock():
+    """Forget the lock on the files held by the parent process.
+
+    A forked worker process inherits the lock file and depth of
+    lock_files, and possibly a thread lock held by another thread of
+    its parent, so that it would neither lock the files of its own store
+    nor be able to take the lock at all.
+    """
+    global _thread_lock
+    _thread_lock = threading.RLock()
+    _file_lock['file'] = None
+    _file_lock['depth'] = 0
+
+
+def open_csv(filename, mode='r', compressed_filename=None):
+    """Open a csv file as text, compressed or not.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the csv file to be opened.
+    mode : str, optional
+        Either 'r' to read (default) or 'w' to write.
+    compressed_filename : str, optional
+        The name whose extension decides the compression, if it differs
+        from filename: '.gz' for gzip, '.xz' for lzma and anything else
+        for none.
+
+    Returns
+    -------
+    csv_file : file object
+        A text file to be passed to csv.reader or csv.writer.
+    """
+    extension = os.path.splitext(compressed_filename or filename)[1]
+    if extension == '.gz':
+        import gzip
+        return gzip.open(filename, f'{mode}t', newline='')
+    if extension == '.xz':
+        import lzma
+        return lzma.open(filename, f'{mode}t', newline='')
+    return open(filename, mode, newline='')
+
+
+@timings.timed('write')
+def write_csv_atomically(filename, fieldnames, rows):
+    """Replace a csv file without ever leaving it half-written.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the csv file to be replaced. Files ending in '.gz'
+        or '.xz' are compressed with gzip or lzma.
+    fieldnames : list
+        The header of the csv file.
+    rows : iterable
+        The rows to be written to the csv file, as lists of values in
+        the order of fieldnames.
+
+    Returns
+    -------
+    None : None
+        The rows are written to a temporary file first, which then
+        replaces the original file in a single step.
+    """
+    temp_filename = f'{filename}.tmp'
+    with open_csv(temp_filename, 'w', filename) as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(fieldnames)
+        writer.writerows(rows)
+    # Compressed files are only complete once they have been closed, so
+    # the file is synced to disk afterwards.
+    with open(temp_filename, 'r+b') as written_file:
+        os.fsync(written_file.fileno())
+    timings.count_file('bytes_written', temp_filename)
+    os.replace(temp_filename, filename)
+
+
+def empty_totals():
+    """Return the daily totals of a date without any sales."""
+    return {'costs': 0, 'revenue': 0, 'sold_count': 0}
+
+
+def compare_daily_totals(stored_totals, rebuilt_totals):
+    """Return the dates whose stored totals differ from rebuilt ones.
+
+    Parameters
+    ----------
+    stored_totals : dict
+        Daily totals as they have been maintained on every sale.
+    rebuilt_totals : dict
+        Daily totals as they have been recomputed from all products.
+
+    Returns
+    -------
+    dates : list
+        The sorted dates for which the number of sold products, the
+        costs or the revenue differ.
+    """
+    return [date for date in sorted(set(stored_totals) | set(rebuilt_totals))
+            if stored_totals.get(date, empty_totals()) !=
+            rebuilt_totals.get(date, empty_totals())]
+
+
+def name_matches(product_name, name_filter):
+    """Check if a product name contains name_filter, ignoring case.
+
+    Every name matches if name_filter is None.
+    """
+    return name_filter is None or \
+        name_filter.lower() in product_name.lower()
+
+
+def sellable_entry(product):
+    """Return the entry of a product in a heap of sellable products.
+
+    Entries are ordered by expiration date, with non-expiring products
+    after all others, and then by the order in which they have been
+    added, so that the heap always yields the product that expires
+    first, and the oldest one among products that expire together.
+    """
+    return (product.expiration_date is None, product.expiration_date,
+            next(_sell_sequence), product)
+
+
+def parse_date(text):
+    """Return a date in YYYY-MM-DD format as a datetime.date, or None
+    if text is empty."""
+    if not text:
+        return None
+    date = _parsed_dates.get(text)
+    if date is None:
+        date = _parsed_dates[text] = datetime.date.fromisoformat(text)
+    return date
+
+
+def format_date(date):
+    """Return a datetime.date in YYYY-MM-DD format, or '' for None."""
+    return '' if date is None else date.isoformat()
+
+
+def to_cents(price):
+    """Return a price given as a number or text as an integer number of
+    cents, or None if price is None or empty."""
+    if price is None or price == '':
+        return None
+    if not isinstance(price, str):
+        return round(float(price) * 100)
+    cents = _parsed_prices.get(price)
+    if cents is None:
+        cents = _parsed_prices[price] = round(float(price) * 100)
+    return cents
+
+
+def format_price(cents):
+    """Return a price in cents as it is written to 'products.csv', e.g.
+    150 becomes '1.5', or '' for None."""
+    return '' if cents is None else str(cents / 100)
+
+
+class Product:
+    """A recorded product whose fields have been parsed once.
+
+    Dates are datetime.date objects (None if the product does not
+    expire or has not been sold), prices are integer numbers of cents
+    (None if the product has not been sold) and names are interned.
+    Products with the same dates share the same date objects, so that
+    a large inventory takes a fraction of the memory of csv rows.
+    """
+
+    __slots__ = tuple(PRODUCT_FIELDNAMES)
+
+    def __init__(self, id, product_name, buy_date, buy_price,
+                 expiration_date=None, sell_date=None, sell_price=None):
+        self.id = id
+        self.product_name = sys.intern(product_name)
+        self.buy_date = buy_date
+        self.buy_price = buy_price
+        self.expiration_date = expiration_date
+        self.sell_date = sell_date
+        self.sell_price = sell_price
+
+    @classmethod
+    def from_row(cls, row):
+        """Parse a row of text in the order of PRODUCT_FIELDNAMES."""
+        (product_id, product_name, buy_date, buy_price, expiration_date,
+         sell_date, sell_price) = row
+        return cls(product_id, product_name, parse_date(buy_date),
+                   to_cents(buy_price), parse_date(expiration_date),
+                   parse_date(sell_date), to_cents(sell_price))
+
+    def to_row(self):
+        """Return the product as a row of text in the order of
+        PRODUCT_FIELDNAMES."""
+        return [self.id, self.product_name, format_date(self.buy_date),
+                format_price(self.buy_price),
+                format_date(self.expiration_date),
+                format_date(self.sell_date), format_price(self.sell_price)]
+
+    def __repr__(self):
+        return f'Product({", ".join(map(repr, self.to_row()))})'
+
+
+@contextlib.contextmanager
+def pause_garbage_collection():
+    """Pause the cyclic garbage collector while products are loaded.
+
+    Products never refer to each other, but creating a million of them
+    would otherwise trigger ever slower full collections.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def read_product_rows(csv_file, header=None):
+    """Parse each row of a csv file with products into a Product.
+
+    The columns may be in any order, as long as the header names them.
+    The header is read from the file, unless it is given because the
+    file is read from the middle.
+    """
+    reader = csv.reader(csv_file)
+    if header is None:
+        header = next(reader, PRODUCT_FIELDNAMES)
+    rows = reader
+    if header != PRODUCT_FIELDNAMES:
+        positions = [header.index(fieldname)
+                     for fieldname in PRODUCT_FIELDNAMES]
+        rows = ([row[position] for position in positions] if row else row
+                for row in reader)
+    for row in rows:
+        # Skip empty lines, like csv.DictReader does.
+        if row:
+            yield Product.from_row(row)
+
+
+def split_csv_file(filename, chunk_bytes):
+    """Split a csv file into byte ranges starting and ending at line
+    boundaries.
+
+    Parameters
+    ----------
+    filename : str
+        The name of an uncompressed csv file without line breaks inside
+        its fields, like the files written by SuperPy.
+    chunk_bytes : int
+        The approximate size of each range.
+
+    Returns
+    -------
+    header : list
+        The names of the columns.
+    ranges : list
+        Tuples of the first byte and the byte after the last byte of
+        each range, covering every row after the header.
+    identity : tuple
+        The inode and size of the file, which the ranges are only valid
+        for.
+    """
+    with open(filename, 'rb') as csv_file:
+        header = next(csv.reader([csv_file.readline().decode()]),
+                      PRODUCT_FIELDNAMES)
+        file_stat = os.fstat(csv_file.fileno())
+        boundaries = [csv_file.tell()]
+        while boundaries[-1] < file_stat.st_size:
+            # Each range ends at the end of the line it would split.
+            csv_file.seek(boundaries[-1] + chunk_bytes)
+            csv_file.readline()
+            boundaries.append(min(csv_file.tell(), file_stat.st_size))
+    return header, list(zip(boundaries, boundaries[1:])), \
+        (file_stat.st_ino, file_stat.st_size)
+
+
+def scan_product_chunk(filename, identity, header, byte_range, function,
+                       args):
+    """Parse the products in a byte range of a csv file and pass them
+    to function(products, *args).
+
+    Runs in a worker process started by map_product_chunks.
+
+    Returns
+    -------
+    result : tuple or None
+        The number of parsed products along with the result of the
+        function, or None if the file has been replaced in the meantime.
+    """
+    start, end = byte_range
+    with open(filename, 'rb') as csv_file:
+        file_stat = os.fstat(csv_file.fileno())
+        # Products may have been appended since, but the file must not
+        # have been replaced.
+        if file_stat.st_ino != identity[0] or \
+                file_stat.st_size < identity[1]:
+            return None
+        csv_file.seek(start)
+        lines = csv_file.read(end - start).decode().splitlines(True)
+    with pause_garbage_collection():
+        products = list(read_product_rows(lines, header))
+    return len(products), function(products, *args)
+
+
+def map_product_chunks(filename, function, *args):
+    """Call a function for each chunk of a large csv file in parallel.
+
+    Parameters
+    ----------
+    filename : str
+        The name of a csv file with products.
+    function : function
+        A function taking a list of products followed by args, which
+        returns a compact partial result (e.g. counts or sums). It has
+        to be defined at the top level of a module, so that it can be
+        passed to the worker processes.
+    *args
+        Further arguments to be passed to the function.
+
+    Returns
+    -------
+    results : list or None
+        The result of the function for each chunk in the order of the
+        file, or None if the file is too small to be worth splitting,
+        there is only a single worker or the file has been replaced
+        while it was being read.
+    """
+    if PARALLEL_WORKERS < 2 or not os.path.exists(filename) or \
+            os.path.getsize(filename) < PARALLEL_MIN_BYTES:
+        return None
+    from concurrent.futures import ProcessPoolExecutor
+    header, ranges, identity = split_csv_file(filename, PARALLEL_CHUNK_BYTES)
+    if not ranges:
+        return None
+
+    timings.count_file('bytes_read', filename)
+    results = []
+    with ProcessPoolExecutor(
+            max_workers=min(len(ranges), PARALLEL_WORKERS)) as executor:
+        for chunk_result in executor.map(
+                scan_product_chunk, itertools.repeat(filename),
+                itertools.repeat(identity), itertools.repeat(header),
+                ranges, itertools.repeat(function), itertools.repeat(args)):
+            if chunk_result is None:
+                return None
+            row_count, result = chunk_result
+            timings.count('rows_scanned', row_count)
+            results.append(result)
+    return results
+
+
+def sum_sales(products, sell_dates=None):
+    """Add up the sales of products for each date they have been sold.
+
+    Parameters
+    ----------
+    products : iterable
+        The products to be added up.
+    sell_dates : set, optional
+        Only add up the sales of these dates (datetime.date objects).
+
+    Returns
+    -------
+    sums : dict
+        A dictionary mapping each sell date to a list of the costs and
+        revenue in cents and the number of sold products.
+    """
+    # Prices are added up in cents, which is exact and cheaper than
+    # adding up floats.
+    sums = {}
+    for product in products:
+        sell_date = product.sell_date
+        if sell_date is None or (sell_dates is not None and
+                                 sell_date not in sell_dates):
+            continue
+        date_sums = sums.get(sell_date)
+        if date_sums is None:
+            date_sums = sums[sell_date] = [0, 0, 0]
+        date_sums[0] += product.buy_price
+        date_sums[1] += product.sell_price
+        date_sums[2] += 1
+    return sums
+
+
+def count_in_stock(products, today):
+    """Count the products of each name that are in stock on today (a
+    datetime.date)."""
+    counts = {}
+    for product in products:
+        if product.sell_date is None and today >= product.buy_date:
+            counts[product.product_name] = \
+                counts.get(product.product_name, 0) + 1
+    return counts
+
+
+@timings.timed('stock checks')
+def build_stock_index(all_products, current_date):
+    """Index all products in a single pass over the inventory.
+
+    Parameters
+    ----------
+    all_products : iterable
+        Each and every recorded product.
+    current_date : str
+        The current date in YYYY-MM-DD format.
+
+    Returns
+    -------
+    stock_index : dict
+        A dictionary containing the following keys:
+
+        * current_date: the date the index has been built for, in
+          YYYY-MM-DD format
+        * in_stock: a dictionary mapping each product name to a list
+          of products with that name that are in stock, in the order
+          in which they have been recorded
+    """
+    today = parse_date(current_date)
+    in_stock = {}
+    for product in all_products:
+        # Products are considered sold when they have a clearly defined
+        # selling date, and are available for sale from the day they
+        # have been bought.
+        if product.sell_date is None and today >= product.buy_date:
+            in_stock.setdefault(product.product_name, []).append(product)
+
+    return {
+        'current_date': current_date,
+        'in_stock': in_stock,
+    }
+
+
+class CsvStorage:
+    """Store each product as a row in 'products.csv'.
+
+    Financial records are kept in 'financial_records.csv', to which
+    each recorded date is appended. The last row of a date holds its
+    current figures, and the rows that have been superseded are dropped
+    once they outnumber the current ones.
+    """
+
+    name = 'csv'
+    products_filename = 'products.csv'
+    financial_records_filename = 'financial_records.csv'
+    daily_totals_filename = 'daily_totals.csv'
+    archive_directory = 'archive'
+
+    def __init__(self):
+        # The files are kept in the directory of the selected store.
+        self.products_filename = data_path(self.products_filename)
+        self.financial_records_filename = data_path(
+            self.financial_records_filename)
+        self.daily_totals_filename = data_path(self.daily_totals_filename)
+        self.archive_directory = data_path(self.archive_directory)
+        # Products that have been loaded most recently along with the
+        # signature of the files they have been read from, so that they
+        # can be reused for as long as nobody else changes these files.
+        self._all_products = None
+        self._signature = None
+        self._stock_index = None
+        # Financial records keyed by date along with the signature of
+        # their file and the number of its rows that have been
+        # superseded by a later row for the same date.
+        self._financial_records = None
+        self._financial_records_signature = None
+        self._superseded_records = 0
+        # Daily totals along with the signature of their file.
+        self._daily_totals = None
+        self._daily_totals_signature = None
+
+    def cache_is_current(self):
+        """Check if the loaded products still match the files on disk."""
+        return self._all_products is not None and \
+            self._signature == self.snapshot_signature()
+
+    def load_products(self):
+        """Return a list of each and every recorded product.
+
+        The products are only read from disk if they have not been
+        loaded before or the files have been changed by someone else.
+        """
+        if not self.cache_is_current():
+            # Take the signature first, so that changes made while
+            # reading make the next call read the files again.
+            self._signature = self.snapshot_signature()
+            self._all_products = self.read_products()
+            self._stock_index = None
+        return self._all_products
+
+    @timings.timed('read')
+    def read_products(self):
+        """Read each and every recorded product from 'products.csv'."""
+        timings.count_file('bytes_read', self.products_filename)
+        with open(self.products_filename, newline='') as csv_file, \
+                pause_garbage_collection():
+            products = list(read_product_rows(csv_file))
+        timings.count('rows_scanned', len(products))
+        return products
+
+    def iter_products(self):
+        """Stream each recorded product without keeping them in memory."""
+        if self.cache_is_current():
+            timings.count('rows_scanned', len(self._all_products))
+            yield from self._all_products
+            return
+        timings.count_file('bytes_read', self.products_filename)
+        with open(self.products_filename, newline='') as csv_file:
+            for product in read_product_rows(csv_file):
+                timings.count('rows_scanned')
+                yield product
+
+    def map_products(self, function, *args):
+        """Call function(products, *args) for all recorded products.
+
+        Returns
+        -------
+        results : list
+            The results of the function, which have to be merged by the
+            caller. Unless the products are already in memory, a large
+            'products.csv' is split into chunks that are passed to the
+            function in parallel by map_product_chunks. Otherwise, the
+            function is called once with all products.
+        """
+        if not self.cache_is_current() and \
+                self.product_filenames() == [self.products_filename]:
+            results = map_product_chunks(self.products_filename, function,
+                                         *args)
+            if results is not None:
+                return results
+        return [function(self.iter_products(), *args)]
+
+    def snapshot_signature(self):
+        """Return the name, size, modification time and inode of each
+        file the products are read from, which changes whenever a
+        product does. The inode changes whenever a file is replaced.
+        """
+        signature = []
+        for filename in self.product_filenames():
+            if os.path.exists(filename):
+                file_stat = os.stat(filename)
+                signature.append([filename, file_stat.st_size,
+                                  file_stat.st_mtime_ns, file_stat.st_ino])
+        return signature
+
+    def product_filenames(self):
+        """Return the names of the files the products are read from."""
+        return [self.products_filename]
+
+    def load_stock_index(self, current_date, product_name=None):
+        """Return the stock index for the current date.
+
+        The whole inventory is indexed in a single pass, regardless of
+        product_name. The index is kept up to date on every purchase and
+        sale made through this backend, so it is only rebuilt when the
+        date or the files on disk change.
+        """
+        all_products = self.load_products()
+        if self._stock_index is None or \
+                self._stock_index['current_date'] != current_date:
+            self._stock_index = build_stock_index(all_products, current_date)
+        return self._stock_index
+
+    def iter_products_in_stock(self, current_date, name_filter=None):
+        """Yield each product in stock, sorted by name.
+
+        Products with the same name are yielded in the order in which
+        they have been recorded. Only names containing name_filter are
+        included, if it has been given.
+        """
+        in_stock = self.load_stock_index(current_date)['in_stock']
+        for product_name in sorted(in_stock):
+            if name_matches(product_name, name_filter):
+                yield from in_stock[product_name]
+
+    @timings.timed('read')
+    def count_products_in_stock(self, current_date, name_filter=None):
+        """Return the name and number of each product in stock.
+
+        Unless the products are already in memory, they are streamed
+        from disk (in parallel chunks if the file is large), so that
+        only one count per product name is kept.
+        """
+        if self.cache_is_current():
+            in_stock = self.load_stock_index(current_date)['in_stock']
+            counts = {product_name: len(products)
+                      for product_name, products in in_stock.items()}
+        else:
+            counts = {}
+            for partial_counts in self.map_products(
+                    count_in_stock, parse_date(current_date)):
+                for product_name, count in partial_counts.items():
+                    counts[product_name] = counts.get(product_name, 0) + count
+        return [(product_name, counts[product_name])
+                for product_name in sorted(counts)
+                if name_matches(product_name, name_filter)]
+
+    def write_through(self, cache_was_current, added_products=(),
+                      sold_products=()):
+        """Apply purchases and sales that have just been stored to the
+        loaded products and stock index.
+
+        If the loaded products were already out of date before the
+        change, they are dropped instead.
+        """
+        if not cache_was_current:
+            self._all_products = None
+            self._stock_index = None
+            return
+
+        self._all_products.extend(added_products)
+        self._signature = self.snapshot_signature()
+
+        stock_index = self._stock_index
+        if stock_index is None:
+            return
+        today = parse_date(stock_index['current_date'])
+        sellable = stock_index.get('sellable', {})
+        for product in added_products:
+            if today >= product.buy_date:
+                stock_index['in_stock'].setdefault(
+                    product.product_name, []).append(product)
+                if product.product_name in sellable and \
+                        (product.expiration_date is None or
+                         product.expiration_date >= today):
+                    heapq.heappush(sellable[product.product_name],
+                                   sellable_entry(product))
+        sold_ids = {}
+        for product in sold_products:
+            sold_ids.setdefault(product.product_name, set()).add(product.id)
+        # The sold products of each name are removed in a single pass,
+        # however many of them have been sold at once.
+        for product_name, ids in sold_ids.items():
+            in_stock = stock_index['in_stock'].get(product_name, [])
+            in_stock[:] = [product for product in in_stock
+                           if product.id not in ids]
+            if not in_stock:
+                stock_index['in_stock'].pop(product_name, None)
+
+    def discard_cache(self):
+        """Forget the loaded products, stock index and daily totals, so
+        that they are read from disk again, e.g. after storing a sale
+        has failed."""
+        self._all_products = None
+        self._signature = None
+        self._stock_index = None
+        self._daily_totals = None
+        self._daily_totals_signature = None
+
+    @timings.timed('write')
+    def add_products(self, products):
+        """Append newly bought products to 'products.csv'."""
+        products = list(products)
+        with lock_files():
+            cache_was_current = self.cache_is_current()
+            with open(self.products_filename, 'a', newline='') as csv_file:
+                size = csv_file.tell()
+                product_writer = csv.writer(csv_file)
+                product_writer.writerows(product.to_row()
+                                         for product in products)
+                timings.count('bytes_written', csv_file.tell() - size)
+            self.write_through(cache_was_current, added_products=products)
+
+    @timings.timed('write')
+    def sell_products(self, sold_products):
+        """Persist sold products by replacing 'products.csv' at once.
+
+        The sold products are expected to have been loaded by this
+        backend and to already have a selling date and price in cents.
+        To make sure no other process has sold them in the meantime,
+        they should have been loaded while holding lock_files.
+        """
+        with lock_files():
+            cache_was_current = self.cache_is_current()
+            all_products = self.load_products()
+            sold_products = {product.id: product
+                             for product in sold_products}
+            all_products[:] = [sold_products.get(product.id, product)
+                               for product in all_products]
+
+            write_csv_atomically(self.products_filename, PRODUCT_FIELDNAMES,
+                                 (product.to_row()
+                                  for product in all_products))
+            self.write_through(cache_was_current,
+                               sold_products=sold_products.values())
+            self.update_daily_totals(sold_products.values())
+
+    @timings.timed('read')
+    def sold_products(self, date):
+        """Return a list of products that have been sold on date.
+
+        Products that have been archived are read from the partition of
+        the month of date.
+        """
+        sell_date = parse_date(date)
+        return [product for product in self.load_products()
+                if product.sell_date == sell_date] + \
+            list(self.iter_archived_products(date, date))
+
+    @timings.timed('read')
+    def sold_products_between(self, start_date, end_date):
+        """Return a list of products sold from start_date to end_date,
+        including those in the archived partitions of these months."""
+        first_date = parse_date(start_date)
+        last_date = parse_date(end_date)
+        return [product for product in self.iter_products()
+                if product.sell_date is not None and
+                first_date <= product.sell_date <= last_date] + \
+            list(self.iter_archived_products(start_date, end_date))
+
+    @timings.timed('read')
+    def scan_sales(self, dates=None):
+        """Add up the sales of several dates in a single pass over all
+        products, which is split into parallel chunks for a large file.
+
+        Parameters
+        ----------
+        dates : iterable, optional
+            The dates to aggregate the sales for. If omitted, every date
+            on which a product has been sold is aggregated.
+
+        Returns
+        -------
+        totals : dict
+            A dictionary mapping each date to a dictionary with the
+            costs and revenue in cents and the number of sold products
+            ('sold_count'). Requested dates without sales have zero
+            totals.
+        """
+        totals = {}
+        requested_dates = None
+        archived_products = ()
+        if dates is None:
+            archived_products = self.iter_archived_products()
+        else:
+            totals = {date: empty_totals() for date in dates}
+            requested_dates = {parse_date(date) for date in totals}
+            # Only the partitions of the requested months are read.
+            if totals:
+                archived_products = self.iter_archived_products(
+                    min(totals), max(totals))
+
+        sums = {}
+        for partial_sums in self.map_products(sum_sales, requested_dates) \
+                + [sum_sales(archived_products, requested_dates)]:
+            for sell_date, date_sums in partial_sums.items():
+                if sell_date in sums:
+                    sums[sell_date] = [total + value for total, value
+                                       in zip(sums[sell_date], date_sums)]
+                else:
+                    sums[sell_date] = date_sums
+
+        for sell_date, (costs, revenue, sold_count) in sums.items():
+            totals[sell_date.isoformat()] = {
+                'costs': costs,
+                'revenue': revenue,
+                'sold_count': sold_count,
+            }
+        return totals
+
+    def aggregate_sales(self, dates=None):
+        """Look up the sales of several dates in the daily totals.
+
+        Takes the same parameters and returns the same totals as
+        scan_sales, but without reading any product.
+        """
+        daily_totals = self.load_daily_totals()
+        if dates is None:
+            return daily_totals
+        return {date: daily_totals.get(date, empty_totals()) for date in dates}
+
+    def daily_totals_signature(self):
+        """Return the size, modification time and inode of the file
+        holding the daily totals, or None if it does not exist."""
+        try:
+            file_stat = os.stat(self.daily_totals_filename)
+        except FileNotFoundError:
+            return None
+        return file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino
+
+    @timings.timed('read')
+    def load_daily_totals(self):
+        """Return the daily totals, which are kept up to date on every
+        sale in 'daily_totals.csv'.
+
+        The file holds the costs and revenue in dollars, while the
+        returned totals are in cents, like those of scan_sales. The
+        totals are rebuilt from all products if the file does not
+        exist yet, and are only read again once the file has been
+        changed by someone else.
+        """
+        signature = self.daily_totals_signature()
+        if signature is None:
+            return self.rebuild_daily_totals()
+        if self._daily_totals_signature == signature:
+            return self._daily_totals
+
+        timings.count_file('bytes_read', self.daily_totals_filename)
+        with open(self.daily_totals_filename, newline='') as csv_file:
+            self._daily_totals = {row['date']: {
+                'costs': to_cents(float(row['costs'])),
+                'revenue': to_cents(float(row['revenue'])),
+                'sold_count': int(row['sold_count']),
+            } for row in csv.DictReader(csv_file)}
+        self._daily_totals_signature = signature
+        return self._daily_totals
+
+    def write_daily_totals(self, daily_totals):
+        """Replace 'daily_totals.csv' with the given daily totals."""
+        write_csv_atomically(
+            self.daily_totals_filename,
+            DAILY_TOTAL_FIELDNAMES,
+            ([date, format_price(totals['costs']),
+              format_price(totals['revenue']), totals['sold_count']]
+             for date, totals in sorted(daily_totals.items()))
+        )
+        self._daily_totals = daily_totals
+        self._daily_totals_signature = self.daily_totals_signature()
+
+    def update_daily_totals(self, sold_products):
+        """Add newly sold products to the daily totals.
+
+        This has to be called after the sold products have been stored,
+        because missing daily totals are rebuilt from all products.
+        """
+        with lock_files():
+            if not os.path.exists(self.daily_totals_filename):
+                self.rebuild_daily_totals()
+                return
+
+            daily_totals = self.load_daily_totals()
+            # The loaded totals are only valid again once written.
+            self._daily_totals_signature = None
+            for product in sold_products:
+                totals = daily_totals.setdefault(
+                    product.sell_date.isoformat(), empty_totals())
+                totals['costs'] += product.buy_price
+                totals['revenue'] += product.sell_price
+                totals['sold_count'] += 1
+            self.write_daily_totals(daily_totals)
+
+    def rebuild_daily_totals(self):
+        """Recompute the daily totals from all products and store them.
+
+        Returns
+        -------
+        daily_totals : dict
+            The rebuilt totals, as returned by scan_sales.
+        """
+        with lock_files():
+            daily_totals = self.scan_sales()
+            self.write_daily_totals(daily_totals)
+        return daily_totals
+
+    def financial_records_signature(self):
+        """Return the size, modification time and inode of the file
+        holding the financial records."""
+        file_stat = os.stat(self.financial_records_filename)
+        return file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino
+
+    @timings.timed('read')
+    def load_financial_records_by_date(self):
+        """Return a dictionary mapping each recorded date to its record.
+
+        The file is only read again once it has been changed by someone
+        else. A date keeps the position of its first row and the values
+        of its last row.
+        """
+        signature = self.financial_records_signature()
+        if self._financial_records is None or \
+                self._financial_records_signature != signature:
+            timings.count_file('bytes_read', self.financial_records_filename)
+            records = {}
+            row_count = 0
+            with open(self.financial_records_filename,
+                      newline='') as csv_file:
+                for record in csv.DictReader(csv_file):
+                    # Skip a row that has only been partly written, e.g.
+                    # because of a power failure.
+                    if None in record or None in record.values():
+                        continue
+                    row_count += 1
+                    records[record['date']] = record
+            self._financial_records = records
+            self._financial_records_signature = signature
+            self._superseded_records = row_count - len(records)
+        return self._financial_records
+
+    def load_financial_records(self):
+        """Return a list of all recorded financial records."""
+        return list(self.load_financial_records_by_date().values())
+
+    @timings.timed('write')
+    def save_financial_records(self, new_records):
+        """Add or update several financial records.
+
+        The records are appended to the file, however many dates have
+        been recorded before, and supersede the earlier rows of their
+        dates. The file is compacted once most of its rows have been
+        superseded, which is only decided here, so that reading the
+        records never writes.
+        """
+        rows = [[str(record[fieldname])
+                 for fieldname in FINANCIAL_RECORD_FIELDNAMES]
+                for record in new_records]
+        with lock_files():
+            # Loading the records under the lock counts the superseded
+            # rows of the file, even in a process that has not read it
+            # before.
+            records = self.load_financial_records_by_date()
+            with open(self.financial_records_filename, 'a',
+                      newline='') as csv_file:
+                size = csv_file.tell()
+                csv.writer(csv_file).writerows(rows)
+                timings.count('bytes_written', csv_file.tell() - size)
+
+            # Keep the loaded records up to date, so that they do not
+            # have to be read again.
+            for row in rows:
+                if row[0] in records:
+                    self._superseded_records += 1
+                records[row[0]] = dict(zip(FINANCIAL_RECORD_FIELDNAMES, row))
+            self._financial_records_signature = \
+                self.financial_records_signature()
+            if self._superseded_records > len(records):
+                self.compact_financial_records()
+
+    def compact_financial_records(self):
+        """Rewrite the financial records with a single row per date."""
+        with lock_files():
+            records = self.load_financial_records_by_date()
+            write_csv_atomically(self.financial_records_filename,
+                                 FINANCIAL_RECORD_FIELDNAMES,
+                                 ([record[fieldname] for fieldname
+                                   in FINANCIAL_RECORD_FIELDNAMES]
+                                  for record in records.values()))
+            self._financial_records_signature = \
+                self.financial_records_signature()
+            self._superseded_records = 0
+
+    def archive_partitions(self):
+        """Return the name of each partition of archived products.
+
+        Returns
+        -------
+        partitions : dict
+            A dictionary mapping each month in YYYY-MM format to a list
+            of the files holding the products sold in that month. There
+            is only more than one file if archiving has been interrupted
+            while changing the compression of a partition.
+        """
+        partitions = {}
+        if os.path.isdir(self.archive_directory):
+            for filename in sorted(os.listdir(self.archive_directory)):
+                match = PARTITION_PATTERN.fullmatch(filename)
+                if match:
+                    partitions.setdefault(match['month'], []).append(
+                        os.path.join(self.archive_directory, filename))
+        return partitions
+
+    @timings.timed('read')
+    def read_partition(self, filenames):
+        """Read the archived products of a month from its files."""
+        products = {}
+        for filename in filenames:
+            timings.count_file('bytes_read', filename)
+            with open_csv(filename) as csv_file:
+                for product in read_product_rows(csv_file):
+                    products[product.id] = product
+        timings.count('rows_scanned', len(products))
+        return list(products.values())
+
+    def iter_archived_products(self, start_date=None, end_date=None):
+        """Yield the archived products sold from start_date to end_date.
+
+        Only the partitions of the months that overlap these dates are
+        read. Either date can be omitted to leave the period open.
+        """
+        start_date = start_date or '0001-01-01'
+        end_date = end_date or '9999-12-31'
+        first_date = parse_date(start_date)
+        last_date = parse_date(end_date)
+        for month, filenames in self.archive_partitions().items():
+            if start_date[:7] <= month <= end_date[:7]:
+                for product in self.read_partition(filenames):
+                    if first_date <= product.sell_date <= last_date:
+                        yield product
+
+    def archive(self, cutoff_date, compression='none'):
+        """Move the products sold before cutoff_date into a partition
+        for each month they have been sold in.
+
+        Parameters
+        ----------
+        cutoff_date : str
+            Products sold before this date in YYYY-MM-DD format are
+            archived.
+        compression : str, optional
+            The compression of the partitions that are written, one of
+            the keys of ARCHIVE_EXTENSIONS (defaults to 'none').
+
+        Returns
+        -------
+        tuple
+            The number of archived products and the names of the
+            partitions they have been added to. Products that are
+            already in a partition are merged with it by id, so
+            archiving again after an interruption never duplicates
+            them.
+        """
+        cutoff_date = parse_date(cutoff_date)
+        with lock_files():
+            archived_products = {}
+            active_products = []
+            for product in self.load_products():
+                if product.sell_date is not None and \
+                        product.sell_date < cutoff_date:
+                    archived_products.setdefault(
+                        product.sell_date.strftime('%Y-%m'), []).append(
+                            product)
+                else:
+                    active_products.append(product)
+            if not archived_products:
+                return 0, []
+
+            os.makedirs(self.archive_directory, exist_ok=True)
+            partitions = self.archive_partitions()
+            written_filenames = []
+            for month, products in sorted(archived_products.items()):
+                filename = os.path.join(
+                    self.archive_directory,
+                    f'products-{month}{ARCHIVE_EXTENSIONS[compression]}')
+                previous_filenames = partitions.get(month, [])
+                products = self.read_partition(previous_filenames) + products
+                products = {product.id: product for product in products}
+                write_csv_atomically(filename, PRODUCT_FIELDNAMES,
+                                     (product.to_row()
+                                      for product in products.values()))
+                for previous_filename in previous_filenames:
+                    if previous_filename != filename:
+                        os.remove(previous_filename)
+                written_filenames.append(filename)
+
+            # The partitions are complete before the archived products
+            # are removed from the hot file.
+            write_csv_atomically(self.products_filename, PRODUCT_FIELDNAMES,
+                                 (product.to_row()
+                                  for product in active_products))
+            self._all_products = None
+            self._stock_index = None
+        return sum(map(len, archived_products.values())), written_filenames
+
+
+class EventLogStorage(CsvStorage):
+    """Append buy and sell events to a log on top of a snapshot.
+
+    The current state of the inventory is rebuilt by replaying the log
+    on top of 'products.csv'. As soon as the log grows beyond
+    compaction_threshold bytes, it is folded into a new snapshot.
+    Replaying is idempotent, so a crash in between writing the snapshot
+    and truncating the log never duplicates products.
+    """
+
+    name = 'log'
+    log_filename = 'products_log.csv'
+    compaction_threshold = 1024 * 1024
+
+    def __init__(self):
+        super().__init__()
+        self.log_filename = data_path(self.log_filename)
+
+    @timings.timed('read')
+    def read_products(self):
+        """Read each and every recorded product by replaying the log."""
+        products = {product.id: product
+                    for product in super().read_products()}
+        if os.path.exists(self.log_filename):
+            timings.count_file('bytes_read', self.log_filename)
+            with open(self.log_filename, newline='') as csv_file, \
+                    pause_garbage_collection():
+                event_reader = csv.DictReader(csv_file)
+                for event in event_reader:
+                    timings.count('rows_scanned')
+                    # Skip a trailing event that has only been partly
+                    # written, e.g. because of a power failure.
+                    if None in event.values():
+                        continue
+                    if event['event'] == 'buy':
+                        if event['id'] not in products:
+                            products[event['id']] = Product(
+                                event['id'], event['product_name'],
+                                parse_date(event['date']),
+                                to_cents(event['price']),
+                                parse_date(event['expiration_date']))
+                    elif event['event'] == 'sell' and \
+                            event['id'] in products:
+                        product = products[event['id']]
+                        product.sell_date = parse_date(event['date'])
+                        product.sell_price = to_cents(event['price'])
+
+        return list(products.values())
+
+    def iter_products(self):
+        """Return an iterator over each and every recorded product.
+
+        The log has to be replayed as a whole before any product is
+        known to be complete.
+        """
+        return iter(self.load_products())
+
+    def product_filenames(self):
+        """Return the names of the files the products are read from."""
+        return [self.products_filename, self.log_filename]
+
+    @timings.timed('write')
+    def append_events(self, events):
+        """Append events to the log and write its header if needed."""
+        with lock_files():
+            is_new_log = not os.path.exists(self.log_filename)
+            with open(self.log_filename, 'a', newline='') as csv_file:
+                size = csv_file.tell()
+                event_writer = csv.DictWriter(csv_file,
+                                              fieldnames=EVENT_FIELDNAMES)
+                if is_new_log:
+                    event_writer.writeheader()
+                event_writer.writerows(events)
+                timings.count('bytes_written', csv_file.tell() - size)
+
+    @timings.timed('write')
+    def add_products(self, products):
+        """Append a buy event for each newly bought product."""
+        products = list(products)
+        with lock_files():
+            cache_was_current = self.cache_is_current()
+            self.append_events({
+                'event': 'buy',
+                'id': product.id,
+                'product_name': product.product_name,
+                'date': format_date(product.buy_date),
+                'price': format_price(product.buy_price),
+                'expiration_date': format_date(product.expiration_date),
+            } for product in products)
+            self.write_through(cache_was_current, added_products=products)
+
+    @timings.timed('write')
+    def sell_products(self, sold_products):
+        """Append a sell event for each sold product.
+
+        The log is compacted afterwards if it has grown too large.
+        """
+        with lock_files():
+            cache_was_current = self.cache_is_current()
+            self.append_events({
+                'event': 'sell',
+                'id': product.id,
+                'product_name': product.product_name,
+                'date': format_date(product.sell_date),
+                'price': format_price(product.sell_price),
+                'expiration_date': format_date(product.expiration_date),
+            } for product in sold_products)
+            self.write_through(cache_was_current,
+                               sold_products=sold_products)
+            self.update_daily_totals(sold_products)
+
+            if os.path.getsize(self.log_filename) > \
+                    self.compaction_threshold:
+                self.compact()
+
+    def compact(self):
+        """Fold the log into a new snapshot and start an empty log."""
+        with lock_files():
+            cache_was_current = self.cache_is_current()
+            write_csv_atomically(self.products_filename, PRODUCT_FIELDNAMES,
+                                 (product.to_row()
+                                  for product in self.load_products()))
+            if os.path.exists(self.log_filename):
+                os.remove(self.log_filename)
+            self.write_through(cache_was_current)
+
+    def archive(self, cutoff_date, compression='none'):
+        """Compact the log and archive the products sold before
+        cutoff_date, as described in CsvStorage.archive."""
+        with lock_files():
+            self.compact()
+            return super().archive(cutoff_date, compression)
+
+
+class SqliteStorage:
+    """Store products and financial records in a SQLite database.
+
+    Selling looks up products through an index on their name, while
+    reports use an index on the selling date, so that each command
+    stays fast however long the history of the store grows.
+    """
+
+    name = 'sqlite'
+    database_filename = 'superpy.db'
+    schema = """
+        CREATE TABLE IF NOT EXISTS products (
+            id TEXT PRIMARY KEY,
+            product_name TEXT NOT NULL,
+            buy_date TEXT NOT NULL,
+            buy_price REAL NOT NULL,
+            expiration_date TEXT NOT NULL DEFAULT '',
+            sell_date TEXT NOT NULL DEFAULT '',
+            sell_price REAL
+        );
+        CREATE INDEX IF NOT EXISTS products_by_name
+            ON products (product_name, sell_date);
+        CREATE INDEX IF NOT EXISTS products_by_sell_date
+            ON products (sell_date);
+        CREATE INDEX IF NOT EXISTS products_by_expiration_date
+            ON products (expiration_date);
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            date TEXT PRIMARY KEY,
+            -- In cents since version 1 of the schema.
+            costs REAL NOT NULL,
+            revenue REAL NOT NULL,
+            sold_count INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS financial_records (
+            date TEXT PRIMARY KEY,
+            costs REAL NOT NULL,
+            revenue REAL NOT NULL,
+            profit REAL NOT NULL
+        );
+    """
+
+    def __init__(self):
+        self.database_filename = data_path(self.database_filename)
+        self._connection = None
+
+    @property
+    def connection(self):
+        """Open the database on first use and create missing tables."""
+        if self._connection is None:
+            # sqlite3 is imported here, so that the other backends do
+            # not have to pay for importing it.
+            import sqlite3
+            # A Store can be used from several threads, which never use
+            # the connection at the same time.
+            self._connection = sqlite3.connect(self.database_filename,
+                                               check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.executescript(self.schema)
+            self.upgrade_schema()
+        return self._connection
+
+    def upgrade_schema(self):
+        """Upgrade a database created by an earlier version of SuperPy.
+
+        Since version 1, the daily totals are kept in cents instead of
+        dollars, so that they are added up exactly. Older totals are
+        rebuilt from the products.
+        """
+        version_query = 'PRAGMA user_version'
+        if self._connection.execute(version_query).fetchone()[0] >= 1:
+            return
+        with lock_files():
+            # Another process may have upgraded the database meanwhile.
+            if self._connection.execute(version_query).fetchone()[0] < 1:
+                self.rebuild_daily_totals()
+                self._connection.execute('PRAGMA user_version = 1')
+
+    @staticmethod
+    def product_from_row(row):
+        """Convert a row of the products table into a Product."""
+        return Product(row['id'], row['product_name'],
+                       parse_date(row['buy_date']), to_cents(row['buy_price']),
+                       parse_date(row['expiration_date']),
+                       parse_date(row['sell_date']),
+                       to_cents(row['sell_price']))
+
+    @timings.timed('read')
+    def select_products(self, condition='1', parameters=()):
+        """Return products matching an SQL condition in buying order."""
+        rows = self.connection.execute(
+            f'SELECT * FROM products WHERE {condition} ORDER BY rowid',
+            parameters
+        )
+        with pause_garbage_collection():
+            products = [self.product_from_row(row) for row in rows]
+        timings.count('rows_scanned', len(products))
+        return products
+
+    def load_products(self):
+        """Return a list of each and every recorded product."""
+        return self.select_products()
+
+    def load_stock_index(self, current_date, product_name=None):
+        """Return the stock index for the current date.
+
+        If product_name has been given, only products with that name
+        are looked up.
+        """
+        condition = "sell_date = '' AND buy_date <= ?"
+        parameters = (current_date,)
+        if product_name is not None:
+            condition += ' AND product_name = ?'
+            parameters += (product_name,)
+
+        in_stock = {}
+        for product in self.select_products(condition, parameters):
+            in_stock.setdefault(product.product_name, []).append(product)
+
+        return {
+            'current_date': current_date,
+            'in_stock': in_stock,
+        }
+
+    def iter_products_in_stock(self, current_date, name_filter=None):
+        """Yield each product in stock, sorted by name.
+
+        See CsvStorage.iter_products_in_stock. Rows are fetched from the
+        database while they are being yielded.
+        """
+        rows = self.connection.execute(
+            "SELECT * FROM products WHERE sell_date = '' AND buy_date <= ? "
+            'ORDER BY product_name, rowid',
+            (current_date,)
+        )
+        for row in rows:
+            timings.count('rows_scanned')
+            if name_matches(row['product_name'], name_filter):
+                yield self.product_from_row(row)
+
+    @timings.timed('read')
+    def count_products_in_stock(self, current_date, name_filter=None):
+        """Return the name and number of each product in stock."""
+        rows = self.connection.execute(
+            'SELECT product_name, COUNT(*) FROM products '
+            "WHERE sell_date = '' AND buy_date <= ? "
+            'GROUP BY product_name ORDER BY product_name',
+            (current_date,)
+        )
+        return [(product_name, count) for product_name, count in rows
+                if name_matches(product_name, name_filter)]
+
+    @timings.timed('read')
+    def expiring_products(self, current_date, last_date):
+        """Return the products in stock that expire from current_date up
+        to and including last_date.
+
+        Only these products are looked up, through the index on the
+        expiration date, instead of the whole stock. They are sorted by
+        name, then by expiration date and then in buying order.
+        """
+        # Unsold products are too many for the index on the selling
+        # date to be a better choice.
+        rows = self.connection.execute(
+            'SELECT * FROM products INDEXED BY products_by_expiration_date '
+            'WHERE expiration_date BETWEEN ? AND ? '
+            "AND sell_date = '' AND buy_date <= ? "
+            'ORDER BY product_name, expiration_date, rowid',
+            (current_date, last_date, current_date)
+        )
+        with pause_garbage_collection():
+            products = [self.product_from_row(row) for row in rows]
+        timings.count('rows_scanned', len(products))
+        return products
+
+    def discard_cache(self):
+        """Do nothing, since products are always read from the database
+        and a failed write is rolled back."""
+
+    @timings.timed('write')
+    def add_products(self, products):
+        """Insert newly bought products."""
+        with lock_files(), self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((product.id,
+                  product.product_name,
+                  format_date(product.buy_date),
+                  product.buy_price / 100,
+                  format_date(product.expiration_date),
+                  format_date(product.sell_date),
+                  None if product.sell_price is None
+                  else product.sell_price / 100)
+                 for product in products)
+            )
+
+    @timings.timed('write')
+    def sell_products(self, sold_products):
+        """Set the selling date and price of sold products.
+
+        The daily totals are updated within the same transaction.
+        """
+        with lock_files(), self.connection:
+            self.connection.executemany(
+                'UPDATE products SET sell_date = ?, sell_price = ? '
+                'WHERE id = ?',
+                ((format_date(product.sell_date), product.sell_price / 100,
+                  product.id)
+                 for product in sold_products)
+            )
+            self.connection.executemany(
+                'INSERT INTO daily_totals VALUES (?, ?, ?, 1) '
+                'ON CONFLICT (date) DO UPDATE SET '
+                'costs = costs + excluded.costs, '
+                'revenue = revenue + excluded.revenue, '
+                'sold_count = sold_count + 1',
+                ((format_date(product.sell_date), product.buy_price,
+                  product.sell_price)
+                 for product in sold_products)
+            )
+
+    @timings.timed('read')
+    def sold_products(self, date):
+        """Return a list of products that have been sold on date."""
+        return self.select_products('sell_date = ?', (date,))
+
+    @timings.timed('read')
+    def sold_products_between(self, start_date, end_date):
+        """Return a list of products sold from start_date to end_date."""
+        return self.select_products("sell_date BETWEEN ? AND ?",
+                                    (start_date, end_date))
+
+    def iter_products(self):
+        """Stream each recorded product without keeping them in memory."""
+        rows = self.connection.execute('SELECT * FROM products ORDER BY rowid')
+        return (self.product_from_row(row) for row in rows)
+
+    @timings.timed('read')
+    def scan_sales(self, dates=None):
+        """Add up the sales of several dates in a single query over all
+        products.
+
+        See CsvStorage.scan_sales.
+        """
+        totals = {}
+        condition = "sell_date != ''"
+        parameters = ()
+        if dates is not None:
+            totals = {date: empty_totals() for date in dates}
+            # Stay well within the limit on the number of parameters and
+            # skip dates that have not been requested afterwards instead.
+            if len(totals) <= 500:
+                condition = f'sell_date IN ({", ".join("?" * len(totals))})'
+                parameters = tuple(totals)
+
+        # Prices are stored in dollars, but added up in cents.
+        rows = self.connection.execute(
+            'SELECT sell_date, '
+            'SUM(CAST(ROUND(buy_price * 100) AS INTEGER)), '
+            'SUM(CAST(ROUND(sell_price * 100) AS INTEGER)), COUNT(*) '
+            f'FROM products WHERE {condition} GROUP BY sell_date',
+            parameters
+        )
+        for sell_date, costs, revenue, sold_count in rows:
+            timings.count('rows_scanned', sold_count)
+            if dates is None or sell_date in totals:
+                totals[sell_date] = {
+                    'costs': costs,
+                    'revenue': revenue,
+                    'sold_count': sold_count,
+                }
+
+        return totals
+
+    def aggregate_sales(self, dates=None):
+        """Look up the sales of several dates in the daily totals.
+
+        See CsvStorage.aggregate_sales.
+        """
+        daily_totals = self.load_daily_totals()
+        if dates is None:
+            return daily_totals
+        return {date: daily_totals.get(date, empty_totals()) for date in dates}
+
+    @timings.timed('read')
+    def load_daily_totals(self):
+        """Return the daily totals, which are kept up to date on every
+        sale in the daily_totals table.
+
+        The totals are rebuilt from all products if the table is empty
+        while products have been sold, e.g. in a database that has been
+        created before the table existed.
+        """
+        rows = self.connection.execute('SELECT * FROM daily_totals').fetchall()
+        if not rows and self.connection.execute(
+                "SELECT 1 FROM products WHERE sell_date != '' LIMIT 1"
+        ).fetchone():
+            return self.rebuild_daily_totals()
+
+        return {row['date']: {
+            'costs': int(row['costs']),
+            'revenue': int(row['revenue']),
+            'sold_count': row['sold_count'],
+        } for row in rows}
+
+    def rebuild_daily_totals(self):
+        """Recompute the daily totals from all products and store them.
+
+        See CsvStorage.rebuild_daily_totals.
+        """
+        with lock_files(), self.connection:
+            daily_totals = self.scan_sales()
+            self.connection.execute('DELETE FROM daily_totals')
+            self.connection.executemany(
+                'INSERT INTO daily_totals VALUES (?, ?, ?, ?)',
+                ((date, totals['costs'], totals['revenue'],
+                  totals['sold_count'])
+                 for date, totals in daily_totals.items())
+            )
+        return daily_totals
+
+    @timings.timed('read')
+    def load_financial_records(self):
+        """Return a list of all recorded financial records."""
+        rows = self.connection.execute(
+            'SELECT * FROM financial_records ORDER BY rowid'
+        )
+        return [{key: str(value) for key, value in dict(row).items()}
+                for row in rows]
+
+    @timings.timed('write')
+    def save_financial_records(self, records):
+        """Add or update several financial records at once."""
+        with lock_files(), self.connection:
+            self.connection.executemany(
+                'INSERT INTO financial_records VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (date) DO UPDATE SET costs = excluded.costs, '
+                'revenue = excluded.revenue, profit = excluded.profit',
+                ((record['date'], float(record['costs']),
+                  float(record['revenue']), float(record['profit']))
+                 for record in records)
+            )
+
+    def import_csv(self):
+        """Import 'products.csv' and 'financial_records.csv'.
+
+        Pending events in 'products_log.csv' are replayed first, so the
+        data of either csv backend can be imported, and archived
+        products are imported as well. Products and records that have
+        been imported before are replaced.
+
+        Returns
+        -------
+        tuple
+            The number of imported products and financial records.
+        """
+        csv_storage = EventLogStorage()
+        products = csv_storage.load_products() + \
+            list(csv_storage.iter_archived_products())
+        records = csv_storage.load_financial_records()
+        self.add_products(products)
+        self.save_financial_records(records)
+        self.rebuild_daily_totals()
+        return len(products), len(records)
+
+
+BACKENDS = {
+    'csv': CsvStorage,
+    'log': EventLogStorage,
+    'sqlite': SqliteStorage,
+}
+_storage = None
+
+
+def set_storage(name):
+    """Select the storage backend to be used by SuperPy.
+
+    Parameters
+    ----------
+    name : str
+        The name of one of the backends in BACKENDS.
+
+    Returns
+    -------
+    None : None
+        Subsequent calls to get_storage return a new instance of the
+        backend for the selected store.
+    """
+    global _storage
+    _storage = BACKENDS[name]()
+
+
+def get_storage():
+    """Return the selected storage backend.
+
+    If no backend has been selected yet, the one named by the
+    SUPERPY_STORAGE environment variable is used (defaults to 'csv').
+    """
+    if _storage is None:
+        set_storage(os.environ.get('SUPERPY_STORAGE', 'csv'))
+    return _storage
+
+
+def get_selection():
+    """Return the selected store and backend, so that they can be
+    selected again later with set_selection."""
+    return dict(_store), _storage
+
+
+def set_selection(selection):
+    """Select a store and backend returned by get_selection."""
+    global _storage
+    store, _storage = selection
+    _store.update(store)
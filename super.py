@@ -1,9 +1,15 @@
 # Imports
+import time
+IMPORT_START = time.perf_counter()
 import argparse
-import csv
+import json
 import os
+import storage
 import superpy as sp
-from datetime import date, datetime
+import sys
+import timings
+from datetime import datetime
+IMPORT_TIME = time.perf_counter() - IMPORT_START
 
 # Do not change these lines.
 __winc_id__ = 'a2bc36ea784242e4989deb157d527ba0'
@@ -11,47 +17,82 @@ __human_name__ = 'superpy'
 
 
 # Your code below this line.
-def generate_current_date_file():
-    """Create text file that stores and keeps track of current date."""
-    filename = 'current_date.txt'
-    if not os.path.exists(filename):
-        with open(filename, 'w') as text_file:
-            text_file.write(date.today().strftime('%Y-%m-%d'))
-
-
-def generate_products_file():
-    """Create csv file that stores information about each product."""
-    filename = 'products.csv'
-    if not os.path.exists(filename):
-        with open(filename, 'w', newline='') as csv_file:
-            fieldnames = [
-                'id',
-                'product_name',
-                'buy_date',
-                'buy_price',
-                'expiration_date',
-                'sell_date',
-                'sell_price'
-            ]
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
-
-
-def generate_financial_records_file():
-    """Create csv file that records financial information for each day."""
-    filename = 'financial_records.csv'
-    if not os.path.exists(filename):
-        with open(filename, 'w', newline='') as csv_file:
-            fieldnames = ['date', 'costs', 'revenue', 'profit']
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
-
-
-def generate_parser():
-    """Generate parser along with subparsers and arguments."""
+# The Store of each store name and backend that has been used, so that
+# the commands of a shell or daemon share its loaded products.
+_stores = {}
+
+
+def store_name(text):
+    """Check that the name of a store can be used as a directory name."""
+    if not storage.STORE_NAME_PATTERN.fullmatch(text):
+        raise argparse.ArgumentTypeError(
+            f'invalid store name {text!r} (use letters, digits, _ and -)')
+    return text
+
+
+def build_parser():
+    """Build parser along with subparsers and arguments."""
     parser = argparse.ArgumentParser(
         description='SuperPy inventory tracking tool'
     )
+    parser.add_argument(
+        '--storage',
+        choices=sorted(storage.BACKENDS),
+        default=os.environ.get('SUPERPY_STORAGE', 'csv'),
+        help='storage backend for products (defaults to the SUPERPY_STORAGE \
+        environment variable or csv)'
+    )
+    parser.add_argument(
+        '--store',
+        default=os.environ.get('SUPERPY_STORE') or None,
+        help='store of a chain whose products and records are used, which \
+        are kept in stores/NAME (defaults to the SUPERPY_STORE environment \
+        variable or the working directory)',
+        metavar='NAME',
+        type=store_name
+    )
+    parser.add_argument(
+        '--all-stores',
+        action='store_true',
+        help='report, count (inventory --count) or record the figures of \
+        all stores of the chain at once'
+    )
+    parser.add_argument(
+        '--plain',
+        action='store_true',
+        help='print plain text and tab-separated tables instead of rich \
+        output'
+    )
+    parser.add_argument(
+        '--group-commit',
+        action='store_true',
+        default=os.environ.get('SUPERPY_GROUP_COMMIT', '') not in ('', '0'),
+        help='queue each sale and store all queued sales of concurrent \
+        processes at once (defaults to the SUPERPY_GROUP_COMMIT environment \
+        variable)'
+    )
+    parser.add_argument(
+        '--import-time',
+        action='store_true',
+        help='report the time spent on importing modules to stderr'
+    )
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        help='report the time spent in each phase of the command, the rows \
+        scanned, the bytes read and written and the peak memory to stderr'
+    )
+    parser.add_argument(
+        '--timings-json',
+        help='write the timings of the command to a JSON file',
+        metavar='FILE'
+    )
+    parser.add_argument(
+        '--profile',
+        help='run the command with cProfile and dump the statistics to a \
+        file, which can be read with the pstats module',
+        metavar='FILE'
+    )
     subparsers = parser.add_subparsers()
 
     advance_date_parser = subparsers.add_parser(
@@ -85,18 +126,16 @@ def generate_parser():
     buy_group.add_argument(
         '-pn',
         '--product-name',
-        help='name of product to be bought',
+        help='name of product to be bought (unless --from-file is given)',
         metavar='',
-        required=True,
         type=str
     )
     buy_group.add_argument(
         '-p',
         '--price',
         dest='buy_price',
-        help='buy price of product',
+        help='buy price of product (unless --from-file is given)',
         metavar='',
-        required=True,
         type=float
     )
     buy_parser.add_argument(
@@ -105,28 +144,62 @@ def generate_parser():
         help='expiration date of product in YYYY-MM-DD format',
         metavar='',
         # Check specifically for YYYY-MM-DD format
-        type=lambda date: datetime.strptime(date, '%Y-%m-%d').date()
+        type=lambda date:
+        datetime.strptime(date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
+    )
+    buy_parser.add_argument(
+        '-f',
+        '--from-file',
+        help='csv or JSON lines file with a product_name, price and \
+        optionally an expiration_date and quantity for each purchase (use - \
+        to read from standard input)',
+        metavar=''
     )
     buy_parser.set_defaults(func=sp.buy_product)
 
+    expiring_parser = subparsers.add_parser(
+        'expiring',
+        help='show products in stock that expire within a number of days'
+    )
+    expiring_parser.add_argument(
+        '-w',
+        '--within',
+        default=7,
+        help='number of days from the current date (defaults to 7)',
+        metavar='N',
+        type=int
+    )
+    expiring_parser.add_argument(
+        '-n',
+        '--name',
+        help='only show products whose name contains this text',
+        metavar='TEXT'
+    )
+    expiring_parser.set_defaults(func=sp.display_expiring_products)
+
     sell_parser = subparsers.add_parser('sell', help='sell product')
     sell_group = sell_parser.add_argument_group('required named arguments')
     sell_group.add_argument(
         '-pn',
         '--product-name',
-        help='name of product to be sold',
+        help='name of product to be sold (unless --from-file is given)',
         metavar='',
-        required=True,
         type=str
     )
     sell_group.add_argument(
         '-p',
         '--price',
         dest='sell_price',
-        help='sell price of product',
+        help='sell price of product (unless --from-file is given)',
         type=float,
-        metavar='',
-        required=True
+        metavar=''
+    )
+    sell_parser.add_argument(
+        '-f',
+        '--from-file',
+        help='csv or JSON lines file with a product_name and price for each \
+        sale (use - to read from standard input)',
+        metavar=''
     )
     sell_parser.set_defaults(func=sp.sell_product)
 
@@ -140,6 +213,35 @@ def generate_parser():
         help='display the count of each product currently in stock',
         action='store_true'
     )
+    inventory_parser.add_argument(
+        '-n',
+        '--name',
+        help='only show products whose name contains this text',
+        metavar='',
+        type=str
+    )
+    inventory_parser.add_argument(
+        '--offset',
+        default=0,
+        help='number of products (or product names with --count) to skip',
+        metavar='',
+        type=int
+    )
+    inventory_parser.add_argument(
+        '--limit',
+        help='maximum number of products (or product names with --count) \
+        to show',
+        metavar='',
+        type=int
+    )
+    inventory_parser.add_argument(
+        '-f',
+        '--format',
+        choices=['table', 'tsv', 'jsonl'],
+        default='table',
+        help='show a table (default) or stream tab-separated values or JSON \
+        lines'
+    )
     inventory_parser.set_defaults(func=sp.display_current_inventory)
 
     report_parser = subparsers.add_parser(
@@ -177,11 +279,42 @@ def generate_parser():
         type=lambda date:
         datetime.strptime(date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
     )
+    report_mutually_exclusive_group.add_argument(
+        '--from',
+        dest='from_date',
+        help='first date of a range of dates in YYYY-MM-DD format',
+        metavar='',
+        type=lambda date:
+        datetime.strptime(date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
+    )
+    report_range_group = report_parser.add_argument_group(
+        'range arguments (only used with --from)'
+    )
+    report_range_group.add_argument(
+        '--to',
+        dest='to_date',
+        help='last date of the range in YYYY-MM-DD format (defaults to today)',
+        metavar='',
+        type=lambda date:
+        datetime.strptime(date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
+    )
+    report_range_group.add_argument(
+        '--group-by',
+        choices=['day', 'week', 'month', 'quarter'],
+        default='day',
+        help='period to group the range by (defaults to day)'
+    )
+    report_range_group.add_argument(
+        '--by-product',
+        action='store_true',
+        help='break down each period per product'
+    )
     report_parser.set_defaults(func=sp.display_sales_data)
 
     record_parser = subparsers.add_parser(
         'record',
-        help='record costs, revenue and profit for a specified day'
+        help='record costs, revenue and profit for a specified day or range \
+        of days'
     )
     record_group = record_parser.add_argument_group('required day arguments')
     record_mutually_exclusive_group = \
@@ -207,6 +340,29 @@ def generate_parser():
         type=lambda date:
         datetime.strptime(date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
     )
+    record_mutually_exclusive_group.add_argument(
+        '--from',
+        dest='from_date',
+        help='first date of a range of dates to record in YYYY-MM-DD format',
+        metavar='',
+        type=lambda date:
+        datetime.strptime(date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
+    )
+    record_mutually_exclusive_group.add_argument(
+        '--all',
+        action='store_true',
+        help='costs, revenue and profit for every date on which products \
+        have been sold'
+    )
+    record_parser.add_argument(
+        '--to',
+        dest='to_date',
+        help='last date of the range in YYYY-MM-DD format (defaults to today, \
+        only used with --from)',
+        metavar='',
+        type=lambda date:
+        datetime.strptime(date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
+    )
     record_parser.set_defaults(func=sp.record_sales_data)
 
     visualize_parser = subparsers.add_parser(
@@ -221,24 +377,390 @@ def generate_parser():
         '--type',
         choices=['bar', 'line'],
         help='plot data as either a line or a bar chart',
-        metavar='',
         required=True,
         type=str
     )
+    visualize_parser.add_argument(
+        '-o',
+        '--output',
+        help='save the chart to a file (e.g. chart.png, chart.svg or \
+        chart.pdf) instead of showing it in a window',
+        metavar='FILE',
+        type=str
+    )
+    visualize_parser.add_argument(
+        '--from',
+        dest='from_date',
+        help='first recorded date to show in YYYY-MM-DD format',
+        metavar='DATE',
+        type=lambda date:
+        datetime.strptime(date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
+    )
+    visualize_parser.add_argument(
+        '--to',
+        dest='to_date',
+        help='last recorded date to show in YYYY-MM-DD format',
+        metavar='DATE',
+        type=lambda date:
+        datetime.strptime(date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
+    )
+    visualize_parser.add_argument(
+        '--group-by',
+        choices=['day', 'week', 'month', 'quarter'],
+        help='period to add up records by (defaults to the shortest period \
+        that needs no more than --max-points points)'
+    )
+    visualize_parser.add_argument(
+        '--max-points',
+        default=60,
+        help='maximum number of points before records are added up per \
+        week, month or quarter (defaults to 60)',
+        metavar='N',
+        type=int
+    )
     visualize_parser.set_defaults(func=sp.visualize_financial_records)
 
-    return parser.parse_args()
+    compact_parser = subparsers.add_parser(
+        'compact',
+        help='fold the event log into a new snapshot of products.csv'
+    )
+    compact_parser.set_defaults(func=sp.compact_storage)
 
+    import_csv_parser = subparsers.add_parser(
+        'import-csv',
+        help='import products.csv and financial_records.csv into the \
+        sqlite storage backend'
+    )
+    import_csv_parser.set_defaults(func=sp.import_csv_into_sqlite)
 
-def main():
-    # Create necessary files first to make them ready for access.
-    generate_current_date_file()
-    generate_products_file()
-    generate_financial_records_file()
+    rebuild_aggregates_parser = subparsers.add_parser(
+        'rebuild-aggregates',
+        help='recompute the daily totals of sold products and verify them'
+    )
+    rebuild_aggregates_parser.set_defaults(func=sp.rebuild_aggregates)
+
+    archive_parser = subparsers.add_parser(
+        'archive',
+        help='move products sold before a date into monthly partitions'
+    )
+    archive_parser.add_argument(
+        '-b',
+        '--before',
+        help='archive products sold before this date in YYYY-MM-DD format',
+        metavar='DATE',
+        required=True,
+        type=lambda date:
+        datetime.strptime(date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
+    )
+    archive_parser.add_argument(
+        '-c',
+        '--compress',
+        choices=['none', 'gzip', 'lzma'],
+        default='none',
+        help='compression of the partitions (defaults to none)'
+    )
+    archive_parser.set_defaults(func=sp.archive_sold_products)
+
+    shell_parser = subparsers.add_parser(
+        'shell',
+        help='run commands interactively while keeping data in memory'
+    )
+    shell_parser.set_defaults(func=start_shell)
+
+    daemon_parser = subparsers.add_parser(
+        'daemon',
+        help='serve commands over a unix socket while keeping data in memory'
+    )
+    daemon_parser.add_argument(
+        '-s',
+        '--socket',
+        default='superpy.sock',
+        help='path of the unix socket to listen on (defaults to \
+        superpy.sock)',
+        metavar=''
+    )
+    daemon_parser.add_argument(
+        '-D',
+        '--detach',
+        action='store_true',
+        help='run the daemon in the background'
+    )
+    daemon_parser.set_defaults(func=start_daemon)
+
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help='serve buy, sell, inventory and report as a local HTTP/JSON API'
+    )
+    serve_parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='address to listen on (defaults to 127.0.0.1)',
+        metavar=''
+    )
+    serve_parser.add_argument(
+        '--port',
+        default=8080,
+        help='port to listen on (defaults to 8080)',
+        metavar='',
+        type=int
+    )
+    serve_parser.set_defaults(func=start_api_server)
 
+    # Keep the subparsers that check their own arguments after parsing.
+    parser.command_parsers = {
+        'buy': buy_parser,
+        'sell': sell_parser,
+        'inventory': inventory_parser,
+        'expiring': expiring_parser,
+        'visualize': visualize_parser,
+    }
+
+    return parser
+
+
+def generate_parser(argv=None, parser=None):
+    """Parse command line arguments and check their combination."""
+    if parser is None:
+        parser = build_parser()
+    args = parser.parse_args(argv)
+
+    # A single product needs a name and price, unless the purchases or
+    # sales are read from a file instead.
+    func = getattr(args, 'func', None)
+    if func is sp.buy_product and args.from_file is None and \
+            (args.product_name is None or args.buy_price is None):
+        parser.command_parsers['buy'].error(
+            'the following arguments are required: '
+            '-pn/--product-name, -p/--price')
+    if func is sp.sell_product and args.from_file is None and \
+            (args.product_name is None or args.sell_price is None):
+        parser.command_parsers['sell'].error(
+            'the following arguments are required: '
+            '-pn/--product-name, -p/--price')
+
+    if func is sp.display_current_inventory and \
+            (args.offset < 0 or (args.limit is not None and args.limit < 0)):
+        parser.command_parsers['inventory'].error(
+            '--offset and --limit cannot be negative')
+    if func is sp.display_expiring_products and args.within < 0:
+        parser.command_parsers['expiring'].error(
+            '--within cannot be negative')
+    if func is sp.visualize_financial_records and args.max_points < 1:
+        parser.command_parsers['visualize'].error(
+            '--max-points has to be at least 1')
+
+    # Only the figures of the stores can be merged for the whole chain.
+    if args.all_stores:
+        if args.store is not None:
+            parser.error('--store and --all-stores cannot be combined')
+        if func not in (sp.display_sales_data, sp.record_sales_data) and \
+                not (func is sp.display_current_inventory and args.count):
+            parser.error('--all-stores only works with report, '
+                         'inventory --count and record')
+        if not storage.list_stores():
+            parser.error(f'there are no stores in '
+                         f'{storage.STORES_DIRECTORY}/ yet')
+
+    return args
+
+
+def run_command(parser, argv=None, startup_time=0.0):
+    """Parse a command line and call the function associated with it.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        The parser built by build_parser.
+    argv : list, optional
+        The arguments to be parsed (defaults to sys.argv).
+    startup_time : float, optional
+        The number of seconds spent on importing modules before, which
+        is included in the timings of the command.
+
+    Returns
+    -------
+    None : None
+        The command is run, optionally while being measured by the
+        timings module or profiled by cProfile.
+    """
+    parse_start = time.perf_counter()
+    args = generate_parser(argv, parser)
+    parse_time = time.perf_counter() - parse_start
+    # Each command works on the selected store, whose files are created
+    # if needed and whose products stay loaded between the commands of
+    # a shell or daemon.
+    key = (args.store, args.storage)
+    if key not in _stores:
+        _stores[key] = sp.Store(*key)
+    _stores[key].select()
+    sp.PLAIN_OUTPUT = args.plain
+    sp.GROUP_COMMIT = args.group_commit
+    sp.ALL_STORES = args.all_stores
+
+    if args.timings or args.timings_json:
+        timings.start({'imports': startup_time,
+                       'parse arguments': parse_time})
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        args.func(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if timings.ENABLED:
+            results = timings.stop()
+            if args.timings:
+                print(timings.format_summary(results), file=sys.stderr)
+            if args.timings_json:
+                with open(args.timings_json, 'w') as json_file:
+                    json.dump({'command': argv or sys.argv[1:], **results},
+                              json_file, indent=2)
+
+    if args.import_time:
+        sp.report_import_times(IMPORT_TIME)
+
+
+def get_global_arguments(args):
+    """Return the global options a shell or daemon has been started with,
+    so that they also apply to each command it runs."""
+    global_arguments = ['--storage', args.storage]
+    if args.store is not None:
+        global_arguments += ['--store', args.store]
+    if args.plain:
+        global_arguments.append('--plain')
+    if args.group_commit:
+        global_arguments.append('--group-commit')
+    if args.timings:
+        global_arguments.append('--timings')
+    return global_arguments
+
+
+def execute_line(parser, global_arguments, line):
+    """Run a single line of a shell or daemon as a SuperPy command.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        The parser built by build_parser.
+    global_arguments : list
+        Arguments to be placed in front of each command.
+    line : str
+        The command without 'python3 super.py', e.g. 'inventory -c'.
+
+    Returns
+    -------
+    bool
+        False if the line asks to leave the shell, otherwise True.
+    """
+    # shlex is only imported once a shell or daemon runs a command.
+    import shlex
+    try:
+        argv = shlex.split(line)
+    except ValueError as error:
+        print(f'ERROR: {error}')
+        return True
+    if not argv:
+        return True
+    if argv[0] in ('exit', 'quit'):
+        return False
+    if argv[0] in ('shell', 'daemon', 'serve'):
+        print(f'ERROR: {argv[0]} cannot be started from a shell or daemon.')
+        return True
+
+    try:
+        run_command(parser, global_arguments + argv)
+    except SystemExit:
+        # Raised by argparse after printing help or a usage error.
+        pass
+    except Exception as error:
+        print(f'ERROR: {error}')
+    return True
+
+
+def start_shell(args):
+    """Read and run commands until 'exit', 'quit' or end of input.
+
+    Products and the current date stay in memory between commands and
+    every change is written through to storage immediately.
+    """
+    parser = build_parser()
+    global_arguments = get_global_arguments(args)
+    while True:
+        try:
+            line = input('superpy> ')
+        except EOFError:
+            print()
+            break
+        if not execute_line(parser, global_arguments, line):
+            break
+
+
+def start_daemon(args):
+    """Serve commands over a unix socket until 'shutdown' is received.
+
+    Each connection sends one command per line and receives the output
+    of all of them once it has closed its side of the connection, e.g.
+    echo 'inventory -c' | nc -U superpy.sock. Commands are run one at a
+    time, while products and the current date stay in memory.
+    """
+    # These modules are only needed by the daemon, so that other
+    # commands do not have to pay for importing them.
+    import contextlib
+    import io
+    import socketserver
+    import threading
+
+    parser = build_parser()
+    global_arguments = get_global_arguments(args)
+
+    class CommandHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                line = line.decode().strip()
+                if line == 'shutdown':
+                    # Shutting down waits for this request to finish, so
+                    # it has to happen in another thread.
+                    threading.Thread(target=self.server.shutdown).start()
+                    break
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output), \
+                        contextlib.redirect_stderr(output):
+                    execute_line(parser, global_arguments, line)
+                self.wfile.write(output.getvalue().encode())
+
+    # Remove the socket of a daemon that has not been shut down cleanly.
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = socketserver.UnixStreamServer(args.socket, CommandHandler)
+
+    if args.detach:
+        if os.fork():
+            print(f'Daemon is listening on {args.socket}.')
+            return
+        os.setsid()
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+def start_api_server(args):
+    """Serve the HTTP/JSON API of the api module until interrupted."""
+    # asyncio is only imported when the API is actually served.
+    import api
+    api.serve(args)
+
+
+def main():
     # Parse args and call the function associated with each command.
-    args = generate_parser()
-    args.func(args)
+    run_command(build_parser(), startup_time=IMPORT_TIME)
 
 
 if __name__ == '__main__':
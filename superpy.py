@@ -6,20 +6,154 @@ commandline tool. These include the following abilities:
 - displaying the current inventory
 - getting information about the sales, revenue and profit for each day
 - visualizing financial data
+The Store class offers the same operations to other Python code, with
+methods that return data instead of printing it.
 """
 
 # Imports
+import contextlib
 import csv
-import numpy as np
-from collections import Counter
+import functools
+import heapq
+import importlib
+import itertools
+import json
+import math
+import os
+import re
+import snapshot
+import storage
+import sys
+import threading
+import time
+import timings
 from datetime import datetime, timedelta
 from uuid import uuid4
-from matplotlib import pyplot as plt
-from rich import print as rprint
-from rich.table import Table
+
+# Heavy third-party modules (numpy, matplotlib and rich) are imported
+# by import_module only once a command actually needs them.
+IMPORT_TIMES = {}
+PLAIN_OUTPUT = False
+BATCH_SIZE = 1000
+# In group commit mode, each sale is queued in PENDING_SALES_DIRECTORY
+# and whichever process gets the lock first stores every queued sale.
+GROUP_COMMIT = False
+PENDING_SALES_DIRECTORY = '.superpy_pending'
+CURRENT_DATE_FILENAME = 'current_date.txt'
+# With ALL_STORES, reports are made for the whole chain by running them
+# for each store in a separate process and merging the results.
+ALL_STORES = False
+MARKUP_PATTERN = re.compile(r'\[/?[a-z][a-z0-9_ ]*\]')
+
+
+# Output-related functions
+@timings.timed('imports')
+def import_module(name):
+    """Import a module on first use and keep track of the time it took.
+
+    Parameters
+    ----------
+    name : str
+        The fully qualified name of the module.
+
+    Returns
+    -------
+    module : module
+        The imported module.
+    """
+    if name not in sys.modules:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        IMPORT_TIMES[name] = time.perf_counter() - start
+    return sys.modules[name]
+
+
+def report_import_times(startup_time):
+    """Print the time spent on importing modules to standard error.
+
+    Parameters
+    ----------
+    startup_time : float
+        The number of seconds spent on importing modules before the
+        command started.
+
+    Returns
+    -------
+    None : None
+        The startup import time and the time spent on each module that
+        has been imported lazily are printed.
+    """
+    print(f'Import time (startup): {startup_time * 1000:.1f} ms',
+          file=sys.stderr)
+    for name, import_time in IMPORT_TIMES.items():
+        print(f'Import time ({name}): {import_time * 1000:.1f} ms',
+              file=sys.stderr)
+
+
+class PlainTable:
+    """Table with the same interface as rich.table.Table that is printed
+    as tab-separated values."""
+
+    def __init__(self, title=None):
+        self.title = title
+        self.columns = []
+        self.rows = []
+
+    def add_column(self, header, style=None):
+        self.columns.append(header)
+
+    def add_row(self, *cells):
+        self.rows.append(cells)
+
+    def __str__(self):
+        lines = ['\t'.join(self.columns)]
+        lines.extend('\t'.join(str(cell) for cell in row) for row in self.rows)
+        return '\n'.join(lines)
+
+
+def Table(title=None):
+    """Return a rich table, or a plain one if plain output is requested."""
+    if PLAIN_OUTPUT:
+        return PlainTable(title)
+    return import_module('rich.table').Table(title=title)
+
+
+@timings.timed('render')
+def rprint(*objects):
+    """Print objects with rich, or without markup if plain output is
+    requested."""
+    if PLAIN_OUTPUT:
+        print(*(MARKUP_PATTERN.sub('', str(obj)) for obj in objects))
+    else:
+        import_module('rich').print(*objects)
+
+
+def print_error(error):
+    """Print an error message for an invalid value, e.g. a ValueError
+    raised by one of the methods of Store."""
+    message = str(error)
+    rprint('[bold red]ERROR[/bold red]')
+    print(f'{message[0].upper()}{message[1:]}.')
 
 
 # Date-related functions
+@timings.timed('read')
+def read_current_date():
+    """Return the current date stored in 'current_date.txt'.
+
+    Returns
+    -------
+    current_date : str
+        The current date in YYYY-MM-DD format, which is shared by all
+        stores of a chain. The file is tiny, so it is read on every
+        call instead of being kept in memory, which could miss another
+        process rewriting it with the same size within the resolution of
+        its modification time.
+    """
+    with open(storage.root_path(CURRENT_DATE_FILENAME)) as text_file:
+        return text_file.read()
+
+
 def advance_date(args):
     """Increment the current date by given number of days.
 
@@ -37,12 +171,13 @@ def advance_date(args):
         The current date is updated and a message confirming the update
         along with the new current date is printed to the terminal.
     """
-    current_date = open('current_date.txt').read()
+    current_date = read_current_date()
     new_current_date = (datetime.strptime(current_date, '%Y-%m-%d')
                         + timedelta(days=args.days)).strftime('%Y-%m-%d')
 
     # Overwrite text file to record the new current date.
-    with open('current_date.txt', 'w') as text_file:
+    filename = storage.root_path(CURRENT_DATE_FILENAME)
+    with open(filename, 'w') as text_file:
         text_file.write(new_current_date)
 
     rprint('[bold green]OK[/bold green]')
@@ -65,7 +200,7 @@ def show_current_date(args):
     None : None
         The current date is printed to the terminal.
     """
-    current_date = open('current_date.txt').read()
+    current_date = read_current_date()
     if args.verbose:
         rprint(f'Current date is: {current_date}')
     else:
@@ -84,134 +219,396 @@ def buy_product(args):
         * product_name
         * buy_price
         * expiration_date
+        * from_file
         * func
 
     Returns
     -------
     None : None
         The product that has been bought is stored and a message
-        confirming this is printed to the terminal.
-    """
-    buy_date = open('current_date.txt').read()
-    product = {
-        'id': uuid4(),
-        'product_name': args.product_name,
-        'buy_price': args.buy_price,
-        'buy_date': buy_date,
-        'expiration_date': args.expiration_date,
-    }
+        confirming this is printed to the terminal. If a file has been
+        given, every purchase in it is stored instead.
+    """
+    if args.from_file is not None:
+        buy_products_from_file(args)
+        return
 
-    with open('products.csv', 'a', newline='') as csv_file:
-        fieldnames = [
-            'id',
-            'product_name',
-            'buy_date',
-            'buy_price',
-            'expiration_date',
-            'sell_date',
-            'sell_price',
-        ]
-        product_writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        product_writer.writerow(product)
+    try:
+        current_store().buy(args.product_name, args.buy_price,
+                            args.expiration_date)
+    except ValueError as error:
+        print_error(error)
+        return
 
     rprint('[bold green]OK[/bold green]')
     print(f'Added {args.product_name} to inventory.')
 
 
+def open_batch_file(filename):
+    """Open a file with one item per line, or standard input for '-'.
+
+    Standard input is left open when the with block using it exits, so
+    that a shell can keep reading commands afterwards.
+    """
+    if filename == '-':
+        return contextlib.nullcontext(sys.stdin)
+    return open(filename, newline='')
+
+
+def read_batch_rows(batch_file):
+    """Read each row of a csv or JSON lines file as a dictionary.
+
+    Parameters
+    ----------
+    batch_file : file object
+        A csv file with a header or a file with one JSON object per
+        line. JSON lines are recognized by their first character.
+
+    Yields
+    ------
+    line_number : int
+        The number of the line the row has been read from.
+    row : dict or None
+        The fields of the row, or None if the line is not valid JSON.
+    """
+    first_line = batch_file.readline()
+    lines = itertools.chain([first_line], batch_file)
+
+    if first_line.lstrip().startswith('{'):
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        row_reader = csv.DictReader(lines)
+        for row in row_reader:
+            yield row_reader.line_num, row
+
+
+def parse_purchase(row):
+    """Validate a row of a purchase file.
+
+    Parameters
+    ----------
+    row : dict or None
+        A row read by read_batch_rows with the fields 'product_name',
+        'price' (or 'buy_price') and optionally 'expiration_date' and
+        'quantity'.
+
+    Returns
+    -------
+    purchase : dict
+        The product name, buy price, expiration date and quantity of
+        the purchase.
+
+    Raises
+    ------
+    ValueError
+        If the row is missing a field or contains an invalid value.
+    """
+    if row is None:
+        raise ValueError('line is not a valid JSON object')
+
+    product_name = str(row.get('product_name') or '').strip()
+    if not product_name:
+        raise ValueError('missing product name')
+
+    price = row.get('price', row.get('buy_price'))
+    try:
+        buy_price = float(price)
+    except (TypeError, ValueError):
+        raise ValueError(f'invalid price {price!r}')
+    # Infinite prices cannot be stored in cents.
+    if not math.isfinite(buy_price):
+        raise ValueError(f'invalid price {price!r}')
+
+    expiration_date = row.get('expiration_date') or ''
+    if expiration_date:
+        try:
+            expiration_date = datetime.strptime(
+                expiration_date, '%Y-%m-%d').date().strftime('%Y-%m-%d')
+        except (TypeError, ValueError):
+            raise ValueError(f'invalid expiration date {expiration_date!r}')
+
+    quantity = row.get('quantity')
+    if quantity is None or quantity == '':
+        quantity = 1
+    try:
+        quantity = int(quantity)
+    except (TypeError, ValueError):
+        quantity = 0
+    if quantity < 1:
+        raise ValueError(f'invalid quantity {row.get("quantity")!r}')
+
+    return {
+        'product_name': product_name,
+        'buy_price': buy_price,
+        'expiration_date': expiration_date,
+        'quantity': quantity,
+    }
+
+
+def buy_products_from_file(args):
+    """Buy and store every purchase in a csv or JSON lines file.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the following fields:
+
+        * from_file
+        * func
+
+    Returns
+    -------
+    None : None
+        Valid purchases are stored in batches of BATCH_SIZE products.
+        Each invalid line is reported, followed by the number of
+        products that have been added and the time this took.
+    """
+    start = time.perf_counter()
+    buy_date = storage.parse_date(read_current_date())
+    product_storage = storage.get_storage()
+    batch = []
+    product_count = 0
+    errors = []
+
+    with open_batch_file(args.from_file) as batch_file:
+        for line_number, row in read_batch_rows(batch_file):
+            try:
+                purchase = parse_purchase(row)
+            except ValueError as error:
+                errors.append((line_number, error))
+                continue
+
+            buy_price = storage.to_cents(purchase['buy_price'])
+            expiration_date = storage.parse_date(purchase['expiration_date'])
+            for _ in range(purchase['quantity']):
+                batch.append(storage.Product(
+                    str(uuid4()), purchase['product_name'], buy_date,
+                    buy_price, expiration_date))
+
+            if len(batch) >= BATCH_SIZE:
+                product_storage.add_products(batch)
+                product_count += len(batch)
+                batch = []
+
+    if batch:
+        product_storage.add_products(batch)
+        product_count += len(batch)
+
+    duration = time.perf_counter() - start
+    for line_number, error in errors:
+        rprint(f'[bold red]ERROR[/bold red] line {line_number}: {error}')
+    if product_count:
+        rprint('[bold green]OK[/bold green]')
+    print(f'Added {product_count} products to inventory in '
+          f'{duration:.2f} seconds '
+          f'({product_count / max(duration, 1e-9):.0f} products/s).')
+
+
 def product_is_non_expiring(product):
     """Check if product is non-expiring (e.g. kitchen utensils).
 
     Parameters
     ----------
-    product : dict
+    product : storage.Product
         A product that has been added to the inventory.
 
     Returns
     -------
     bool
-        True if the value of the 'expiration_date' key is empty,
-        otherwise False.
+        True if the product has no expiration date, otherwise False.
     """
-    return not product['expiration_date']
+    return product.expiration_date is None
 
 
-def product_is_fresh(product):
+def product_is_fresh(product, current_date=None):
     """Check if product is not expired.
 
     Parameters
     ----------
-    product : dict
-        A product that has been added to the inventory.
+    product : storage.Product
+        A perishable product that has been added to the inventory.
+    current_date : str, optional
+        The current date in YYYY-MM-DD format. It is read from
+        'current_date.txt' if it has not been given.
 
     Returns
     -------
     bool
-        True if the value of the 'expiration_date' key is equal to or
-        larger than the current date, otherwise False.
+        True if the expiration date of the product is on or after the
+        current date, otherwise False.
     """
-    current_date = open('current_date.txt').read()
-    return product['expiration_date'] >= current_date
+    if current_date is None:
+        current_date = read_current_date()
+    return product.expiration_date >= storage.parse_date(current_date)
 
 
-def product_is_in_stock(product):
-    """Check if product has not yet been sold.
+def load_stock_index(product_name=None):
+    """Load the stock index for the current date from storage.
 
     Parameters
     ----------
-    product : dict
-        A product that may have already been sold.
+    product_name : str, optional
+        The name of the only product that is needed. Storage backends
+        that can look up products by name use this to avoid loading the
+        whole inventory.
 
     Returns
     -------
-    bool
-        True if the relevant product has not yet been sold and the
-        current date is equal to or larger than the buying date,
-        otherwise False.
+    stock_index : dict
+        A dictionary containing the following keys:
+
+        * current_date: the date the index has been built for
+        * in_stock: a dictionary mapping each product name to a list
+          of products with that name that are in stock
+    """
+    current_date = read_current_date()
+    return storage.get_storage().load_stock_index(current_date, product_name)
+
+
+def get_sellable_products(stock_index, product_name):
+    """Return the heap of products with a name that can still be sold.
+
+    Parameters
+    ----------
+    stock_index : dict
+        The stock index returned by load_stock_index.
+    product_name : str
+        The name of the products.
+
+    Returns
+    -------
+    sellable : list
+        A heap of the entries returned by storage.sellable_entry for
+        each product in stock that is either non-expiring or still
+        fresh, so that the product that expires first is at the top.
+        The heap is built once per product name and kept in the stock
+        index, which keeps it up to date on every purchase.
     """
-    current_date = open('current_date.txt').read()
-    with open('products.csv', newline='') as csv_file:
-        product_reader = csv.DictReader(csv_file)
-        product_id = product['id']
+    sellable = stock_index.setdefault('sellable', {})
+    if product_name not in sellable:
+        heap = [
+            storage.sellable_entry(product) for product
+            in stock_index['in_stock'].get(product_name, [])
+            if product_is_non_expiring(product) or
+            product_is_fresh(product, stock_index['current_date'])
+        ]
+        heapq.heapify(heap)
+        sellable[product_name] = heap
+    return sellable[product_name]
 
-        # Products are considered sold when they have a clearly defined
-        # selling date.
-        sold_products_ids = [product['id'] for product in product_reader
-                             if product['sell_date']]
 
-    # Make product available for sale from the day it has been bought.
-    return product_id not in sold_products_ids and \
-        current_date >= product['buy_date']
+@timings.timed('stock checks')
+def take_product_to_sell(stock_index, product_name):
+    """Remove the product to be sold next from the stock index.
+
+    Parameters
+    ----------
+    stock_index : dict
+        The stock index returned by load_stock_index.
+    product_name : str
+        The name of the product to be sold.
 
+    Returns
+    -------
+    product : storage.Product or None
+        The product with the given name that expires first among those
+        that are still fresh (first expired, first out), or None if
+        there is no such product left. Non-expiring products are sold
+        in the order in which they have been recorded. Products that
+        are returned are no longer offered by subsequent calls with the
+        same stock index.
+    """
+    sellable = get_sellable_products(stock_index, product_name)
+    if sellable:
+        return heapq.heappop(sellable)[-1]
+    return None
 
-def update_inventory(all_products):
-    """Update inventory after product has been sold.
+
+@timings.timed('stock checks')
+def iter_expiring_products(stock_index, last_date):
+    """Yield each sellable product that expires on or before a date.
 
     Parameters
     ----------
-    all_products: list
-        A list of each and every recorded product.
+    stock_index : dict
+        The stock index returned by load_stock_index.
+    last_date : str
+        The last expiration date to include in YYYY-MM-DD format.
 
     Returns
     -------
-    None : None
-        'products.csv' is overwritten with the data of all products,
-        including the one that has been sold (and now has a selling
-        price and date).
-    """
-    with open('products.csv', 'w', newline='') as csv_file:
-        fieldnames = [
-            'id',
-            'product_name',
-            'buy_date',
-            'buy_price',
-            'expiration_date',
-            'sell_date',
-            'sell_price',
-        ]
-        product_writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        product_writer.writeheader()
-        for product in all_products:
-            product_writer.writerow(product)
+    generator
+        The products of each name, sorted by name and then by
+        expiration date. Only the part of each heap holding these
+        products is visited, since the children of an entry never
+        expire earlier than the entry itself.
+    """
+    last_entry = (False, storage.parse_date(last_date))
+    for product_name in sorted(stock_index['in_stock']):
+        sellable = get_sellable_products(stock_index, product_name)
+        expiring = []
+        positions = [0]
+        while positions:
+            position = positions.pop()
+            if position < len(sellable) and \
+                    sellable[position][:2] <= last_entry:
+                expiring.append(sellable[position])
+                positions.extend((2 * position + 1, 2 * position + 2))
+        for entry in sorted(expiring, key=lambda entry: entry[:3]):
+            yield entry[-1]
+
+
+def sell_in_stock(sales, product_name=None):
+    """Sell a product for each sale and store them with a single write.
+
+    Has to be called while holding storage.lock_files, so that no other
+    process can sell the same products in between.
+
+    Parameters
+    ----------
+    sales : list
+        The sales returned by parse_sale.
+    product_name : str, optional
+        The name of the only product that is sold, which is passed on
+        to load_stock_index.
+
+    Returns
+    -------
+    stock_index : dict
+        The stock index the products have been taken from.
+    products : list
+        The product sold by each sale, or None for each sale of a
+        product that is expired or not in stock.
+    """
+    product_storage = storage.get_storage()
+    stock_index = load_stock_index(product_name)
+    sell_date = storage.parse_date(stock_index['current_date'])
+    products = []
+    try:
+        for sale in sales:
+            product = take_product_to_sell(stock_index, sale['product_name'])
+            if product is not None:
+                product.sell_price = storage.to_cents(sale['sell_price'])
+                product.sell_date = sell_date
+            products.append(product)
+        sold_products = [product for product in products
+                         if product is not None]
+        if sold_products:
+            product_storage.sell_products(sold_products)
+    except BaseException:
+        # The products have been changed in the loaded stock index of
+        # the backend, which would otherwise keep sales that have never
+        # been stored.
+        product_storage.discard_cache()
+        raise
+    return stock_index, products
 
 
 def sell_product(args):
@@ -224,6 +621,7 @@ def sell_product(args):
 
         * product_name
         * sell_price
+        * from_file
         * func
 
     Returns
@@ -232,42 +630,711 @@ def sell_product(args):
         A message confirming the sale is printed to the terminal if a
         matching product has been found to sell. Otherwise, it prints a
         message stating that an error occurred, because the product has
-        either expired or is not in stock.
-    """
-    with open('products.csv', newline='') as csv_file:
-        product_reader = csv.DictReader(csv_file)
-        all_products = [product for product in product_reader]
-
-        # Non-perishable goods to be sold are filtered based on being
-        # non-expiring and perishable goods are filtered based on the
-        # fact that they are still fresh on the current day.
-        matching_products = [product for product in all_products
-                             if product['product_name'] == args.product_name
-                             and (product_is_non_expiring(product) or
-                                  product_is_fresh(product)) and
-                             product_is_in_stock(product)]
-
-    if matching_products:
-        sell_date = open('current_date.txt').read()
-        matching_product = matching_products.pop()
-        matching_product['sell_price'] = args.sell_price
-        matching_product['sell_date'] = sell_date
-
-        # Find and update product with newly added values.
-        for product in all_products:
-            if product['id'] == matching_product['id']:
-                product = matching_product
-
-        update_inventory(all_products)
+        either expired or is not in stock. If a file has been given,
+        every sale in it is processed instead.
+    """
+    if args.from_file is not None:
+        sell_products_from_file(args)
+        return
+
+    if GROUP_COMMIT:
+        result = sell_with_group_commit({'product_name': args.product_name,
+                                         'sell_price': args.sell_price})
+        if result is None:
+            rprint('[bold red]ERROR[/bold red]')
+            print('The sale has been interrupted, please check the '
+                  'inventory.')
+        elif result['sold']:
+            rprint('[bold green]OK[/bold green]')
+            print(f'Successfully sold {result["product_name"]}.')
+        else:
+            rprint('[bold red]ERROR[/bold red]')
+            print('Product is expired or is not in stock.')
+        return
 
+    try:
+        matching_product = current_store().sell(args.product_name,
+                                                args.sell_price)
+    except ValueError as error:
+        print_error(error)
+        return
+
+    if matching_product:
         rprint('[bold green]OK[/bold green]')
-        print(f'Successfully sold {matching_product["product_name"]}.')
+        print(f'Successfully sold {matching_product.product_name}.')
     else:
         rprint('[bold red]ERROR[/bold red]')
         print('Product is expired or is not in stock.')
 
 
-# Function related to current inventory
+def queue_sale(sale):
+    """Queue a sale to be stored by the next group commit.
+
+    Parameters
+    ----------
+    sale : dict
+        The product name and sell price of the sale.
+
+    Returns
+    -------
+    sale_id : str
+        The id under which the result of the sale will be stored.
+    """
+    directory = storage.data_path(PENDING_SALES_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    sale_id = uuid4().hex
+    filename = os.path.join(directory, f'{sale_id}.sale')
+    # Sales only become visible once they have been written completely.
+    with open(f'{filename}.tmp', 'w') as sale_file:
+        json.dump(sale, sale_file)
+    os.replace(f'{filename}.tmp', filename)
+    return sale_id
+
+
+def commit_pending_sales():
+    """Store every queued sale with a single write.
+
+    Has to be called while holding storage.lock_files. Each queued sale
+    is removed from the queue before the sold products are stored, so
+    that a sale is never stored twice, and its result is written to a
+    '.done' file afterwards.
+    """
+    directory = storage.data_path(PENDING_SALES_DIRECTORY)
+    pending_sales = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.sale'):
+            pending_sales.append((entry.stat().st_mtime_ns, entry.name))
+
+    sales = []
+    for _, filename in sorted(pending_sales):
+        filename = os.path.join(directory, filename)
+        with open(filename) as sale_file:
+            sales.append((filename[:-len('.sale')], json.load(sale_file)))
+        os.remove(filename)
+
+    _, products = sell_in_stock([sale for _, sale in sales])
+    results = [(sale_filename, {
+        'product_name': sale['product_name'],
+        'sold': product is not None,
+    }) for (sale_filename, sale), product in zip(sales, products)]
+
+    for sale_filename, result in results:
+        with open(f'{sale_filename}.done.tmp', 'w') as result_file:
+            json.dump(result, result_file)
+        os.replace(f'{sale_filename}.done.tmp', f'{sale_filename}.done')
+
+
+def sell_with_group_commit(sale):
+    """Queue a sale and wait until it has been stored.
+
+    Parameters
+    ----------
+    sale : dict
+        The product name and sell price of the sale.
+
+    Returns
+    -------
+    result : dict or None
+        The product name and whether it has been sold. None is returned
+        if the process storing the sale has been interrupted.
+    """
+    sale_id = queue_sale(sale)
+    filename = os.path.join(storage.data_path(PENDING_SALES_DIRECTORY),
+                            sale_id)
+
+    # While this process waits for the lock, the process holding it may
+    # already store this sale together with its own.
+    with storage.lock_files():
+        if os.path.exists(f'{filename}.sale'):
+            commit_pending_sales()
+
+    try:
+        with open(f'{filename}.done') as result_file:
+            result = json.load(result_file)
+    except FileNotFoundError:
+        return None
+    os.remove(f'{filename}.done')
+    return result
+
+
+def parse_sale(row):
+    """Validate a row of a sales file.
+
+    Parameters
+    ----------
+    row : dict or None
+        A row read by read_batch_rows with the fields 'product_name'
+        and 'price' (or 'sell_price').
+
+    Returns
+    -------
+    sale : dict
+        The product name and sell price of the sale.
+
+    Raises
+    ------
+    ValueError
+        If the row is missing a field or contains an invalid value.
+    """
+    if row is None:
+        raise ValueError('line is not a valid JSON object')
+
+    product_name = str(row.get('product_name') or '').strip()
+    if not product_name:
+        raise ValueError('missing product name')
+
+    price = row.get('price', row.get('sell_price'))
+    try:
+        sell_price = float(price)
+    except (TypeError, ValueError):
+        raise ValueError(f'invalid price {price!r}')
+    # Infinite prices cannot be stored in cents.
+    if not math.isfinite(sell_price):
+        raise ValueError(f'invalid price {price!r}')
+
+    return {'product_name': product_name, 'sell_price': sell_price}
+
+
+def sell_products_from_file(args):
+    """Sell every product in a csv or JSON lines file in a single pass.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the following fields:
+
+        * from_file
+        * func
+
+    Returns
+    -------
+    None : None
+        Each sale is matched against one stock index and all sold
+        products are stored at once at the end. Each line that could
+        not be sold is reported, followed by the number of products
+        that have been sold and the time this took.
+    """
+    start = time.perf_counter()
+    sales = []
+    errors = []
+
+    with open_batch_file(args.from_file) as batch_file:
+        for line_number, row in read_batch_rows(batch_file):
+            try:
+                sales.append((line_number, parse_sale(row)))
+            except ValueError as error:
+                errors.append((line_number, error))
+
+    # The file is read before taking the lock, so that slow input does
+    # not keep other processes waiting.
+    with storage.lock_files():
+        stock_index, products = sell_in_stock([sale for _, sale in sales])
+    sold_products = []
+    for (line_number, sale), product in zip(sales, products):
+        if product is not None:
+            sold_products.append(product)
+        elif sale['product_name'] in stock_index['in_stock']:
+            errors.append((line_number,
+                           f'{sale["product_name"]} is expired or sold out'))
+        else:
+            errors.append((line_number,
+                           f'{sale["product_name"]} is not in stock'))
+    errors.sort(key=lambda error: error[0])
+
+    duration = time.perf_counter() - start
+    for line_number, error in errors:
+        rprint(f'[bold red]ERROR[/bold red] line {line_number}: {error}')
+    if sold_products:
+        rprint('[bold green]OK[/bold green]')
+    print(f'Sold {len(sold_products)} products in {duration:.2f} seconds '
+          f'({len(sold_products) / max(duration, 1e-9):.0f} products/s).')
+
+
+def compact_storage(args):
+    """Compact the event log of the storage backend into a snapshot.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the following fields:
+
+        * storage
+        * func
+
+    Returns
+    -------
+    None : None
+        A message confirming the compaction is printed to the terminal.
+        If the selected backend does not keep an event log, an error
+        message is printed instead.
+    """
+    product_storage = storage.get_storage()
+    if not hasattr(product_storage, 'compact'):
+        rprint('[bold red]ERROR[/bold red]')
+        print(f'The {args.storage} storage backend has no event log.')
+        return
+
+    product_storage.compact()
+
+    rprint('[bold green]OK[/bold green]')
+    print('Successfully compacted event log into products.csv.')
+
+
+def import_csv_into_sqlite(args):
+    """Import the csv files into the SQLite storage backend.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the following fields:
+
+        * storage
+        * func
+
+    Returns
+    -------
+    None : None
+        A message stating the number of imported products and financial
+        records is printed to the terminal.
+    """
+    sqlite_storage = storage.SqliteStorage()
+    product_count, record_count = sqlite_storage.import_csv()
+
+    rprint('[bold green]OK[/bold green]')
+    print(f'Imported {product_count} products and {record_count} financial '
+          f'records into {sqlite_storage.database_filename}.')
+
+
+def rebuild_aggregates(args):
+    """Recompute the daily totals from all products and verify them.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the following fields:
+
+        * func
+
+    Returns
+    -------
+    None : None
+        The daily totals that are kept up to date on every sale are
+        replaced by totals computed from scratch. The number of rebuilt
+        dates is printed to the terminal, along with each date whose
+        stored totals turned out to be wrong.
+    """
+    product_storage = storage.get_storage()
+    stored_totals = product_storage.load_daily_totals()
+    rebuilt_totals = product_storage.rebuild_daily_totals()
+    mismatched_dates = storage.compare_daily_totals(stored_totals,
+                                                    rebuilt_totals)
+
+    for date in mismatched_dates:
+        rprint(f'[bold red]ERROR[/bold red] daily totals for {date} were '
+               f'incorrect and have been corrected.')
+    rprint('[bold green]OK[/bold green]')
+    print(f'Rebuilt daily totals for {len(rebuilt_totals)} dates.')
+
+
+def archive_sold_products(args):
+    """Move products sold before a date out of 'products.csv'.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the following fields:
+
+        * storage
+        * before
+        * compress
+        * func
+
+    Returns
+    -------
+    None : None
+        The products are added to a partition in the 'archive'
+        directory for each month they have been sold in, and a message
+        stating their number is printed to the terminal. If the selected
+        backend keeps no products in csv files, an error message is
+        printed instead.
+    """
+    product_storage = storage.get_storage()
+    if not hasattr(product_storage, 'archive'):
+        rprint('[bold red]ERROR[/bold red]')
+        print(f'The {args.storage} storage backend keeps sold products '
+              f'indexed by date, so they do not have to be archived.')
+        return
+
+    archived_count, filenames = product_storage.archive(args.before,
+                                                        args.compress)
+
+    rprint('[bold green]OK[/bold green]')
+    print(f'Archived {archived_count} products sold before {args.before} '
+          f'into {len(filenames)} monthly partitions.')
+
+
+# Functions related to the stores of a chain
+def call_in_store(root, store, storage_name, function_name, args, kwargs):
+    """Call one of the functions of this module for a single store.
+
+    Runs in a worker process started by map_stores, so that the store
+    and storage backend of the command have to be selected again. The
+    locks inherited from the parent process are reset first.
+    """
+    global ALL_STORES, _store_lock
+    storage.reset_file_lock()
+    _store_lock = threading.RLock()
+    ALL_STORES = False
+    Store(store, storage_name, root).select()
+    return globals()[function_name](*args, **kwargs)
+
+
+def map_stores(function_name, *args, **kwargs):
+    """Call a function for every store of the chain in parallel.
+
+    Parameters
+    ----------
+    function_name : str
+        The name of a function of this module.
+    *args, **kwargs
+        The arguments to be passed to the function.
+
+    Returns
+    -------
+    results : list
+        The result of the function for each store, in the order of
+        storage.list_stores. Each store is handled in a process of its
+        own, so that the work is spread over all cores.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    stores = storage.list_stores()
+    if not stores:
+        return []
+    storage_name = storage.get_storage().name
+    with ProcessPoolExecutor(
+            max_workers=min(len(stores), os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(call_in_store, storage.get_root(), store,
+                                   storage_name, function_name, args,
+                                   kwargs)
+                   for store in stores]
+        return [future.result() for future in futures]
+
+
+def chain_wide(merge):
+    """Make a function cover all stores of the chain with ALL_STORES.
+
+    Parameters
+    ----------
+    merge : function
+        A function merging the list of results of the stores into the
+        result for the whole chain.
+
+    Returns
+    -------
+    decorator : function
+        A decorator that calls the decorated function for each store
+        with map_stores and merges the results if ALL_STORES is set,
+        and calls it for the selected store otherwise.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ALL_STORES:
+                return function(*args, **kwargs)
+            return merge(map_stores(function.__name__, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def merge_product_counts(store_counts):
+    """Add up the product counts of several stores, sorted by name."""
+    counts = {}
+    for product_counts in store_counts:
+        for product_name, count in product_counts:
+            counts[product_name] = counts.get(product_name, 0) + count
+    return sorted(counts.items())
+
+
+def merge_financial_figures(store_figures):
+    """Add up the financial figures of several stores for each date."""
+    totals = {}
+    for figures in store_figures:
+        for date, figure in figures.items():
+            add_figures(totals.setdefault(date, storage.empty_totals()),
+                        figure)
+    return {date: make_figures(total) for date, total in totals.items()}
+
+
+def merge_sold_products(store_products):
+    """Concatenate the sold products of several stores."""
+    return list(itertools.chain.from_iterable(store_products))
+
+
+def merge_period_figures(store_figures):
+    """Add up the figures of several stores for each period (and
+    product), sorted like the figures of a single store."""
+    totals = {}
+    for figures in store_figures:
+        for figure in figures:
+            add_figures(totals.setdefault(
+                (figure['period'], figure['product_name']),
+                storage.empty_totals()), figure)
+    return [{'period': period, 'product_name': product_name,
+             **make_figures(totals[period, product_name])}
+            for period, product_name in sorted(
+                totals, key=lambda key: (key[0], key[1] or ''))]
+
+
+def add_figures(totals, figures):
+    """Add the costs and revenue of figures in dollars to totals in
+    cents, along with the number of sold products."""
+    totals['costs'] += storage.to_cents(figures['costs'])
+    totals['revenue'] += storage.to_cents(figures['revenue'])
+    totals['sold_count'] += figures['sold_count']
+
+
+def to_dollars(cents):
+    """Return an amount in cents in dollars, e.g. 150 becomes 1.5."""
+    return cents / 100 if cents else 0
+
+
+def make_figures(totals):
+    """Return costs, revenue and profit in dollars along with the
+    number of sold products, given totals in cents."""
+    return {
+        'sold_count': totals['sold_count'],
+        'costs': to_dollars(totals['costs']),
+        'revenue': to_dollars(totals['revenue']),
+        'profit': to_dollars(totals['revenue'] - totals['costs']),
+    }
+
+
+# Functions related to current inventory
+def load_product_columns():
+    """Return the columnar snapshot of all products if it pays off.
+
+    Returns
+    -------
+    columns : dict or None
+        The memory-mapped columns returned by snapshot.load_columns, or
+        None if the products are better read from storage directly.
+    """
+    columns = snapshot.load_columns(storage.get_storage())
+    if columns is not None:
+        # Make the import of NumPy by the snapshot show up in the import
+        # times as well.
+        import_module('numpy')
+    return columns
+
+
+@timings.timed('stock checks')
+def get_in_stock_mask(columns, current_date):
+    """Select the products in the columnar snapshot that are in stock.
+
+    Parameters
+    ----------
+    columns : dict
+        The columns returned by load_product_columns.
+    current_date : str
+        The current date in YYYY-MM-DD format.
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        A boolean array that is True for each product that has not been
+        sold and has been bought on or before the current date.
+    """
+    current_ordinal = snapshot.date_to_ordinal(current_date)
+    return (columns['sell_date'] == snapshot.NO_DATE) & \
+        (columns['buy_date'] <= current_ordinal)
+
+
+def iter_products_in_stock(current_date, name_filter=None, offset=0,
+                           limit=None):
+    """Yield each product that is in stock, sorted by name.
+
+    Parameters
+    ----------
+    current_date : str
+        The current date in YYYY-MM-DD format.
+    name_filter : str, optional
+        Only yield products whose name contains this text (ignoring
+        case).
+    offset : int, optional
+        The number of products to skip (defaults to 0).
+    limit : int, optional
+        The maximum number of products to yield (defaults to all).
+
+    Yields
+    ------
+    product : storage.Product
+        Products with the same name are yielded in the order in which
+        they have been recorded. Products are produced one at a time,
+        so that the first ones can be shown before all of them have
+        been looked up. Products read from the columnar snapshot have
+        no id.
+    """
+    stop = None if limit is None else offset + limit
+    columns = load_product_columns()
+    if columns is None:
+        yield from itertools.islice(
+            storage.get_storage().iter_products_in_stock(current_date,
+                                                         name_filter),
+            offset, stop)
+        return
+
+    np = import_module('numpy')
+    mask = get_in_stock_mask(columns, current_date)
+    if name_filter is not None:
+        matching_codes = [code for code, product_name
+                          in enumerate(columns['product_names'])
+                          if storage.name_matches(product_name, name_filter)]
+        mask &= np.isin(columns['product_code'], matching_codes)
+    in_stock = np.flatnonzero(mask)
+    # Product codes follow the alphabetical order of product names.
+    in_stock = in_stock[np.argsort(columns['product_code'][in_stock],
+                                   kind='stable')][offset:stop]
+
+    # Convert the columns into products in batches, so that memory use
+    # does not depend on the number of products in stock.
+    for batch_start in range(0, len(in_stock), BATCH_SIZE):
+        batch = in_stock[batch_start:batch_start + BATCH_SIZE]
+        product_names = columns['product_names'][
+            columns['product_code'][batch]].tolist()
+        buy_dates = snapshot.ordinals_to_dates(columns['buy_date'][batch],
+                                               snapshot.NO_DATE)
+        buy_prices = columns['buy_price'][batch].tolist()
+        expiration_dates = snapshot.ordinals_to_dates(
+            columns['expiration_date'][batch], snapshot.NO_EXPIRATION_DATE)
+
+        for product_name, buy_date, buy_price, expiration_date in zip(
+                product_names, buy_dates, buy_prices, expiration_dates):
+            yield storage.Product(None, product_name, buy_date, buy_price,
+                                  expiration_date)
+
+
+@chain_wide(merge_product_counts)
+def count_products_in_stock(current_date, name_filter=None):
+    """Return the name and number of each product in stock.
+
+    Parameters
+    ----------
+    current_date : str
+        The current date in YYYY-MM-DD format.
+    name_filter : str, optional
+        Only count products whose name contains this text (ignoring
+        case).
+
+    Returns
+    -------
+    product_counts : list
+        Tuples of a product name and its count, sorted by name. Only
+        a single count per product name is kept in memory. With
+        ALL_STORES, the counts of all stores are added up.
+    """
+    columns = load_product_columns()
+    if columns is None:
+        return storage.get_storage().count_products_in_stock(current_date,
+                                                             name_filter)
+
+    np = import_module('numpy')
+    mask = get_in_stock_mask(columns, current_date)
+    counts = np.bincount(columns['product_code'][mask],
+                         minlength=len(columns['product_names']))
+    return [(str(product_name), int(count))
+            for product_name, count in zip(columns['product_names'], counts)
+            if count and storage.name_matches(str(product_name),
+                                              name_filter)]
+
+
+def describe_expiration_date(product, current_date):
+    """Return how the expiration date of a product in stock is shown,
+    e.g. 'Non-expiring' or 'Expired'."""
+    if product_is_non_expiring(product):
+        return 'Non-expiring'
+    if not product_is_fresh(product, current_date):
+        return '[red]Expired[/red]'
+    return product.expiration_date.isoformat()
+
+
+def write_lines(lines):
+    """Write lines to standard output as soon as they are produced.
+
+    Returns
+    -------
+    None : None
+        If the reader of standard output goes away (e.g. when piping
+        into head), writing stops silently.
+    """
+    try:
+        for line in lines:
+            sys.stdout.write(line)
+            sys.stdout.write('\n')
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Python would otherwise complain when flushing standard output
+        # at exit.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+
+
+def stream_current_inventory(args, current_date):
+    """Write products in stock (or their count) as TSV or JSON lines.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the fields of display_current_inventory.
+    current_date : str
+        The current date in YYYY-MM-DD format.
+
+    Returns
+    -------
+    None : None
+        Each product (or product name along with its count) is written
+        as a line as soon as it has been looked up, preceded by a
+        header in TSV format.
+    """
+    if args.count:
+        product_counts = itertools.islice(
+            count_products_in_stock(current_date, args.name), args.offset,
+            None if args.limit is None else args.offset + args.limit)
+        if args.format == 'jsonl':
+            lines = (json.dumps({'product_name': product_name,
+                                 'count': count})
+                     for product_name, count in product_counts)
+        else:
+            lines = itertools.chain(
+                ['product_name\tcount'],
+                (f'{product_name}\t{count}'
+                 for product_name, count in product_counts))
+        write_lines(lines)
+        return
+
+    products_in_stock = iter_products_in_stock(current_date, args.name,
+                                               args.offset, args.limit)
+    if args.format == 'jsonl':
+        lines = (json.dumps({
+            'product_name': product.product_name,
+            'buy_price': product.buy_price / 100,
+            'expiration_date': storage.format_date(product.expiration_date)
+            or None,
+            'expired': not product_is_non_expiring(product) and
+            not product_is_fresh(product, current_date),
+        }) for product in products_in_stock)
+    else:
+        lines = itertools.chain(
+            ['product_name\tbuy_price\texpiration_date\texpired'],
+            ('\t'.join([
+                product.product_name,
+                storage.format_price(product.buy_price),
+                storage.format_date(product.expiration_date),
+                str(not product_is_non_expiring(product) and
+                    not product_is_fresh(product, current_date)).lower(),
+            ]) for product in products_in_stock))
+    write_lines(lines)
+
+
 def display_current_inventory(args):
     """Show products that are in stock (optionally by count).
 
@@ -277,6 +1344,10 @@ def display_current_inventory(args):
         A namespace containing the following fields:
 
         * count
+        * name
+        * offset
+        * limit
+        * format
         * func
 
     Returns
@@ -286,28 +1357,25 @@ def display_current_inventory(args):
         expiration date is printed to the terminal. If the count flag
         has been added, the table shows the number of each product. If
         no products are present, an error message is printed instead.
+        Only products whose name contains the given name are shown,
+        skipping the first offset products and showing no more than
+        limit products. In the tsv and jsonl formats, products are
+        streamed by stream_current_inventory instead.
     """
-    with open('products.csv', newline='') as csv_file:
-        product_reader = csv.DictReader(csv_file)
-        products_in_stock = [product for product in product_reader
-                             if product_is_in_stock(product)]
+    current_date = read_current_date()
+    if args.format != 'table':
+        stream_current_inventory(args, current_date)
+        return
 
     if args.count:
         inventory_table = Table(title='Currently in stock')
         inventory_table.add_column('Product Name', style='steel_blue1')
         inventory_table.add_column('Count', style='yellow')
 
-        if products_in_stock:
-            product_counter = Counter()
-
-            # Count each product and sort them by name to make them
-            # appear in alphabetical order in the generated table.
-            for product_in_stock in sorted(products_in_stock,
-                                           key=lambda product:
-                                           product['product_name']):
-                product_counter[product_in_stock['product_name']] += 1
-
-            for product, count in product_counter.items():
+        product_counts = current_store().inventory(args.name, True,
+                                                   args.offset, args.limit)
+        if product_counts:
+            for product, count in product_counts:
                 inventory_table.add_row(product.title(), str(count))
 
             rprint(inventory_table)
@@ -320,33 +1388,124 @@ def display_current_inventory(args):
         inventory_table.add_column('Buy Price', style='yellow')
         inventory_table.add_column('Expiration Date', style='dark_sea_green4')
 
-        if products_in_stock:
-            # Again, sort products by name to make them appear in
-            # alphabetical order in the generated table.
-            for product_in_stock in sorted(products_in_stock,
-                                           key=lambda product:
-                                           product['product_name']):
-
-                # Set correct display in the table for non-expiring
-                # products and products that have already expired.
-                if product_is_non_expiring(product_in_stock):
-                    product_in_stock['expiration_date'] = 'Non-expiring'
-                if not product_is_fresh(product_in_stock):
-                    product_in_stock['expiration_date'] = '[red]Expired[/red]'
-
-                inventory_table.add_row(
-                    product_in_stock['product_name'].title(),
-                    product_in_stock['buy_price'],
-                    product_in_stock['expiration_date'],
-                )
-
+        products_in_stock = current_store().inventory(
+            args.name, offset=args.offset, limit=args.limit)
+        for product_in_stock in products_in_stock:
+            # Set correct display in the table for non-expiring
+            # products and products that have already expired.
+            inventory_table.add_row(
+                product_in_stock.product_name.title(),
+                storage.format_price(product_in_stock.buy_price),
+                describe_expiration_date(product_in_stock, current_date),
+            )
+
+        if inventory_table.rows:
             rprint(inventory_table)
         else:
             rprint('[bold red]ERROR[/bold red]')
             print('No products found in stock.')
 
 
+def display_expiring_products(args):
+    """Show products in stock that expire within a number of days.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the following fields:
+
+        * within
+        * name
+        * func
+
+    Returns
+    -------
+    None : None
+        A table showing each product that expires from the current date
+        up to and including the given number of days later is printed
+        to the terminal, along with its buy price, expiration date and
+        the number of days it has left, sorted by name and expiration
+        date. Only products whose name contains the given name are
+        shown. If no products expire within these days, an error
+        message is printed instead.
+    """
+    current_date = read_current_date()
+    today = storage.parse_date(current_date)
+    last_date = (today + timedelta(days=args.within)).strftime('%Y-%m-%d')
+    product_storage = storage.get_storage()
+    if hasattr(product_storage, 'expiring_products'):
+        # The backend looks up the expiring products by their expiration
+        # date instead of loading the whole stock.
+        expiring_products = product_storage.expiring_products(current_date,
+                                                              last_date)
+    else:
+        expiring_products = iter_expiring_products(
+            product_storage.load_stock_index(current_date), last_date)
+
+    expiring_table = Table(title=f'Expiring within {args.within} days')
+    expiring_table.add_column('Product Name', style='steel_blue1')
+    expiring_table.add_column('Buy Price', style='yellow')
+    expiring_table.add_column('Expiration Date', style='dark_sea_green4')
+    expiring_table.add_column('Days Left', style='red')
+
+    for product in expiring_products:
+        if not storage.name_matches(product.product_name, args.name):
+            continue
+        days_left = (product.expiration_date - today).days
+        expiring_table.add_row(product.product_name.title(),
+                               storage.format_price(product.buy_price),
+                               product.expiration_date.isoformat(),
+                               str(days_left))
+
+    if expiring_table.rows:
+        rprint(expiring_table)
+    else:
+        rprint('[bold red]ERROR[/bold red]')
+        print(f'No products in stock expire within {args.within} days.')
+
+
 # Functions related to sales, revenue, costs and profit
+@timings.timed('aggregate')
+@chain_wide(merge_financial_figures)
+def get_financial_figures(dates=None):
+    """Calculate costs, revenue and profit for several dates at once.
+
+    Parameters
+    ----------
+    dates : iterable, optional
+        Dates representing today, yesterday or any other given date. If
+        omitted, the figures are calculated for every date on which a
+        product has been sold.
+
+    Returns
+    -------
+    figures : dict
+        A dictionary mapping each date to a dictionary containing the
+        following keys:
+
+        * costs: the costs of all sold products on the date
+        * revenue: the revenue that has been made on the date
+        * profit: the profit that has been made on the date
+        * sold_count: the number of products sold on the date
+
+        The figures are looked up in the daily totals that are kept up
+        to date on every sale, however many dates have been requested.
+        With ALL_STORES, the figures of all stores are added up.
+    """
+    figures = {}
+    # The daily totals are kept in cents, which are only converted to
+    # dollars here.
+    for date, totals in storage.get_storage().aggregate_sales(dates).items():
+        figures[date] = {
+            'costs': to_dollars(totals['costs']),
+            'revenue': to_dollars(totals['revenue']),
+            'profit': to_dollars(totals['revenue'] - totals['costs']),
+            'sold_count': totals['sold_count'],
+        }
+
+    return figures
+
+
 def get_costs(date):
     """Calculate and return costs of sold products for a given date.
 
@@ -361,18 +1520,7 @@ def get_costs(date):
     costs : float
         The costs of all sold products on the specific date.
     """
-    with open('products.csv', newline='') as csv_file:
-        costs = 0
-        product_reader = csv.DictReader(csv_file)
-        sold_products = [product for product in product_reader
-                         if product['sell_date']]
-        for sold_product in sold_products:
-            if sold_product['sell_date'] == date:
-                costs += float(sold_product['buy_price'])
-
-        costs = round(costs, 2)
-
-    return costs
+    return get_financial_figures([date])[date]['costs']
 
 
 def get_revenue(date):
@@ -389,18 +1537,7 @@ def get_revenue(date):
     revenue : float
         The revenue that has been made on the specific date.
     """
-    with open('products.csv', newline='') as csv_file:
-        revenue = 0
-        product_reader = csv.DictReader(csv_file)
-        sold_products = [product for product in product_reader
-                         if product['sell_date']]
-        for sold_product in sold_products:
-            if sold_product['sell_date'] == date:
-                revenue += float(sold_product['sell_price'])
-
-        revenue = round(revenue, 2)
-
-    return revenue
+    return get_financial_figures([date])[date]['revenue']
 
 
 def get_profit(date):
@@ -417,13 +1554,10 @@ def get_profit(date):
     profit : float
         The profit that has been made on the specific date.
     """
-    revenue = get_revenue(date)
-    costs = get_costs(date)
-    profit = round(revenue - costs, 2)
-
-    return profit
+    return get_financial_figures([date])[date]['profit']
 
 
+@chain_wide(merge_sold_products)
 def get_sold_products(date):
     """Return sold products for a given date.
 
@@ -436,16 +1570,295 @@ def get_sold_products(date):
     Returns
     -------
     sold_products : list
-        A list of products that have been sold on the specific date.
+        A list of products that have been sold on the specific date,
+        in any store of the chain with ALL_STORES.
     """
-    with open('products.csv', newline='') as csv_file:
-        product_reader = csv.DictReader(csv_file)
-        sold_products = [product for product in product_reader
-                         if product['sell_date'] == date]
+    sold_products = storage.get_storage().sold_products(date)
 
     return sold_products
 
 
+def load_sales_columns(start_date, end_date):
+    """Load products sold within a period as columns of NumPy arrays.
+
+    Parameters
+    ----------
+    start_date : str
+        The first date of the period in YYYY-MM-DD format.
+    end_date : str
+        The last date of the period in YYYY-MM-DD format.
+
+    Returns
+    -------
+    columns : dict
+        A dictionary containing the following NumPy arrays, with one
+        element for each sold product:
+
+        * sell_date: selling dates as datetime64[D]
+        * product_name: product names
+        * buy_price: buy prices as floats
+        * sell_price: sell prices as floats
+    """
+    np = import_module('numpy')
+    product_storage = storage.get_storage()
+    columns = load_product_columns()
+    if columns is None:
+        sold_products = product_storage.sold_products_between(start_date,
+                                                              end_date)
+    else:
+        # The snapshot only holds the products in 'products.csv', so
+        # archived products are read from their partitions.
+        sold_products = list(product_storage.iter_archived_products(
+            start_date, end_date))
+    sales_columns = {
+        'sell_date': np.array([product.sell_date
+                               for product in sold_products],
+                              dtype='datetime64[D]'),
+        'product_name': np.array([product.product_name
+                                  for product in sold_products],
+                                 dtype=str),
+        'buy_price': np.array([product.buy_price
+                               for product in sold_products],
+                              dtype=float) / 100,
+        'sell_price': np.array([product.sell_price
+                                for product in sold_products],
+                               dtype=float) / 100,
+    }
+    if columns is None:
+        return sales_columns
+
+    sell_dates = columns['sell_date']
+    sold = np.flatnonzero(
+        (sell_dates >= snapshot.date_to_ordinal(start_date)) &
+        (sell_dates <= snapshot.date_to_ordinal(end_date)))
+    snapshot_columns = {
+        'sell_date': sell_dates[sold].astype('datetime64[D]'),
+        'product_name': columns['product_names'][
+            columns['product_code'][sold]],
+        'buy_price': columns['buy_price'][sold] / 100,
+        'sell_price': columns['sell_price'][sold] / 100,
+    }
+    if not sold_products:
+        return snapshot_columns
+    return {name: np.concatenate([snapshot_columns[name], column])
+            for name, column in sales_columns.items()}
+
+
+def get_periods(sell_dates, group_by):
+    """Map selling dates to the start of the period they fall in.
+
+    Parameters
+    ----------
+    sell_dates : numpy.ndarray
+        Selling dates as datetime64[D].
+    group_by : str
+        Either 'day', 'week' (starting on Monday), 'month' or 'quarter'.
+
+    Returns
+    -------
+    periods : numpy.ndarray
+        The first day of the period of each selling date as
+        datetime64[D].
+    """
+    np = import_module('numpy')
+    if group_by == 'week':
+        # Day 0 of datetime64 is a Thursday, so Monday is 3 days earlier.
+        days = sell_dates.astype('int64')
+        return (days - (days + 3) % 7).astype('datetime64[D]')
+    if group_by == 'month':
+        return sell_dates.astype('datetime64[M]').astype('datetime64[D]')
+    if group_by == 'quarter':
+        months = sell_dates.astype('datetime64[M]').astype('int64')
+        return (months - months % 3).astype('datetime64[M]') \
+            .astype('datetime64[D]')
+    return np.asarray(sell_dates, dtype='datetime64[D]')
+
+
+def format_period(period, group_by):
+    """Return a label for a period such as '2021-06' or '2021-Q2'."""
+    period = str(period)
+    if group_by == 'week':
+        return f'Week of {period}'
+    if group_by == 'month':
+        return period[:7]
+    if group_by == 'quarter':
+        return f'{period[:4]}-Q{(int(period[5:7]) - 1) // 3 + 1}'
+    return period
+
+
+@timings.timed('aggregate')
+@chain_wide(merge_period_figures)
+def get_period_figures(start_date, end_date, group_by='day',
+                       by_product=False):
+    """Calculate costs, revenue and profit for each period in a range.
+
+    Parameters
+    ----------
+    start_date : str
+        The first date of the range in YYYY-MM-DD format.
+    end_date : str
+        The last date of the range in YYYY-MM-DD format.
+    group_by : str, optional
+        Either 'day' (default), 'week', 'month' or 'quarter'.
+    by_product : bool, optional
+        Whether to break down the figures of each period per product.
+
+    Returns
+    -------
+    figures : list
+        A list of dictionaries sorted by period (and product name),
+        containing the keys 'period', 'product_name' (None unless
+        by_product is True), 'sold_count', 'costs', 'revenue' and
+        'profit'. Periods without sales are left out. With ALL_STORES,
+        the figures of all stores are added up.
+    """
+    np = import_module('numpy')
+    columns = load_sales_columns(start_date, end_date)
+    if not len(columns['sell_date']):
+        return []
+
+    # Give each period (and product) an integer key, so that all
+    # figures can be summed up with a few grouped reductions.
+    periods, period_keys = np.unique(
+        get_periods(columns['sell_date'], group_by), return_inverse=True)
+    if by_product:
+        product_names, product_keys = np.unique(columns['product_name'],
+                                                return_inverse=True)
+    else:
+        product_names = np.array([None])
+        product_keys = np.zeros(len(period_keys), dtype=int)
+    keys = period_keys * len(product_names) + product_keys
+
+    groups, group_keys = np.unique(keys, return_inverse=True)
+    sold_counts = np.bincount(group_keys)
+    costs = np.bincount(group_keys, weights=columns['buy_price'])
+    revenue = np.bincount(group_keys, weights=columns['sell_price'])
+
+    figures = []
+    for index, group in enumerate(groups):
+        group_costs = round(float(costs[index]), 2)
+        group_revenue = round(float(revenue[index]), 2)
+        product_name = product_names[group % len(product_names)]
+        figures.append({
+            'period': format_period(periods[group // len(product_names)],
+                                    group_by),
+            'product_name': None if product_name is None
+            else str(product_name),
+            'sold_count': int(sold_counts[index]),
+            'costs': group_costs,
+            'revenue': group_revenue,
+            'profit': round(group_revenue - group_costs, 2),
+        })
+
+    return figures
+
+
+def display_period_report(args):
+    """Display sales, revenue, costs or profit for each period in a range.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the following fields:
+
+        * information
+        * from_date
+        * to_date
+        * group_by
+        * by_product
+        * func
+
+    Returns
+    -------
+    None : None
+        A table with the number of sold products, costs, revenue or
+        profit for each day, week, month or quarter in the range (and
+        optionally for each product) is printed to the terminal, along
+        with the total for the whole range. If nothing has been sold in
+        the range, an error message is printed instead.
+    """
+    end_date = args.to_date or read_current_date()
+    if args.from_date > end_date:
+        rprint('[bold red]ERROR[/bold red]')
+        print(f'Start date {args.from_date} is after end date {end_date}.')
+        return
+
+    figures = current_store().period_figures(args.from_date, end_date,
+                                             args.group_by, args.by_product)
+    if not figures:
+        rprint('[bold red]ERROR[/bold red]')
+        print('No sales data available.')
+        return
+
+    field, header, style = {
+        'sales': ('sold_count', 'Sold', 'steel_blue1'),
+        'costs': ('costs', 'Costs', 'red'),
+        'revenue': ('revenue', 'Revenue', 'bright_green'),
+        'profit': ('profit', 'Profit', 'green'),
+    }[args.information]
+
+    report_table = Table(title=f'{header} from {args.from_date} to '
+                         f'{end_date} by {args.group_by}')
+    report_table.add_column(args.group_by.title(), style='yellow')
+    if args.by_product:
+        report_table.add_column('Product Name', style='steel_blue1')
+    report_table.add_column(header, style=style)
+
+    for figure in figures:
+        cells = [figure['period']]
+        if args.by_product:
+            cells.append(figure['product_name'].title())
+        cells.append(str(figure[field]))
+        report_table.add_row(*cells)
+
+    total = sum(figure[field] for figure in figures)
+    if field != 'sold_count':
+        total = round(total, 2)
+    report_table.add_row('Total', *([''] if args.by_product else []),
+                         str(total))
+
+    rprint(report_table)
+
+
+def get_selected_date(args):
+    """Return the date selected by the --today, --yesterday or --date flag.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        A namespace containing the following fields:
+
+        * today
+        * yesterday
+        * date
+
+    Returns
+    -------
+    date : str
+        The selected date in YYYY-MM-DD format.
+    """
+    today = read_current_date()
+    if args.today:
+        return today
+    if args.yesterday:
+        return (datetime.strptime(today, '%Y-%m-%d')
+                - timedelta(days=1)).strftime('%Y-%m-%d')
+    return args.date
+
+
+def describe_selected_date(args, subject):
+    """Describe a subject for the date selected by the day flags.
+
+    For example, 'revenue' becomes "Today's revenue" or "Revenue for
+    2021-06-13".
+    """
+    if args.today:
+        return f"Today's {subject}"
+    if args.yesterday:
+        return f"Yesterday's {subject}"
+    return f'{subject[0].upper()}{subject[1:]} for {args.date}'
+
+
 def display_sales_data(args):
     """Display sales, revenue, costs or profit based on given day.
 
@@ -458,6 +1871,10 @@ def display_sales_data(args):
         * today
         * yesterday
         * date
+        * from_date
+        * to_date
+        * group_by
+        * by_product
         * func
 
     Returns
@@ -467,95 +1884,18 @@ def display_sales_data(args):
         given date are printed to the terminal (defaults to 0 if no
         information has been found). If the user requests sales, either
         a table displaying each sold product is printed or an error
-        message saying that no sales data is available.
+        message saying that no sales data is available. If a range of
+        dates has been given, display_period_report is used instead.
     """
-    today = open('current_date.txt').read()
-    yesterday = (datetime.strptime(today, '%Y-%m-%d')
-                 - timedelta(days=1)).strftime('%Y-%m-%d')
+    if args.from_date:
+        display_period_report(args)
+        return
 
-    if args.information == 'revenue':
-        if args.today:
-            revenue = get_revenue(today)
-            if revenue > 0:
-                rprint(f"Today's revenue: [green]+{revenue}[/green]")
-            else:
-                rprint(f"Today's revenue: [orange1]{revenue}[/orange1]")
-        elif args.yesterday:
-            revenue = get_revenue(yesterday)
-            if revenue > 0:
-                rprint(f"Yesterday's revenue: [green]+{revenue}[/green]")
-            else:
-                rprint(f"Yesterday's revenue: [orange1]{revenue}[/orange1]")
-        elif args.date:
-            revenue = get_revenue(args.date)
-            if revenue > 0:
-                rprint(f'Revenue for {args.date}: [green]+{revenue}[/green]')
-            else:
-                rprint(
-                    f'Revenue for {args.date}: [orange1]{revenue}[/orange1]')
-    elif args.information == 'costs':
-        if args.today:
-            costs = get_costs(today)
-            if costs > 0:
-                rprint(f"Today's costs of sold products: [red]+{costs}[/red]")
-            else:
-                rprint(
-                    f"Today's costs of sold products: [orange1]{costs} \
-                    [/orange1]")
-        elif args.yesterday:
-            costs = get_costs(yesterday)
-            if costs > 0:
-                rprint(
-                    f"Yesterday's costs of sold products: [red]+{costs}[/red]")
-            else:
-                rprint(
-                    f"Yesterday's costs of sold products: [orange1]{costs} \
-                    [/orange1]")
-        elif args.date:
-            costs = get_costs(args.date)
-            if costs > 0:
-                rprint(
-                    f"Costs of sold products for {args.date}: [red]+{costs} \
-                    [/red]")
-            else:
-                rprint(
-                    f"Costs of sold products for {args.date}: [orange1]{costs} \
-                    [/orange1]")
-    elif args.information == 'profit':
-        if args.today:
-            profit = get_profit(today)
-            if profit > 0:
-                rprint(f"Today's profit: [green]+{profit}[/green]")
-            elif profit < 0:
-                rprint(f"Today's profit: [red]{profit}[/red]")
-            else:
-                rprint(f"Today's profit: [orange1]{profit}[/orange1]")
-        elif args.yesterday:
-            profit = get_profit(yesterday)
-            if profit > 0:
-                rprint(f"Yesterday's profit: [green]+{profit}[/green]")
-            elif profit < 0:
-                rprint(f"Yesterday's profit: [red]{profit}[/red]")
-            else:
-                rprint(f"Yesterday's profit: [orange1]{profit}[/orange1]")
-        elif args.date:
-            profit = get_profit(args.date)
-            if profit > 0:
-                rprint(f"Profit for {args.date}: [green]+{profit}[/green]")
-            elif profit < 0:
-                rprint(f"Profit for {args.date}: [red]{profit}[/red]")
-            else:
-                rprint(f"Profit for {args.date}: [orange1]{profit}[/orange1]")
-    elif args.information == 'sales':
-        if args.today:
-            sales_table = Table(title="Today's sales")
-            sold_products = get_sold_products(today)
-        elif args.yesterday:
-            sales_table = Table(title="Yesterday's sales")
-            sold_products = get_sold_products(yesterday)
-        elif args.date:
-            sales_table = Table(title=f'Sales for {args.date}')
-            sold_products = get_sold_products(args.date)
+    date = get_selected_date(args)
+
+    if args.information == 'sales':
+        sales_table = Table(title=describe_selected_date(args, 'sales'))
+        sold_products = current_store().sales(date)
 
         sales_table.add_column('Product Name', style='steel_blue1')
         sales_table.add_column('Buy Price', style='yellow')
@@ -566,22 +1906,48 @@ def display_sales_data(args):
             # alphabetical order in the generated table.
             for sold_product in sorted(sold_products,
                                        key=lambda product:
-                                       product['product_name']):
+                                       product.product_name):
                 sales_table.add_row(
-                    sold_product['product_name'].title(),
-                    sold_product['buy_price'],
-                    sold_product['sell_price'],
+                    sold_product.product_name.title(),
+                    storage.format_price(sold_product.buy_price),
+                    storage.format_price(sold_product.sell_price),
                 )
 
             rprint(sales_table)
         else:
             rprint('[bold red]ERROR[/bold red]')
             print('No sales data available.')
+        return
+
+    figures = current_store().figures(date)
+    if args.information == 'revenue':
+        label = describe_selected_date(args, 'revenue')
+        revenue = figures['revenue']
+        if revenue > 0:
+            rprint(f'{label}: [green]+{revenue}[/green]')
+        else:
+            rprint(f'{label}: [orange1]{revenue}[/orange1]')
+    elif args.information == 'costs':
+        label = describe_selected_date(args, 'costs of sold products')
+        costs = figures['costs']
+        if costs > 0:
+            rprint(f'{label}: [red]+{costs}[/red]')
+        else:
+            rprint(f'{label}: [orange1]{costs}[/orange1]')
+    elif args.information == 'profit':
+        label = describe_selected_date(args, 'profit')
+        profit = figures['profit']
+        if profit > 0:
+            rprint(f'{label}: [green]+{profit}[/green]')
+        elif profit < 0:
+            rprint(f'{label}: [red]{profit}[/red]')
+        else:
+            rprint(f'{label}: [orange1]{profit}[/orange1]')
 
 
 # Functions related to recording and visualizing financial data
 def record_sales_data(args):
-    """Record costs, revenue and profit for given date.
+    """Record costs, revenue and profit for given date or range of dates.
 
     Parameters
     ----------
@@ -591,82 +1957,98 @@ def record_sales_data(args):
         * today
         * yesterday
         * date
+        * from_date
+        * to_date
+        * all
         * func
 
     Returns
     -------
     None : None
         A message saying that the costs, revenue and profit have been
-        recorded for the specified day is printed to the terminal.
+        recorded for the specified day, for each day in the range from
+        --from to --to or for each day on which products have been sold
+        (--all) is printed to the terminal. The figures of all dates are
+        looked up at once and stored with a single write. With
+        ALL_STORES, the figures of the whole chain are recorded in the
+        financial records outside of the store directories.
     """
-    today = open('current_date.txt').read()
-    yesterday = (datetime.strptime(today, '%Y-%m-%d')
-                 - timedelta(days=1)).strftime('%Y-%m-%d')
+    try:
+        if args.all:
+            new_records = current_store().record(all_dates=True)
+        elif args.from_date is not None:
+            new_records = current_store().record(
+                args.from_date, args.to_date or read_current_date())
+        else:
+            new_records = current_store().record(get_selected_date(args))
+    except ValueError as error:
+        print_error(error)
+        return
 
-    if args.today:
-        costs = get_costs(today)
-        revenue = get_revenue(today)
-        profit = get_profit(today)
-        new_record = {
-            'date': today,
-            'costs': costs,
-            'revenue': revenue,
-            'profit': profit,
-        }
-    elif args.yesterday:
-        costs = get_costs(yesterday)
-        revenue = get_revenue(yesterday)
-        profit = get_profit(yesterday)
-        new_record = {
-            'date': yesterday,
-            'costs': costs,
-            'revenue': revenue,
-            'profit': profit,
-        }
-    elif args.date:
-        costs = get_costs(args.date)
-        revenue = get_revenue(args.date)
-        profit = get_profit(args.date)
-        new_record = {
-            'date': args.date,
-            'costs': costs,
-            'revenue': revenue,
-            'profit': profit,
-        }
+    if not new_records:
+        rprint('[bold red]ERROR[/bold red]')
+        print('No sales data available.')
+        return
 
-    with open('financial_records.csv', newline='') as csv_file:
-        record_reader = csv.DictReader(csv_file)
-        all_records = [record for record in record_reader]
-        recorded_dates = [record['date'] for record in all_records]
-
-    # Dates that have not yet been recorded are newly added to the file
-    # and existing dates are updated with the latest values for costs,
-    # revenue and profit
-    if new_record['date'] in recorded_dates:
-        for record in all_records:
-            if record['date'] == new_record['date']:
-                record = record.update(new_record)
+    subject = 'costs, revenue and profit'
+    if ALL_STORES:
+        subject += ' of all stores'
+    rprint('[bold green]OK[/bold green]')
+    if args.all or args.from_date is not None:
+        print(f'Successfully recorded {subject} for {len(new_records)} '
+              f'dates from {new_records[0]["date"]} to '
+              f'{new_records[-1]["date"]}.')
     else:
-        all_records.append(new_record)
+        label = describe_selected_date(args, subject)
+        print(f'Successfully recorded {label[0].lower()}{label[1:]}.')
 
-    with open('financial_records.csv', 'w', newline='') as csv_file:
-        fieldnames = ['date', 'costs', 'revenue', 'profit']
-        record_writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        record_writer.writeheader()
-        for record in all_records:
-            record_writer.writerow(record)
 
-    if args.today:
-        rprint('[bold green]OK[/bold green]')
-        print("Successfully recorded today's costs, revenue and profit.")
-    elif args.yesterday:
-        rprint('[bold green]OK[/bold green]')
-        print("Successfully recorded yesterday's costs, revenue and profit.")
-    elif args.date:
-        rprint('[bold green]OK[/bold green]')
-        rprint(
-            f"Successfully recorded costs, revenue and profit for {args.date}."
-        )
+def resample_financial_records(records, group_by):
+    """Add up the costs, revenue and profit of records per period.
+
+    Parameters
+    ----------
+    records : list
+        Financial records sorted by date.
+    group_by : str
+        Either 'day', 'week' (starting on Monday), 'month' or 'quarter'.
+
+    Returns
+    -------
+    figures : tuple
+        The labels of the periods along with NumPy arrays containing
+        the costs, revenue and profit of each period.
+    """
+    np = import_module('numpy')
+    dates = np.array([record['date'] for record in records],
+                     dtype='datetime64[D]')
+    periods, period_keys = np.unique(get_periods(dates, group_by),
+                                     return_inverse=True)
+    costs, revenue, profit = (
+        np.bincount(period_keys,
+                    weights=[float(record[field]) for record in records])
+        for field in ('costs', 'revenue', 'profit'))
+
+    if group_by == 'day':
+        # Get MM-DD format for each date
+        labels = [str(period)[5:] for period in periods]
+    elif group_by == 'week':
+        labels = [str(period) for period in periods]
+    else:
+        labels = [format_period(period, group_by) for period in periods]
+    return labels, costs, revenue, profit
+
+
+def choose_group_by(records, max_points):
+    """Return the shortest period ('day', 'week', 'month' or 'quarter')
+    that shows the records in no more than max_points points."""
+    np = import_module('numpy')
+    dates = np.array([record['date'] for record in records],
+                     dtype='datetime64[D]')
+    for group_by in ('day', 'week', 'month'):
+        if len(np.unique(get_periods(dates, group_by))) <= max_points:
+            return group_by
+    return 'quarter'
 
 
 def visualize_financial_records(args):
@@ -678,36 +2060,56 @@ def visualize_financial_records(args):
         A namespace containing the following fields:
 
         * type
+        * output
+        * from_date
+        * to_date
+        * group_by
+        * max_points
         * func
 
     Returns
     -------
     None : None
         Depending on the selected type, a line or bar chart that
-        represents the data in 'financial_records.csv' is created
-        and displayed.
+        represents the recorded financial data is created and displayed,
+        or saved to the output file without opening a window. Only
+        records from from_date to to_date are shown. If there are more
+        than max_points days, the records are added up per week, month
+        or quarter, unless group_by has been given.
     """
-    with open('financial_records.csv', newline='') as csv_file:
-        record_reader = csv.DictReader(csv_file)
-        all_records = [record for record in record_reader]
-
-        # Sort all records by date to make them appear in the correct
-        # order in the generated chart
-        all_records.sort(key=lambda record: datetime.strptime(
-            record['date'],
-            '%Y-%m-%d'
-        ))
-
-        # Get MM-DD format for each date
-        dates = [record['date'][5:] for record in all_records]
-        costs = [float(record['costs']) for record in all_records]
-        revenue = [float(record['revenue'])for record in all_records]
-        profit = [float(record['profit']) for record in all_records]
-
-    x = np.arange(len(dates))
+    all_records = [
+        record for record in storage.get_storage().load_financial_records()
+        if (args.from_date is None or record['date'] >= args.from_date) and
+        (args.to_date is None or record['date'] <= args.to_date)
+    ]
+    if not all_records:
+        rprint('[bold red]ERROR[/bold red]')
+        print('No financial records found.')
+        return
+
+    # Sort all records by date to make them appear in the correct order
+    # in the generated chart
+    all_records.sort(key=lambda record: datetime.strptime(
+        record['date'],
+        '%Y-%m-%d'
+    ))
+
+    group_by = args.group_by or choose_group_by(all_records, args.max_points)
+    labels, costs, revenue, profit = resample_financial_records(all_records,
+                                                                group_by)
+
+    np = import_module('numpy')
+    if args.output:
+        # Render without a window, e.g. on a server without a display.
+        import_module('matplotlib').use('Agg')
+    plt = import_module('matplotlib.pyplot')
+
+    x = np.arange(len(labels))
     width = 0.2
 
-    plt.style.use('seaborn')
+    # The seaborn style has been renamed in Matplotlib 3.6.
+    plt.style.use('seaborn-v0_8' if 'seaborn-v0_8' in plt.style.available
+                  else 'seaborn')
     fig, ax = plt.subplots()
 
     if args.type == 'bar':
@@ -715,22 +2117,431 @@ def visualize_financial_records(args):
         ax.bar(x, revenue, width, label='Revenue', color='orange')
         ax.bar(x + width, profit, width, label='Profit', color='green')
     else:
-        ax.plot(dates, costs, label='Costs', color='cyan')
-        ax.plot(dates, revenue, label='Revenue', color='orange')
-        ax.plot(dates, profit, label='Profit', color='green')
+        ax.plot(x, costs, label='Costs', color='cyan')
+        ax.plot(x, revenue, label='Revenue', color='orange')
+        ax.plot(x, profit, label='Profit', color='green')
 
     ax.axhline(0, color='black', linewidth=0.8)
-    ax.set_title('Financial overview for each day')
+    ax.set_title(f'Financial overview for each {group_by}')
     ax.set_ylabel('Costs, revenue and profit')
-    ax.set_xlabel('Days (MM-DD)')
-    ax.set_xticks(x)
-    ax.set_xticklabels(dates)
+    ax.set_xlabel({
+        'day': 'Days (MM-DD)',
+        'week': 'Weeks (starting on Monday)',
+        'month': 'Months',
+        'quarter': 'Quarters',
+    }[group_by])
+    # Label no more than 20 ticks, so that the labels stay readable.
+    step = -(-len(labels) // 20)
+    ax.set_xticks(x[::step])
+    ax.set_xticklabels(labels[::step])
     ax.legend()
 
     fig.tight_layout()
     fig.autofmt_xdate()
 
+    if args.output:
+        fig.savefig(args.output)
+        plt.close(fig)
+        rprint('[bold green]OK[/bold green]')
+        print(f'Successfully saved chart to {args.output}.')
+        return
+
     rprint('[bold green]OK[/bold green]')
     print('Successfully created chart.')
 
     plt.show()
+
+
+# In-process API
+_selected_store = {'store': None}
+# The functions of this module work on the store and backend selected
+# in the storage module, so stores used by several threads take turns.
+_store_lock = threading.RLock()
+
+
+def date_text(date):
+    """Return a date, datetime or text in YYYY-MM-DD format, or None."""
+    if date is None or isinstance(date, str):
+        return date
+    return date.strftime('%Y-%m-%d')
+
+
+class Store:
+    """A store whose products and records stay loaded between calls.
+
+    The methods offer the operations of the commands, but return data
+    instead of printing it, e.g.:
+
+        store = Store('north')
+        store.buy('apple', 0.5, expiration_date='2024-02-01', quantity=10)
+        store.sell('apple', 1.2)
+        store.profit()
+
+    Each store has a storage backend of its own, which keeps the
+    products, the stock index and the daily totals in memory, and only
+    reads them again once their files have been changed by someone
+    else. Stores can be used from several threads, which call their
+    methods one at a time.
+
+    Parameters
+    ----------
+    name : str, optional
+        The name of a store of a chain, whose files are kept in
+        'stores/NAME', or None (default) for the files in directory.
+    storage_name : str, optional
+        The name of one of the backends in storage.BACKENDS (defaults
+        to the SUPERPY_STORAGE environment variable or 'csv').
+    directory : str, optional
+        The directory holding 'current_date.txt' and the files of all
+        stores (defaults to the working directory).
+    """
+
+    def __init__(self, name=None, storage_name=None, directory=''):
+        self.name = name
+        self.storage_name = storage_name or \
+            os.environ.get('SUPERPY_STORAGE', 'csv')
+        self.directory = directory
+        with _store_lock:
+            previous_selection = storage.get_selection()
+            try:
+                storage.set_store(name, directory)
+                storage.set_storage(self.storage_name)
+                self.storage = storage.get_storage()
+                self._selection = storage.get_selection()
+                self.create_files()
+            finally:
+                storage.set_selection(previous_selection)
+
+    def __repr__(self):
+        return f'Store({self.name!r}, {self.storage_name!r}, ' \
+            f'{self.directory!r})'
+
+    def select(self):
+        """Make the functions of this module use the files and storage
+        backend of the store from now on, e.g. for a command.
+
+        Returns
+        -------
+        product_storage : storage.CsvStorage or storage.SqliteStorage
+            The storage backend of the store.
+        """
+        with _store_lock:
+            storage.set_selection(self._selection)
+            _selected_store['store'] = self
+        return self.storage
+
+    @contextlib.contextmanager
+    def selected(self):
+        """Make the functions of this module use the files and storage
+        backend of the store until the block exits, without changing the
+        selection of other code.
+
+        Yields
+        ------
+        product_storage : storage.CsvStorage or storage.SqliteStorage
+            The storage backend of the store.
+        """
+        with _store_lock:
+            previous_selection = storage.get_selection()
+            storage.set_selection(self._selection)
+            try:
+                yield self.storage
+            finally:
+                storage.set_selection(previous_selection)
+
+    def create_files(self):
+        """Create the current date (today) and the csv files of the store
+        if they do not exist yet."""
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        with self.selected():
+            filename = storage.root_path(CURRENT_DATE_FILENAME)
+            if not os.path.exists(filename):
+                with open(filename, 'w') as text_file:
+                    text_file.write(datetime.today().strftime('%Y-%m-%d'))
+            for filename, fieldnames in (
+                    (storage.CsvStorage.products_filename,
+                     storage.PRODUCT_FIELDNAMES),
+                    (storage.CsvStorage.financial_records_filename,
+                     storage.FINANCIAL_RECORD_FIELDNAMES)):
+                filename = storage.data_path(filename)
+                if not os.path.exists(filename):
+                    with open(filename, 'w', newline='') as csv_file:
+                        csv.writer(csv_file).writerow(fieldnames)
+
+    def date(self):
+        """Return the current date in YYYY-MM-DD format."""
+        with self.selected():
+            return read_current_date()
+
+    def buy(self, product_name, price, expiration_date=None, quantity=1):
+        """Buy products on the current date and add them to the inventory.
+
+        Parameters
+        ----------
+        product_name : str
+            The name of the product.
+        price : float
+            The buy price of each product.
+        expiration_date : str or datetime.date, optional
+            The expiration date (as text in YYYY-MM-DD format), or None
+            (default) for non-expiring products.
+        quantity : int, optional
+            The number of products to buy (defaults to 1).
+
+        Returns
+        -------
+        products : list
+            The storage.Product records that have been added.
+
+        Raises
+        ------
+        ValueError
+            If any of the values is invalid.
+        """
+        return self.add_purchases([parse_purchase({
+            'product_name': product_name,
+            'price': price,
+            'expiration_date': date_text(expiration_date),
+            'quantity': quantity,
+        })])
+
+    def buy_many(self, rows):
+        """Buy the products of several purchases with a single write.
+
+        Parameters
+        ----------
+        rows : list
+            A dictionary for each purchase with the fields accepted by
+            parse_purchase.
+
+        Returns
+        -------
+        products : list
+            The storage.Product records that have been added.
+
+        Raises
+        ------
+        ValueError
+            If any of the purchases is invalid, in which case nothing is
+            stored.
+        """
+        purchases = []
+        for index, row in enumerate(rows):
+            if isinstance(row, dict):
+                row = dict(row, expiration_date=date_text(
+                    row.get('expiration_date')))
+            else:
+                row = None
+            try:
+                purchases.append(parse_purchase(row))
+            except ValueError as error:
+                raise ValueError(f'item {index}: {error}')
+        return self.add_purchases(purchases)
+
+    def add_purchases(self, purchases):
+        """Add the products of purchases returned by parse_purchase to the
+        inventory with a single write, and return them."""
+        with self.selected() as product_storage:
+            buy_date = storage.parse_date(read_current_date())
+            products = [storage.Product(
+                str(uuid4()),
+                purchase['product_name'],
+                buy_date,
+                storage.to_cents(purchase['buy_price']),
+                storage.parse_date(purchase['expiration_date']),
+            ) for purchase in purchases for _ in range(purchase['quantity'])]
+            product_storage.add_products(products)
+        return products
+
+    def sell(self, product_name, price):
+        """Sell the product with a name that expires first.
+
+        Parameters
+        ----------
+        product_name : str
+            The name of the product.
+        price : float
+            The sell price of the product.
+
+        Returns
+        -------
+        product : storage.Product or None
+            The product that has been sold on the current date, or None
+            if it is expired or not in stock.
+
+        Raises
+        ------
+        ValueError
+            If the name or price is invalid.
+        """
+        sale = parse_sale({'product_name': product_name, 'price': price})
+        # Hold the lock from finding the product until it has been
+        # stored, so that no other process can sell the same product in
+        # between.
+        with self.selected(), storage.lock_files():
+            _, (product,) = sell_in_stock([sale], sale['product_name'])
+        return product
+
+    def sell_many(self, sales):
+        """Sell several products with a single write.
+
+        Parameters
+        ----------
+        sales : list
+            A pair of a product name and a sell price for each sale.
+
+        Returns
+        -------
+        products : list
+            The product sold by each sale, or None for each sale of a
+            product that is expired or not in stock.
+
+        Raises
+        ------
+        ValueError
+            If any of the names or prices is invalid, in which case
+            nothing is sold.
+        """
+        parsed_sales = []
+        for index, (product_name, price) in enumerate(sales):
+            try:
+                parsed_sales.append(parse_sale({'product_name': product_name,
+                                                'price': price}))
+            except ValueError as error:
+                raise ValueError(f'item {index}: {error}')
+        with self.selected(), storage.lock_files():
+            _, products = sell_in_stock(parsed_sales)
+        return products
+
+    def inventory(self, name=None, count=False, offset=0, limit=None):
+        """Return the products in stock on the current date.
+
+        Parameters
+        ----------
+        name : str, optional
+            Only return products whose name contains this text (ignoring
+            case).
+        count : bool, optional
+            Whether to return the number of products of each name
+            instead of the products themselves.
+        offset : int, optional
+            The number of products (or product names) to skip.
+        limit : int, optional
+            The largest number of products (or product names) to return.
+
+        Returns
+        -------
+        products : list
+            The storage.Product records in stock, or tuples of a product
+            name and its count sorted by name.
+        """
+        with self.selected():
+            current_date = read_current_date()
+            if count:
+                stop = None if limit is None else offset + limit
+                return count_products_in_stock(current_date,
+                                               name)[offset:stop]
+            return list(iter_products_in_stock(current_date, name, offset,
+                                               limit))
+
+    def sales(self, date=None):
+        """Return the products sold on a date (defaults to the current
+        date)."""
+        with self.selected():
+            return get_sold_products(date_text(date) or read_current_date())
+
+    def figures(self, date=None):
+        """Return the costs, revenue, profit and number of sold products
+        ('sold_count') of a date (defaults to the current date)."""
+        with self.selected():
+            date = date_text(date) or read_current_date()
+            return get_financial_figures([date])[date]
+
+    def costs(self, date=None):
+        """Return the costs of the products sold on a date (defaults to
+        the current date)."""
+        return self.figures(date)['costs']
+
+    def revenue(self, date=None):
+        """Return the revenue made on a date (defaults to the current
+        date)."""
+        return self.figures(date)['revenue']
+
+    def profit(self, date=None):
+        """Return the profit made on a date (defaults to the current
+        date)."""
+        return self.figures(date)['profit']
+
+    def period_figures(self, start_date, end_date=None, group_by='day',
+                       by_product=False):
+        """Return the figures of each period in a range of dates, as
+        described in get_period_figures. The range ends on the current
+        date unless end_date is given."""
+        with self.selected():
+            return get_period_figures(
+                date_text(start_date),
+                date_text(end_date) or read_current_date(), group_by,
+                by_product)
+
+    def record(self, date=None, end_date=None, all_dates=False):
+        """Record costs, revenue and profit in the financial records.
+
+        Parameters
+        ----------
+        date : str or datetime.date, optional
+            The date to record (defaults to the current date), or the
+            first date of a range.
+        end_date : str or datetime.date, optional
+            The last date of the range to record.
+        all_dates : bool, optional
+            Whether to record every date on which products have been
+            sold instead.
+
+        Returns
+        -------
+        records : list
+            The records that have been stored, sorted by date. The
+            figures of all dates are looked up at once and stored with a
+            single write.
+
+        Raises
+        ------
+        ValueError
+            If the range ends before it starts.
+        """
+        with self.selected() as product_storage:
+            if all_dates:
+                dates = None
+            else:
+                date = date_text(date) or read_current_date()
+                end_date = date_text(end_date) or date
+                if date > end_date:
+                    raise ValueError(f'start date {date} is after end date '
+                                     f'{end_date}')
+                first_day = datetime.strptime(date, '%Y-%m-%d')
+                dates = [(first_day + timedelta(days=offset)).strftime(
+                    '%Y-%m-%d') for offset in range((datetime.strptime(
+                        end_date, '%Y-%m-%d') - first_day).days + 1)]
+
+            # Keep sales from being stored while the figures are being
+            # recorded.
+            with storage.lock_files():
+                records = [{
+                    'date': date,
+                    'costs': figures['costs'],
+                    'revenue': figures['revenue'],
+                    'profit': figures['profit'],
+                } for date, figures in sorted(
+                    get_financial_figures(dates).items())]
+                if records:
+                    product_storage.save_financial_records(records)
+        return records
+
+
+def current_store():
+    """Return the Store selected most recently, e.g. by super.py, or the
+    files in the working directory if none has been selected yet."""
+    if _selected_store['store'] is None:
+        Store().select()
+    return _selected_store['store']
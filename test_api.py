@@ -0,0 +1,294 @@
+"""
+Tests of the HTTP/JSON API in api.py, which is served on an ephemeral
+port of 127.0.0.1 with the files of a temporary directory.
+"""
+
+# Imports
+import api
+import asyncio
+import http.client
+import json
+import pytest
+import queue
+import socket
+import superpy as sp
+import threading
+
+CURRENT_DATE = '2024-01-10'
+
+
+@pytest.fixture
+def port(tmp_path):
+    """Serve the API for a new store and return the port it listens on."""
+    sp.Store(directory=str(tmp_path)).select()
+    with open(tmp_path / sp.CURRENT_DATE_FILENAME, 'w') as text_file:
+        text_file.write(CURRENT_DATE)
+
+    ports = queue.Queue()
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(api.run_server('127.0.0.1', 0, ports.put))
+
+    def serve():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        yield ports.get(timeout=10)
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join(timeout=10)
+        loop.close()
+
+
+@pytest.fixture
+def connection(port):
+    """Return a keep-alive HTTP connection to the API."""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    yield connection
+    connection.close()
+
+
+def request(connection, method, target, body=None):
+    """Send a request and return the status and decoded response."""
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    connection.request(method, target, body=body)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def send_raw(port, data):
+    """Send raw bytes on a new connection and return the whole reply."""
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as client:
+        client.sendall(data)
+        reply = b''
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                return reply
+            reply += chunk
+
+
+def test_date(connection):
+    assert request(connection, 'GET', '/date') == \
+        (200, {'date': CURRENT_DATE})
+
+
+def test_buy_single_and_batch(connection):
+    assert request(connection, 'POST', '/buy', {
+        'product_name': 'apple', 'price': 0.5,
+        'expiration_date': '2024-02-01', 'quantity': 3,
+    }) == (201, {'added': 3})
+    assert request(connection, 'POST', '/buy', [
+        {'product_name': 'pear', 'price': 0.75},
+        {'product_name': 'apple', 'price': 0.25},
+    ]) == (201, {'added': 2})
+
+    status, response = request(connection, 'GET', '/inventory?count=1')
+    assert status == 200
+    assert response['products'] == [
+        {'product_name': 'apple', 'count': 4},
+        {'product_name': 'pear', 'count': 1},
+    ]
+
+
+def test_buy_rejects_invalid_item(connection):
+    status, response = request(connection, 'POST', '/buy', [
+        {'product_name': 'apple', 'price': 0.5},
+        {'product_name': 'pear', 'price': 'free'},
+    ])
+    assert status == 400
+    assert response['error'].startswith('item 1:')
+    # Nothing is stored if any of the purchases is invalid.
+    assert request(connection, 'GET', '/inventory')[1]['products'] == []
+
+
+def test_non_finite_prices(connection):
+    status, response = request(connection, 'POST', '/buy',
+                               b'{"product_name": "apple", "price": NaN}')
+    assert (status, response) == (400, {'error': "item 0: invalid price nan"})
+    status, response = request(connection, 'POST', '/sell', b'{"product_name'
+                               b'": "apple", "price": Infinity}')
+    assert (status, response) == (400, {'error': 'invalid price inf'})
+
+
+def test_sell_single(connection):
+    request(connection, 'POST', '/buy', {'product_name': 'apple',
+                                         'price': 0.5})
+    assert request(connection, 'POST', '/sell', {
+        'product_name': 'apple', 'price': 1.25,
+    }) == (200, {
+        'sold': [{'product_name': 'apple', 'buy_price': 0.5,
+                  'sell_price': 1.25}],
+        'errors': [],
+    })
+
+    status, response = request(connection, 'POST', '/sell', {
+        'product_name': 'apple', 'price': 1.25,
+    })
+    assert status == 409
+    assert response['sold'] == []
+    assert response['errors'] == [{
+        'index': 0, 'error': 'apple is expired or is not in stock',
+    }]
+
+
+def test_sell_batch_with_partial_errors(connection):
+    request(connection, 'POST', '/buy', {'product_name': 'apple',
+                                         'price': 0.5, 'quantity': 2})
+    status, response = request(connection, 'POST', '/sell', [
+        {'product_name': 'apple', 'price': 1},
+        {'product_name': 'pear', 'price': 1},
+        {'product_name': 'apple'},
+        {'product_name': 'apple', 'price': 2},
+        {'product_name': 'apple', 'price': 3},
+    ])
+    assert status == 200
+    assert [product['sell_price'] for product in response['sold']] == \
+        [1.0, 2.0]
+    assert [error['index'] for error in response['errors']] == [1, 2, 4]
+    assert response['errors'][0]['error'] == \
+        'pear is expired or is not in stock'
+
+
+def test_inventory_offset_and_limit(connection):
+    request(connection, 'POST', '/buy', [
+        {'product_name': name, 'price': 1}
+        for name in ('cheese', 'apple', 'bread', 'apple')
+    ])
+
+    status, response = request(connection, 'GET', '/inventory')
+    assert status == 200
+    assert response['date'] == CURRENT_DATE
+    assert [product['product_name'] for product in response['products']] \
+        == ['apple', 'apple', 'bread', 'cheese']
+    assert response['products'][0] == {
+        'product_name': 'apple', 'buy_price': 1.0,
+        'expiration_date': None, 'expired': False,
+    }
+
+    response = request(connection, 'GET',
+                       '/inventory?offset=1&limit=2')[1]
+    assert [product['product_name'] for product in response['products']] \
+        == ['apple', 'bread']
+    response = request(connection, 'GET',
+                       '/inventory?count=1&offset=1&limit=1')[1]
+    assert response['products'] == [{'product_name': 'bread', 'count': 1}]
+    response = request(connection, 'GET', '/inventory?name=CHE')[1]
+    assert [product['product_name'] for product in response['products']] \
+        == ['cheese']
+
+    assert request(connection, 'GET', '/inventory?limit=x')[0] == 400
+    assert request(connection, 'GET', '/inventory?offset=-1')[0] == 400
+
+
+def test_report_date_and_range(connection):
+    request(connection, 'POST', '/buy', {'product_name': 'apple',
+                                         'price': 0.5, 'quantity': 3})
+    request(connection, 'POST', '/sell', [
+        {'product_name': 'apple', 'price': 1.5},
+        {'product_name': 'apple', 'price': 2},
+    ])
+
+    assert request(connection, 'GET', '/report?information=revenue') == \
+        (200, {'date': CURRENT_DATE, 'revenue': 3.5})
+    assert request(connection, 'GET', '/report?information=profit&date='
+                   f'{CURRENT_DATE}') == \
+        (200, {'date': CURRENT_DATE, 'profit': 2.5})
+    assert request(connection, 'GET',
+                   '/report?information=costs&date=yesterday') == \
+        (200, {'date': '2024-01-09', 'costs': 0})
+    status, response = request(connection, 'GET',
+                               '/report?information=sales')
+    assert status == 200
+    assert [product['sell_price'] for product in response['sales']] == \
+        [1.5, 2.0]
+
+    status, response = request(
+        connection, 'GET',
+        '/report?information=revenue&from=2024-01-09&to=2024-01-10')
+    assert status == 200
+    assert response['from'] == '2024-01-09'
+    assert response['to'] == CURRENT_DATE
+    assert response['group_by'] == 'day'
+    assert response['total'] == 3.5
+    assert [(figures['period'], figures['revenue'])
+            for figures in response['figures']] == [(CURRENT_DATE, 3.5)]
+    status, response = request(
+        connection, 'GET', '/report?information=sales&from=2024-01-01'
+        '&group_by=month')
+    assert status == 200
+    assert response['total'] == 2
+
+
+def test_report_rejects_invalid_query(connection):
+    assert request(connection, 'GET', '/report')[0] == 400
+    assert request(connection, 'GET',
+                   '/report?information=profit&date=10-01-2024')[0] == 400
+    assert request(connection, 'GET', '/report?information=profit'
+                   '&from=2024-01-10&to=2024-01-01')[0] == 400
+    assert request(connection, 'GET', '/report?information=profit'
+                   '&from=2024-01-01&group_by=year')[0] == 400
+
+
+def test_invalid_body(connection):
+    status, response = request(connection, 'POST', '/buy', b'{not json')
+    assert (status, response) == (400, {'error': 'body is not valid JSON'})
+    assert request(connection, 'POST', '/buy', [])[0] == 400
+    assert request(connection, 'POST', '/sell', {'price': 1})[0] == 400
+
+
+def test_unknown_path_and_method(connection):
+    assert request(connection, 'GET', '/unknown') == \
+        (404, {'error': 'unknown path /unknown'})
+    assert request(connection, 'GET', '/buy') == \
+        (405, {'error': '/buy only accepts POST'})
+    assert request(connection, 'POST', '/inventory', {})[0] == 405
+
+
+def test_malformed_request(port):
+    reply = send_raw(port, b'NONSENSE\r\n\r\n')
+    assert reply.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+    assert b'Connection: close\r\n' in reply
+    reply = send_raw(port, b'POST /buy HTTP/1.1\r\n'
+                     b'Content-Length: many\r\n\r\n')
+    assert reply.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+
+
+def test_body_too_large(port):
+    # The request is rejected before reading a single byte of the body.
+    reply = send_raw(port, b'POST /buy HTTP/1.1\r\nContent-Length: '
+                     + str(api.MAX_BODY_BYTES + 1).encode() + b'\r\n\r\n')
+    assert reply.startswith(b'HTTP/1.1 413 Payload Too Large\r\n')
+    assert reply.endswith(b'{"error": "request body too large"}')
+
+
+def test_keep_alive(connection):
+    request(connection, 'GET', '/date')
+    client_socket = connection.sock
+    for target in ('/date', '/unknown', '/inventory'):
+        request(connection, 'GET', target)
+        # The connection is reused instead of being reopened.
+        assert connection.sock is client_socket
+
+
+def test_connection_close(port):
+    reply = send_raw(port, b'GET /date HTTP/1.1\r\n'
+                     b'Connection: close\r\n\r\n')
+    assert b'Connection: close\r\n' in reply
+    assert reply.endswith(json.dumps({'date': CURRENT_DATE}).encode())
+    # HTTP/1.0 only keeps the connection open when asked to.
+    reply = send_raw(port, b'GET /date HTTP/1.0\r\n\r\n')
+    assert reply.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert b'Connection: close\r\n' in reply
+
+
+def test_pipelined_requests(port):
+    reply = send_raw(port, b'GET /date HTTP/1.1\r\n\r\n'
+                     b'GET /date HTTP/1.1\r\nConnection: close\r\n\r\n')
+    assert reply.count(b'HTTP/1.1 200 OK\r\n') == 2
+    assert b'Connection: keep-alive\r\n' in reply
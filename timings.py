@@ -0,0 +1,165 @@
+"""
+This module contains the instrumentation of the SuperPy commandline
+tool. Once started, it keeps track of the following for one command:
+- the wall time spent in each phase, e.g. reading files, checking stock
+  or rendering tables (time spent in a nested phase only counts towards
+  that phase)
+- the number of rows scanned
+- the number of bytes read from and written to the files of SuperPy
+- the peak memory of the process
+While it has not been started, none of this is measured, so that
+commands do not pay for it.
+"""
+
+# Imports
+import functools
+import os
+import sys
+import time
+
+PHASES = [
+    'imports',
+    'parse arguments',
+    'read',
+    'stock checks',
+    'aggregate',
+    'render',
+    'write',
+    'other',
+]
+ENABLED = False
+_state = {
+    'start': None,
+    'phases': {},
+    'counters': {},
+    # Each entry is the name of a phase along with the time it has
+    # been (re)started at.
+    'stack': [],
+}
+
+
+def start(measured_phases=None):
+    """Start measuring a command from scratch.
+
+    Parameters
+    ----------
+    measured_phases : dict, optional
+        Seconds that have already been spent on some phases before
+        measuring started, e.g. {'imports': 0.02}. They are included
+        in the total wall time.
+    """
+    global ENABLED
+    ENABLED = True
+    measured_phases = measured_phases or {}
+    _state['phases'] = dict.fromkeys(PHASES, 0.0)
+    _state['phases'].update(measured_phases)
+    _state['start'] = time.perf_counter() - sum(measured_phases.values())
+    _state['counters'] = {'rows_scanned': 0, 'bytes_read': 0,
+                          'bytes_written': 0}
+    _state['stack'] = [['other', time.perf_counter()]]
+
+
+def stop():
+    """Stop measuring and return the results.
+
+    Returns
+    -------
+    results : dict
+        The total wall time and the wall time of each phase in seconds,
+        the number of rows scanned, the number of bytes read and
+        written and the peak memory of the process in kilobytes (None
+        if it cannot be determined on this platform).
+    """
+    global ENABLED
+    now = time.perf_counter()
+    name, started = _state['stack'][-1]
+    _state['phases'][name] += now - started
+    ENABLED = False
+    return {
+        'total_seconds': now - _state['start'],
+        'phases': dict(_state['phases']),
+        **_state['counters'],
+        'peak_memory_kb': get_peak_memory(),
+    }
+
+
+def enter(name):
+    """Pause the current phase and start the phase with the given name."""
+    now = time.perf_counter()
+    current = _state['stack'][-1]
+    _state['phases'][current[0]] += now - current[1]
+    _state['stack'].append([name, now])
+
+
+def leave():
+    """End the current phase and resume the phase it interrupted."""
+    now = time.perf_counter()
+    name, started = _state['stack'].pop()
+    _state['phases'][name] = _state['phases'].get(name, 0.0) + now - started
+    _state['stack'][-1][1] = now
+
+
+def count(name, amount=1):
+    """Add to a counter, e.g. count('rows_scanned', len(products))."""
+    if ENABLED:
+        _state['counters'][name] += amount
+
+
+def count_file(name, filename):
+    """Add the size of a file to the 'bytes_read' or 'bytes_written'
+    counter."""
+    if ENABLED and os.path.exists(filename):
+        _state['counters'][name] += os.path.getsize(filename)
+
+
+def timed(name):
+    """Decorate a function, so that the time spent in it is attributed
+    to the phase with the given name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                leave()
+        return wrapper
+    return decorator
+
+
+def get_peak_memory():
+    """Return the peak resident memory of this process in kilobytes."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere.
+    return peak_memory // 1024 if sys.platform == 'darwin' else peak_memory
+
+
+def format_size(size):
+    """Format a number of bytes, e.g. 1536 becomes '1.5 KB'."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f} {unit}' if unit == 'B' \
+                else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+def format_summary(results):
+    """Return the results returned by stop as a readable summary."""
+    lines = [f'Timings (total {results["total_seconds"] * 1000:.1f} ms):']
+    for name, seconds in results['phases'].items():
+        if seconds:
+            lines.append(f'  {name:<16} {seconds * 1000:9.1f} ms '
+                         f'({seconds / results["total_seconds"]:6.1%})')
+    lines.append(f'Rows scanned: {results["rows_scanned"]}')
+    lines.append(f'Bytes read: {format_size(results["bytes_read"])}, '
+                 f'written: {format_size(results["bytes_written"])}')
+    if results['peak_memory_kb'] is not None:
+        lines.append('Peak memory: '
+                     f'{format_size(results["peak_memory_kb"] * 1024)}')
+    return '\n'.join(lines)